@@ -1,6 +1,8 @@
 import os.path
+from functools import lru_cache
 
 import morecantile
+import numpy as np
 from pyproj import CRS
 
 CUSTOM_TMS = {
@@ -13,17 +15,144 @@ CUSTOM_TMS = {
         'extent_crs': CRS.from_epsg(4326)}
 }
 
+MAX_ZOOM = 24
 
+
+@lru_cache(maxsize=32)
 def load_tms(output_crs, tilesize):
+    """TMS выходной СК с тайлами tilesize×tilesize; определения кэшируются на процесс (CUSTOM_TMS не изменяется)."""
     if output_crs in CUSTOM_TMS:
-        tms_params = CUSTOM_TMS[output_crs]
-        tms_params['tile_width'] = tilesize
-        tms_params['tile_height'] = tilesize
-        tms = morecantile.TileMatrixSet.custom(**tms_params)
+        tms_params = dict(CUSTOM_TMS[output_crs])
     else:
         tms_params = {'extent': list(CRS.from_user_input(output_crs).area_of_use.bounds),
-                      'crs': CRS.from_user_input(output_crs), 'extent_crs': CRS.from_epsg(4326),
-                      'tile_width': tilesize,
-                      'tile_height': tilesize}
-        tms = morecantile.TileMatrixSet.custom(**tms_params)
-    return tms
+                      'crs': CRS.from_user_input(output_crs), 'extent_crs': CRS.from_epsg(4326)}
+    tms_params['tile_width'] = tilesize
+    tms_params['tile_height'] = tilesize
+    return morecantile.TileMatrixSet.custom(**tms_params)
+
+
+class TileGrid:
+    """Геометрия матриц тайлов TMS по уровням увеличения в виде массивов NumPy (индекс — уровень увеличения).
+
+    Охваты тайлов вычисляются арифметикой над массивами, номера тайлов перечисляются по размерам матриц самого
+    TMS (а не сетки Web Mercator), поэтому подходят для любой выходной СК.
+    """
+
+    def __init__(self, tms, max_zoom=MAX_ZOOM):
+        self.tms = tms
+        matrices = [tms.matrix(z) for z in range(max_zoom + 1)]
+        # Матрицы с переменной шириной (coalesce) не описываются одним шагом по X
+        self.regular = all(matrix.variableMatrixWidths is None for matrix in matrices)
+        origins = np.array([tuple(tms._matrix_origin(matrix)) for matrix in matrices], dtype='float64')
+        self.origin_x = origins[:, 0]
+        self.origin_y = origins[:, 1]
+        self.span_x = np.array([matrix.cellSize * matrix.tileWidth for matrix in matrices], dtype='float64')
+        self.span_y = np.array([matrix.cellSize * matrix.tileHeight for matrix in matrices], dtype='float64')
+        self.matrix_width = np.array([matrix.matrixWidth for matrix in matrices], dtype='int64')
+        self.matrix_height = np.array([matrix.matrixHeight for matrix in matrices], dtype='int64')
+        self.top_left = np.array([matrix.cornerOfOrigin == 'topLeft' for matrix in matrices])
+
+    def bounds(self, z, x, y):
+        """Охват тайла (left, bottom, right, top) в СК TMS."""
+        if not self.regular:
+            return tuple(self.tms.xy_bounds(x, y, z))
+        left = self.origin_x[z] + x * self.span_x[z]
+        if self.top_left[z]:
+            top = self.origin_y[z] - y * self.span_y[z]
+            bottom = top - self.span_y[z]
+        else:
+            bottom = self.origin_y[z] + y * self.span_y[z]
+            top = bottom + self.span_y[z]
+        return float(left), float(bottom), float(left + self.span_x[z]), float(top)
+
+    def bounds_array(self, z, x, y):
+        """Охваты тайлов по массивам номеров z, x, y: массив формы (N, 4) — left, bottom, right, top."""
+        z, x, y = np.asarray(z), np.asarray(x), np.asarray(y)
+        if not self.regular:
+            return np.array([tuple(self.tms.xy_bounds(int(tx), int(ty), int(tz)))
+                             for tz, tx, ty in zip(z, x, y)], dtype='float64').reshape(-1, 4)
+        left = self.origin_x[z] + x * self.span_x[z]
+        offset_y = np.where(self.top_left[z], -y, y) * self.span_y[z]
+        edge_y = self.origin_y[z] + offset_y
+        other_edge_y = edge_y + np.where(self.top_left[z], -1, 1) * self.span_y[z]
+        return np.column_stack([left, np.minimum(edge_y, other_edge_y), left + self.span_x[z],
+                                np.maximum(edge_y, other_edge_y)])
+
+    def tile_index(self, zooms):
+        """Индекс всех тайлов уровней zooms (см. TileIndex)."""
+        tile_zs, tile_xs, tile_ys = self.tiles(zooms)
+        if not self.regular:
+            return TileIndex(tile_zs, tile_xs, tile_ys, self.bounds_array(tile_zs, tile_xs, tile_ys))
+        # Охваты строятся по столбцам и строкам каждой матрицы, без индексации массивов уровней по каждому тайлу
+        bounds = np.empty((len(tile_zs), 4), dtype='float64')
+        start = 0
+        for z in zooms:
+            width, height = int(self.matrix_width[z]), int(self.matrix_height[z])
+            stop = start + width * height
+            lefts = self.origin_x[z] + np.arange(width + 1) * self.span_x[z]
+            edges_y = self.origin_y[z] + np.arange(height + 1) * (-self.span_y[z] if self.top_left[z] else self.span_y[z])
+            bottoms, tops = np.minimum(edges_y[:-1], edges_y[1:]), np.maximum(edges_y[:-1], edges_y[1:])
+            zoom_bounds = bounds[start:stop].reshape(height, width, 4)
+            zoom_bounds[:, :, 0] = lefts[:-1]
+            zoom_bounds[:, :, 1] = bottoms[:, None]
+            zoom_bounds[:, :, 2] = lefts[1:]
+            zoom_bounds[:, :, 3] = tops[:, None]
+            start = stop
+        return TileIndex(tile_zs, tile_xs, tile_ys, bounds)
+
+    def tiles(self, zooms):
+        """Все тайлы матриц TMS уровней zooms: массивы номеров (z, x, y), на каждом уровне — по строкам."""
+        zs, xs, ys = [], [], []
+        for z in zooms:
+            width, height = int(self.matrix_width[z]), int(self.matrix_height[z])
+            zs.append(np.full(width * height, z, dtype='int64'))
+            xs.append(np.tile(np.arange(width, dtype='int64'), height))
+            ys.append(np.repeat(np.arange(height, dtype='int64'), width))
+        if not zs:
+            return (np.empty(0, dtype='int64'),) * 3
+        return np.concatenate(zs), np.concatenate(xs), np.concatenate(ys)
+
+
+class TileIndex:
+    """Номера тайлов (массивы z, x, y) и их охваты в СК TMS (массив формы (N, 4)); строка индекса — тайл."""
+
+    def __init__(self, z, x, y, bounds):
+        self.z = z
+        self.x = x
+        self.y = y
+        self.bounds = bounds
+
+    def __len__(self):
+        return len(self.z)
+
+    def select(self, rows):
+        """Подмножество индекса по булевой маске или номерам строк."""
+        return TileIndex(self.z[rows], self.x[rows], self.y[rows], self.bounds[rows])
+
+    def source_windows(self, transform):
+        """Окна тайлов в пикселях растра той же СК с геотрансформацией transform.
+
+        Возвращает массив формы (N, 4) — col_off, row_off, width, height — или None для повёрнутых
+        геотрансформаций. Окна тайлов вне растра не отбрасываются (проверяются при чтении по размерам растра).
+        """
+        a, b, c, d, e, f = tuple(transform)[:6]
+        if b or d:
+            return None
+        windows = np.empty(self.bounds.shape, dtype='float64')
+        # col_off, row_off — от левого верхнего угла тайла (для геотрансформаций с a < 0 или e > 0 — от правого
+        # или нижнего края)
+        np.subtract(self.bounds[:, 0 if a > 0 else 2], c, out=windows[:, 0])
+        windows[:, 0] /= a
+        np.subtract(self.bounds[:, 3 if e < 0 else 1], f, out=windows[:, 1])
+        windows[:, 1] /= e
+        np.subtract(self.bounds[:, 2], self.bounds[:, 0], out=windows[:, 2])
+        windows[:, 2] /= abs(a)
+        np.subtract(self.bounds[:, 3], self.bounds[:, 1], out=windows[:, 3])
+        windows[:, 3] /= abs(e)
+        return windows
+
+
+@lru_cache(maxsize=32)
+def load_tile_grid(output_crs, tilesize):
+    """Геометрия матриц тайлов TMS (см. TileGrid), кэшируемая на процесс."""
+    return TileGrid(load_tms(output_crs, tilesize))
@@ -0,0 +1,807 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from click import UsageError, echo
+from pyproj import CRS
+
+from grib_tiler.data.tms import load_tms, load_tile_grid
+from grib_tiler.tasks import RenderTileTask
+from grib_tiler.tasks.executors import extract_band, warp_band, scale_band_to_byte, concatenate_bands, \
+    vrt_to_raster, timed_render_batch, band_isolines, \
+    tile_encoder_options, calculate_band_minmax, apply_cutline_mask, publish_tiling_source, RGB24_MAX_VALUE
+from grib_tiler.tasks.warp_maps import grid_signature, unpublish_warp_source
+from grib_tiler.utils import get_rfc3339nano_time
+from grib_tiler.utils.catalogue import load_band_catalogue, parse_band_selection, select_bands
+from grib_tiler.utils.colormap import load_colormap, band_colormap, scale_meta, band_palette, palette_ramp
+from grib_tiler.utils.cutline import load_cutline, tiles_intersecting
+from grib_tiler.utils.grib_index import band_message_ranges
+from grib_tiler.utils.intermediates import IntermediateStore
+from grib_tiler.utils.remote import is_remote, fetch_remote_inputs
+from grib_tiler.utils.resources import worker_resources, configure_gdal, create_pool, peak_rss, MEBIBYTE
+from grib_tiler.utils.scheduling import tile_costs, schedule_batches, straggler_stats
+from grib_tiler.utils.stage_cache import StageCache
+from grib_tiler.utils.work_queue import open_work_queue
+
+from rasterio.cutils.bounds import extent  # TODO: посмотреть код GDALWarp(), выяснить, происходит ли обрезка по пределам СК или входного изображения
+
+warnings.filterwarnings("ignore")
+
+MANIFEST_FILENAME = 'manifest.json'
+DEFAULT_STAGE_CACHE_SIZE = 10240
+PYRAMID_DEPTH = 3
+QUEUE_POLL_INTERVAL = 1.0
+
+
+class TilingContext:
+    """Данные, общие для тайлирования нескольких входных файлов одной модели (одной сетки).
+
+    Кэширует TMS, списки номеров тайлов и охваты каналов по сигнатуре исходной сетки.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tms = {}
+        self._tiles = {}
+        self._grid_bounds = {}
+
+    def tms(self, output_crs, tilesize):
+        with self._lock:
+            key = (output_crs, tilesize)
+            if key not in self._tms:
+                self._tms[key] = load_tms(output_crs, tilesize)
+            return self._tms[key]
+
+    def tiles(self, output_crs, tilesize, zooms_list):
+        """Индекс тайлов (TileIndex) матриц TMS выходной СК на уровнях zooms_list."""
+        with self._lock:
+            key = (output_crs, tilesize, tuple(zooms_list))
+            if key not in self._tiles:
+                self._tiles[key] = load_tile_grid(output_crs, tilesize).tile_index(zooms_list)
+            return self._tiles[key]
+
+    def band_bounds(self, band_filename):
+        key = grid_signature(band_filename)
+        with self._lock:
+            if key not in self._grid_bounds:
+                self._grid_bounds[key] = extent(band_filename, True)
+            return list(self._grid_bounds[key])
+
+
+def load_tile_references(previous_directory, current_directory, image_format):
+    """Хэши тайлов предыдущего запуска и пути к их файлам относительно каталога текущего запуска."""
+    manifest_filename = os.path.join(previous_directory, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_filename):
+        return {}
+    with open(manifest_filename) as manifest_fp:
+        manifest = json.load(manifest_fp)
+    extension = RenderTileTask.get_raster_extension(image_format)
+    tile_references = {}
+    for tile_key, tile_entry in manifest['tiles'].items():
+        if 'ref' in tile_entry:
+            tile_filename = os.path.normpath(os.path.join(previous_directory, tile_entry['ref']))
+        else:
+            tile_filename = os.path.join(previous_directory, f'{tile_key}{extension}')
+        tile_references[tile_key] = (tile_entry['hash'], os.path.relpath(tile_filename, current_directory))
+    return tile_references
+
+
+def write_manifest_file(output_directory, tile_entries):
+    with open(os.path.join(output_directory, MANIFEST_FILENAME), 'w') as manifest_fp:
+        json.dump({'tiles': tile_entries}, manifest_fp)
+
+
+def group_metatiles(render_tile_tasks, metatile_size):
+    """Группировка задач тайлов одного выходного каталога в метатайлы metatile_size×metatile_size; задачи без
+    заранее вычисленного окна источника остаются одиночными."""
+    metatiles = {}
+    for render_tile_task in render_tile_tasks:
+        if render_tile_task.source_window is not None:
+            metatile_key = (render_tile_task.output_directory, render_tile_task.z,
+                            render_tile_task.x // metatile_size, render_tile_task.y // metatile_size)
+        else:
+            metatile_key = (render_tile_task.output_directory, render_tile_task.tile_key)
+        metatiles.setdefault(metatile_key, []).append(render_tile_task)
+    return list(metatiles.values())
+
+
+def group_pyramids(render_tile_tasks, depth=PYRAMID_DEPTH):
+    """Группировка задач тайлов одного выходного каталога в пирамиды — поддеревья тайлов depth + 1 верхних уровней
+    увеличения (при depth = 3 — 8×8 тайлов наибольшего уровня и их предки); тайлы меньших уровней остаются
+    одиночными задачами и читаются из источника."""
+    if not render_tile_tasks:
+        return []
+    root_zoom = max(render_tile_task.z for render_tile_task in render_tile_tasks) - depth
+    pyramids = {}
+    for render_tile_task in render_tile_tasks:
+        if render_tile_task.z < root_zoom:
+            pyramid_key = (render_tile_task.output_directory, render_tile_task.tile_key)
+        else:
+            shift = render_tile_task.z - root_zoom
+            pyramid_key = (render_tile_task.output_directory, root_zoom, render_tile_task.x >> shift,
+                           render_tile_task.y >> shift)
+        pyramids.setdefault(pyramid_key, []).append(render_tile_task)
+    return list(pyramids.values())
+
+
+def render_units(render_tile_tasks, metatile_size=1, downsample=False):
+    """Неделимые единицы рендеринга (вид, задачи) для render_batch: пирамиды, метатайлы или отдельные тайлы."""
+    if downsample:
+        return [('pyramid', group) for group in group_pyramids(render_tile_tasks)]
+    if metatile_size > 1:
+        return [('metatile', group) for group in group_metatiles(render_tile_tasks, metatile_size)]
+    return [('tiles', [render_tile_task]) for render_tile_task in render_tile_tasks]
+
+
+def render_scheduled(pool, batches, render_timings):
+    """Рендеринг пакетов задач пулом процессов в порядке готовности; длительности пакетов и моменты их
+    завершения (от начала рендеринга) добавляются в render_timings."""
+    render_start = time.perf_counter()
+    for results, batch_seconds in pool.imap_unordered(timed_render_batch, batches):
+        render_timings.append((batch_seconds, time.perf_counter() - render_start))
+        yield from results
+
+
+def _batch_param(value):
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
+
+
+def _batch_key(kind, render_tile_tasks):
+    if kind == 'batch':
+        return [kind, [_batch_key(*unit) for unit in render_tile_tasks]]
+    return [kind, [[os.path.basename(task.input_filename), os.path.basename(task.original_range_filename or ''),
+                    task.output_filename, task.image_format, task.encoder_options, task.transparency_percent,
+                    task.include_exif, task.data_encoding, task.data_range, task.palette, task.nodata,
+                    task.tilesize, task.write_manifest, task.previous_tile_hash]
+                   for task in render_tile_tasks]]
+
+
+def render_batch_id(kind, render_tile_tasks):
+    """Идентификатор пакета задач по виду, источникам, выходным файлам и параметрам кодирования тайлов.
+
+    Промежуточные файлы адресуются по содержимому, поэтому учитываются их имена без временного каталога запуска:
+    пакет перезапущенного задания получает тот же идентификатор.
+    """
+    batch_key = json.dumps(_batch_key(kind, render_tile_tasks), default=_batch_param)
+    return hashlib.sha1(batch_key.encode('utf-8')).hexdigest()
+
+
+def render_distributed(work_queue_url, output_directory, batches, poll_interval=QUEUE_POLL_INTERVAL):
+    """Рендеринг пакетов задач исполнителями очереди work_queue_url (см. queue_worker).
+
+    Задание адресуется выходным каталогом: пакеты, завершённые прерванным ранее заданием, повторно не
+    рендерятся. Возвращает результаты рендеринга тайлов, как render_tile.
+    """
+    work_queue = open_work_queue(work_queue_url)
+    job = hashlib.sha1(os.path.abspath(output_directory).encode('utf-8')).hexdigest()
+    batch_ids = [render_batch_id(kind, render_tile_tasks) for kind, render_tile_tasks in batches]
+    work_queue.submit(job, [(batch_id, kind, render_tile_tasks)
+                            for batch_id, (kind, render_tile_tasks) in zip(batch_ids, batches)])
+    echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(), "job": job,
+                     "msg": f"Пакетов задач в очереди: {len(batch_ids)}"}, ensure_ascii=False))
+    done = None
+    try:
+        while True:
+            states = work_queue.progress(job, batch_ids)
+            if states['failed']:
+                raise RuntimeError(f'Ошибка рендеринга пакета задач: {work_queue.errors(job)[0]}')
+            if states['done'] != done:
+                done = states['done']
+                echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(), "job": job,
+                                 "msg": f"Пакетов задач готово: {done} из {len(batch_ids)}"}, ensure_ascii=False))
+            if done == len(batch_ids):
+                break
+            time.sleep(poll_interval)
+    finally:
+        work_queue.close(job)
+    return list(work_queue.results(job, batch_ids))
+
+
+def tile_source_windows(tiles, source_filename, output_crs):
+    """Окна тайлов индекса tiles в пикселях источника тайлирования (массив формы (N, 4)) или None, если
+    источник не в выходной СК или его геотрансформация повёрнута."""
+    with rasterio.open(source_filename) as source_rio:
+        if source_rio.crs is None or CRS.from_user_input(source_rio.crs) != CRS.from_user_input(output_crs):
+            return None
+        return tiles.source_windows(source_rio.transform)
+
+
+def select_input_bands(input_files, band_selection):
+    """Номера каналов входных файлов, выбранных по каталогу каналов.
+
+    Для одного входного файла выбираются все подходящие каналы, для нескольких — ровно один канал каждого файла.
+    """
+    selection = parse_band_selection(band_selection)
+    selected_bands = [select_bands(load_band_catalogue(input_file), selection) for input_file in input_files]
+    if len(input_files) == 1:
+        bands_list = selected_bands[0]
+    elif all(len(file_bands) == 1 for file_bands in selected_bands):
+        bands_list = [file_bands[0] for file_bands in selected_bands]
+    else:
+        bands_list = []
+    if not bands_list:
+        echo(json.dumps({"level": "fatal", "time": get_rfc3339nano_time(),
+                         "msg": f"Условию выбора каналов {band_selection} не соответствует ни один канал "
+                                f"(или для нескольких входных файлов выбрано не ровно по одному каналу)"},
+                        ensure_ascii=False))
+        raise UsageError(f'Условию выбора каналов {band_selection} не соответствует ни один канал '
+                         f'(или для нескольких входных файлов выбрано не ровно по одному каналу)')
+    echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                     "msg": f"Выбраны каналы: {','.join(map(str, bands_list))}"}, ensure_ascii=False))
+    return bands_list
+
+
+def input_message_ranges(input_files, bands_list):
+    """Байтовые диапазоны сообщений GRIB для пар (входной файл, канал) или None, если индекс неприменим."""
+    file_message_ranges = {input_file: band_message_ranges(input_file) for input_file in set(input_files)}
+    message_ranges = []
+    for input_file, band in zip(input_files, bands_list):
+        band_ranges = file_message_ranges[input_file]
+        message_ranges.append(band_ranges[band - 1] if band_ranges and 0 < band <= len(band_ranges) else None)
+    return message_ranges
+
+
+def batch_output_directory(output_directory, input_file):
+    return os.path.join(output_directory, os.path.basename(input_file).replace(' ', '_'))
+
+
+def batch_tiling_options(tiling_options, input_file):
+    """Параметры тайлирования файла пакета: манифесты предыдущего запуска (delta_directory) ищутся в подкаталоге
+    файла, как и его выходной каталог."""
+    delta_directory = tiling_options.get('delta_directory')
+    if not delta_directory:
+        return tiling_options
+    return dict(tiling_options, delta_directory=batch_output_directory(delta_directory, input_file))
+
+
+def tile_grib_files(input_files,
+                    output_directory,
+                    temp_directory,
+                    cutline_filename=None,
+                    bands_list='1',
+                    band_selection=None,
+                    zooms_list='0,1,2,3,4',
+                    is_multiband=False,
+                    output_crs='EPSG:3857',
+                    threads=os.cpu_count(),
+                    tilesize=256,
+                    image_format='JPEG',
+                    generate_isolines=False,
+                    isolines_elevation_interval=10.0,
+                    isolines_simplify_epsilon=0.0,
+                    get_equator=None,
+                    transparency_percent=0,
+                    output_nodata=None,
+                    include_exif=False,
+                    warp_cache_directory=None,
+                    write_manifest=False,
+                    delta_directory=None,
+                    memory_budget=None,
+                    intermediate_compression='LZW',
+                    gdal_cachemax=None,
+                    gdal_threads=None,
+                    warp_threads=None,
+                    colormap_filename=None,
+                    quality=None,
+                    lossless=False,
+                    png_compress_level=None,
+                    png_strategy=None,
+                    data_encoding=None,
+                    metatile_size=1,
+                    downsample=False,
+                    remote_cache_directory=None,
+                    s3_endpoint=None,
+                    stage_cache_directory=None,
+                    stage_cache_size=DEFAULT_STAGE_CACHE_SIZE,
+                    work_queue=None,
+                    schedule='cost',
+                    pool=None,
+                    tiling_context=None):
+    """Тайлирование входных GRIB-файлов.
+
+    band_selection (например, «GRIB_ELEMENT=TMP,GRIB_SHORT_NAME=850-ISBL») выбирает каналы по каталогу каналов
+    входных файлов вместо номеров bands_list.
+    Удалённые входные файлы (http(s)://, s3://) загружаются один раз через блочный кэш remote_cache_directory
+    (по умолчанию — в temp_directory); s3_endpoint — адрес S3-совместимого хранилища.
+    Если пул процессов pool не передан, он создаётся на время тайлирования и используется всеми этапами.
+    tiling_context (TilingContext) позволяет переиспользовать TMS, номера тайлов и геометрию сетки между вызовами.
+    При заданном warp_cache_directory тайлы перепроецируются по картам пикселей, кэшируемым в этом каталоге.
+    write_manifest включает запись manifest.json с хэшами тайлов; тайлы, хэш которых совпадает с записанным в
+    manifest.json выходного каталога предыдущего запуска delta_directory, не записываются, а в манифест
+    заносится ссылка на тайл предыдущего запуска.
+    memory_budget (в МиБ) ограничивает количество рабочих процессов и объём данных, обрабатываемых процессом за раз;
+    списки тайлов и задач основного процесса в него не входят.
+    Промежуточные растры записываются тайлированными (блоками размера тайла) со сжатием intermediate_compression.
+    gdal_cachemax (в МиБ) и gdal_threads задают кэш блоков и потоки GDAL каждого процесса, warp_threads — потоки
+    GDALWarp; по умолчанию они выводятся из бюджета памяти и количества процессов.
+    colormap_filename — JSON-спецификация шкалы преобразования каналов в 8 бит (см. load_colormap).
+    quality (JPEG, WEBP), lossless (WEBP), png_compress_level и png_strategy (PNG) настраивают кодировщик тайлов;
+    время кодирования и размер тайлов выводятся в метриках выполнения.
+    data_encoding включает тайлы данных из растров исходного диапазона вместо 8-битных изображений: float16 —
+    сжатые zlib массивы Float16 (.bin, nodata — NaN), rgb24 — PNG, значение = min + (R·65536 + G·256 + B)·step
+    с мин/шагом канала в meta.json и альфа-каналом nodata.
+    metatile_size > 1 объединяет тайлы в задачи-метатайлы metatile_size×metatile_size: окно источника в выходной СК
+    читается один раз на метатайл (см. render_metatile).
+    downsample включает построение тайлов снизу вверх: тайлы наибольшего уровня увеличения читаются из источника,
+    тайлы меньших уровней — уменьшением 2×2 тайлов-потомков в памяти (см. group_pyramids, render_pyramid).
+    При заданном stage_cache_directory извлечённые, перепроецированные, обрезанные и 8-битные каналы и мин/макс
+    каналов сохраняются между запусками в этом каталоге (см. StageCache) объёмом до stage_cache_size МиБ.
+    При заданной очереди задач work_queue тайлы рендерятся не пулом процессов, а исполнителями очереди
+    (см. render_distributed, queue_worker).
+    schedule — порядок и укрупнение пакетов задач рендеринга: cost — по оценённой стоимости тайлов (см.
+    schedule_batches), count — равными по количеству тайлов пакетами; статистика хвоста выводится в метриках.
+    """
+    if tiling_context is None:
+        tiling_context = TilingContext()
+    threads, memory_limit, gdal_options = worker_resources(threads, memory_budget, gdal_cachemax, gdal_threads)
+    warp_threads = warp_threads or int(gdal_options['GDAL_NUM_THREADS'])
+    configure_gdal(gdal_options)
+    run_metrics = {
+        'threads': threads,
+        'memory_budget_mb': memory_budget,
+        'worker_memory_limit_mb': memory_limit / MEBIBYTE if memory_limit else None,
+        'warp_threads': warp_threads,
+        'gdal': gdal_options
+    }
+    own_pool = pool is None
+    if own_pool:
+        pool = create_pool(threads, gdal_options)
+    stage_cache = None
+    stage_directory = temp_directory
+    if stage_cache_directory:
+        stage_directory = stage_cache_directory = os.path.abspath(stage_cache_directory)
+        stage_cache = StageCache(stage_cache_directory, stage_cache_size * MEBIBYTE)
+    # Промежуточные файлы удаляются, как только становятся не нужны последующим этапам (кроме файлов кэша этапов)
+    intermediates = IntermediateStore(persistent_directory=stage_cache_directory)
+    published_sources = []
+    try:
+        tms = tiling_context.tms(output_crs, tilesize)
+        if any(is_remote(input_file) for input_file in input_files):
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Загрузка удалённых входных файлов..."}, ensure_ascii=False))
+            input_files, run_metrics['remote'] = fetch_remote_inputs(
+                input_files, remote_cache_directory or os.path.join(temp_directory, 'remote'), s3_endpoint)
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Загрузка удалённых входных файлов... OK"}, ensure_ascii=False))
+        colormap = load_colormap(colormap_filename) if colormap_filename else {}
+
+        input_pack = None
+        bands_list = list(map(int, bands_list.split(',')))
+        if band_selection:
+            bands_list = select_input_bands(input_files, band_selection)
+        zooms_list = list(map(int, zooms_list.split(',')))
+
+        if transparency_percent and image_format == 'JPEG':
+            image_format = 'PNG'
+        if data_encoding:
+            if data_encoding == 'rgb24' and is_multiband:
+                echo(json.dumps({"level": "fatal", "time": get_rfc3339nano_time(),
+                                 "msg": "Тайлы данных rgb24 доступны только в одноканальном режиме"},
+                                ensure_ascii=False))
+                raise UsageError('Тайлы данных rgb24 доступны только в одноканальном режиме')
+            # Значения содержатся в самих тайлах, EXIF-метаданные не нужны
+            image_format = 'BIN' if data_encoding == 'float16' else 'PNG'
+            include_exif = False
+        elif not is_multiband and any(band_colormap(colormap, band).get('palette') for band in bands_list):
+            # Палитровые тайлы записываются только в PNG
+            if image_format != 'PNG':
+                echo(json.dumps({"level": "warn", "time": get_rfc3339nano_time(),
+                                 "msg": f"Шкала содержит палитру: тайлы всех каналов записываются в PNG вместо "
+                                        f"{image_format}"}, ensure_ascii=False))
+            image_format = 'PNG'
+
+        cutline_geometry = None
+        if cutline_filename:
+            cutline_geometry = load_cutline(cutline_filename)
+        elif get_equator:
+            from shapely.geometry import box
+
+            input_file_bounds = extent(input_files[0], True)
+            if get_equator == 'northern':
+                input_file_bounds[1] = 0.0
+                input_file_bounds[3] = float(int(input_file_bounds[3]))
+            elif get_equator == 'southern':
+                input_file_bounds[1] = float(int(input_file_bounds[1]))
+                input_file_bounds[3] = 0.0
+            cutline_geometry = box(*input_file_bounds)
+        mask_cache_directory = warp_cache_directory or temp_directory
+
+        if is_multiband:
+            echo(
+                json.dumps({"level": "info", "time": get_rfc3339nano_time(), "msg": "Тип выходных тайлов: мультиканальный"},
+                           ensure_ascii=False))
+            if (len(input_files) != len(bands_list)) and (len(bands_list) != 1) and (len(input_files) != 1):
+                echo(json.dumps({"level": "fatal", "time": get_rfc3339nano_time(),
+                                 "msg": "Количество каналов и входных файлов должно быть равно, или должен быть указан только один канал"},
+                                ensure_ascii=False))
+                raise UsageError(
+                    'Количество каналов и входных файлов должно быть равно, или должен быть указан только один канал')
+
+            elif (len(input_files) != len(bands_list)) and (len(bands_list) == 1):
+                bands_list = bands_list * len(input_files)
+            elif (len(input_files) == 1) and (len(input_files) != len(bands_list)):
+                input_files = input_files * len(bands_list)
+            input_pack = list(zip(input_files,
+                                  bands_list,
+                                  [stage_directory] * len(input_files),
+                                  input_message_ranges(input_files, bands_list)))
+        else:
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(), "msg": "Тип выходных тайлов: одноканальный"},
+                            ensure_ascii=False))
+            if len(input_files) >= 2:
+                echo(json.dumps({"level": "fatal", "time": get_rfc3339nano_time(),
+                                 "msg": "Использование двух и более входных файлов в одноканальном режиме недоступно"},
+                                ensure_ascii=False))
+                raise UsageError('Использование двух и более входных файлов в одноканальном режиме недоступно')
+            input_pack = list(zip(input_files * len(bands_list),
+                                  bands_list,
+                                  [stage_directory] * len(bands_list),
+                                  input_message_ranges(input_files * len(bands_list), bands_list)))
+        band_progress_step = 100 / len(bands_list)
+        band_extract_progress = 0
+        echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                         "msg": f"Извлечение каналов из входных файлов..."}, ensure_ascii=False))
+        extracted_cropped_bands = []
+        for result in pool.map(extract_band, input_pack):
+            band_extract_progress += band_progress_step
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Извлечение каналов из входных файлов... {int(band_extract_progress)}%"},
+                            ensure_ascii=False))
+            intermediates.add(result)
+            band_bounds = tiling_context.band_bounds(result)
+            warp_band_args = [result, 'EPSG:4326', band_bounds, 'EPSG:4326', None, None, stage_directory, True,
+                              output_nodata, warp_threads]
+            warped_band = intermediates.add(warp_band(warp_band_args), sources=[result])
+            intermediates.release(result)
+            if cutline_geometry is not None:
+                # Обрезка по маске геометрии, растеризуемой один раз на сетку, вместо линии обрезки GDALWarp
+                extracted_cropped_bands.append(
+                    [warped_band, cutline_geometry, stage_directory, mask_cache_directory, output_nodata, memory_limit,
+                     tilesize, intermediate_compression])
+            else:
+                extracted_cropped_bands.append(
+                    [warped_band, 'EPSG:4326', band_bounds, 'EPSG:4326', None, None, stage_directory, True,
+                     output_nodata, warp_threads])
+
+        echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                         "msg": f"Извлечение каналов из входных файлов... ОК"}, ensure_ascii=False))
+        warp_cropped_extract_progress = 0
+        echo(json.dumps({
+            "level": "info",
+            "time": get_rfc3339nano_time(),
+            "msg": f"Предварительное перепроецирование в EPSG:4326 извлечённых каналов из входных файлов..."
+        }, ensure_ascii=False))
+        warped_cropped_3857_extracts = []
+        for extracted_cropped_band, result in zip(
+                extracted_cropped_bands,
+                pool.map(apply_cutline_mask if cutline_geometry is not None else warp_band, extracted_cropped_bands)):
+            # Обрезанный GTiff не ссылается на исходный VRT, перепроецированный VRT — ссылается
+            intermediates.add(result, sources=[] if cutline_geometry is not None else extracted_cropped_band[:1])
+            intermediates.release(extracted_cropped_band[0])
+            warp_cropped_extract_progress += band_progress_step
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Предварительное перепроецирование в EPSG:4326 извлечённых каналов из входных файлов... {int(warp_cropped_extract_progress)}%"},
+                            ensure_ascii=False))
+            warped_cropped_3857_extracts.append(result)
+        echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                         "msg": f"Предварительное перепроецирование в EPSG:4326 извлечённых каналов из входных файлов... ОК"},
+                        ensure_ascii=False))
+        output_directories = []
+        if is_multiband:
+            os.makedirs(output_directory, exist_ok=True)
+            output_directories.append(output_directory)
+        else:
+            for band in bands_list:
+                band_tiles_output_directory = os.path.join(output_directory, str(band))
+                os.makedirs(band_tiles_output_directory, exist_ok=True)
+                output_directories.append(band_tiles_output_directory)
+
+        if generate_isolines:
+            band_isolines_list = []
+            isolines_generation_progress = 0
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Генерация изолиний..."}, ensure_ascii=False))
+            isolines_tasks = list(zip(warped_cropped_3857_extracts,
+                                      [temp_directory] * len(warped_cropped_3857_extracts),
+                                      [isolines_elevation_interval] * len(warped_cropped_3857_extracts),
+                                      [isolines_simplify_epsilon] * len(warped_cropped_3857_extracts)))
+            for isoline_task in isolines_tasks:
+                isoline = band_isolines(isoline_task)
+                band_isolines_list.append(isoline)
+                isolines_generation_progress += band_progress_step
+                echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                                 "msg": f"Генерация изолиний... {isolines_generation_progress}%"}, ensure_ascii=False))
+
+            for isolines_output_directory, band_isoline in zip(output_directories, band_isolines_list):
+                with open(os.path.join(isolines_output_directory, f'contours.json'), 'w') as isoline_json:
+                    json.dump(band_isoline, isoline_json)
+
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Генерация изолиний... OK"}, ensure_ascii=False))
+        if warp_cache_directory:
+            # Тайлы перепроецируются из EPSG:4326 по кэшированным картам, без промежуточного GDALWarp
+            warped_extracts = list(warped_cropped_3857_extracts)
+        else:
+            input_packs = []
+            if cutline_geometry is not None:
+                for input_file in warped_cropped_3857_extracts:
+                    input_packs.append([
+                        input_file, output_crs, None,
+                        None,
+                        None, None, stage_directory, False, output_nodata, warp_threads
+                    ])
+            else:
+                for input_file in warped_cropped_3857_extracts:
+                    input_packs.append([
+                        input_file, output_crs, CRS.from_string(output_crs).area_of_use.bounds,
+                        'EPSG:4326',
+                        None, None, stage_directory, False, output_nodata, warp_threads
+                    ])
+
+            warp_cropped_extract_progress = 0
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Перепроецирование извлечённых каналов из входных файлов..."}, ensure_ascii=False))
+            warped_extracts = []
+            for input_file, result in zip(warped_cropped_3857_extracts, pool.map(warp_band, input_packs)):
+                intermediates.add(result, sources=[input_file])
+                intermediates.release(input_file)
+                warp_cropped_extract_progress += band_progress_step
+                echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                                 "msg": f"Перепроецирование извлечённых каналов из входных файлов... {int(warp_cropped_extract_progress)}%"},
+                                ensure_ascii=False))
+                warped_extracts.append(result)
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Перепроецирование извлечённых каналов из входных файлов... ОК"}, ensure_ascii=False))
+        tiling_source_files_original_range = []
+        if is_multiband:
+            concatenate_args = [warped_extracts, temp_directory]
+            tiling_source_file_vrt = intermediates.add(concatenate_bands(concatenate_args), sources=warped_extracts)
+            # Каналы остаются доступны через ссылки объединяющего VRT
+            intermediates.release(*warped_extracts)
+            tiling_source_files_original_range.append(tiling_source_file_vrt)
+        else:
+            tiling_source_files_original_range.extend(warped_extracts)
+        band_metas = []
+        band_palettes = [None] * len(bands_list)
+        band_data_ranges = [None] * len(bands_list)
+        if data_encoding == 'float16':
+            band_metas = [{'encoding': 'float16', 'dtype': '<f2', 'compression': 'zlib'} for _ in bands_list]
+        elif data_encoding == 'rgb24':
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Вычисление мин/макс каналов..."}, ensure_ascii=False))
+            for idx, (band_min, band_max) in enumerate(pool.map(calculate_band_minmax, warped_extracts)):
+                band_data_ranges[idx] = (band_min, (band_max - band_min) / RGB24_MAX_VALUE)
+                band_metas.append({'encoding': 'rgb24', 'min': band_min, 'step': band_data_ranges[idx][1]})
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Вычисление мин/макс каналов... ОК"}, ensure_ascii=False))
+        else:
+            byte_conv_progress = 0
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Конверсия извлечённых каналов в 8-битные изображения..."}, ensure_ascii=False))
+            byte_converted = []
+            band_colormaps = [band_colormap(colormap, band) for band in bands_list]
+            byte_conv_tasks = list(zip(warped_extracts, band_colormaps, [stage_directory] * len(bands_list),
+                                       [memory_limit] * len(bands_list), [tilesize] * len(bands_list),
+                                       [intermediate_compression] * len(bands_list)))
+            for idx, (result, band_min, band_max) in enumerate(pool.map(scale_band_to_byte, byte_conv_tasks)):
+                colormap_spec = band_colormaps[idx]
+                byte_conv_progress += band_progress_step
+                echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                                 "msg": f"Конверсия извлечённых каналов в 8-битные изображения... {int(byte_conv_progress)}%"},
+                                ensure_ascii=False))
+                byte_converted.append(intermediates.add(result))
+                band_meta = scale_meta(colormap_spec, band_min, band_max)
+                if not is_multiband and colormap_spec.get('palette'):
+                    band_palettes[idx] = band_palette(colormap_spec, band_min, band_max)
+                    band_meta['ramp'] = palette_ramp(colormap_spec)
+                band_metas.append(band_meta)
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Конверсия извлечённых каналов в 8-битные изображения... ОК"}, ensure_ascii=False))
+        if not (data_encoding or include_exif):
+            # Растры исходного диапазона нужны только тайлам данных и EXIF-метаданным
+            intermediates.release(*tiling_source_files_original_range)
+        if is_multiband:
+            meta_infos = [{'common': band_metas}]
+        else:
+            meta_infos = [{'common': [band_meta]} for band_meta in band_metas]
+        for band_output_directory, meta_info in zip(output_directories, meta_infos):
+            with open(os.path.join(band_output_directory, 'meta.json'), 'w') as meta_json:
+                json.dump(meta_info, meta_json)
+        tiling_source_files = []
+        echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(), "msg": "Генерация номеров тайлов..."},
+                        ensure_ascii=False))
+        tiles = tiling_context.tiles(output_crs, tilesize, zooms_list)
+        echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                         "msg": f"Генерация номеров тайлов... OK"}, ensure_ascii=False))
+        if cutline_geometry is not None:
+            tiles_quantity = len(tiles)
+            tiles = tiles_intersecting(tiles, output_crs, cutline_geometry)
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Тайлов вне области обрезки: {tiles_quantity - len(tiles)} из {tiles_quantity}"},
+                            ensure_ascii=False))
+        if data_encoding:
+            # Тайлы данных строятся напрямую из растров исходного диапазона
+            tiling_source_files.extend(tiling_source_files_original_range)
+            render_tiles_quantity = len(tiles) * len(tiling_source_files)
+        elif is_multiband:
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Объединение и рендеринг 8-битных изображений..."}, ensure_ascii=False))
+            concatenate_args = [byte_converted, temp_directory]
+            tiling_source_file_vrt = intermediates.add(concatenate_bands(concatenate_args), sources=byte_converted)
+            intermediates.release(*byte_converted)
+            tiling_source_file = intermediates.add(vrt_to_raster([tiling_source_file_vrt, temp_directory,
+                                                                  memory_limit, tilesize, intermediate_compression,
+                                                                  byte_converted]))
+            # 8-битные каналы больше не нужны: объединённый растр записан
+            intermediates.release(tiling_source_file_vrt)
+            tiling_source_files.append(tiling_source_file)
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Объединение и рендеринг 8-битных изображений... OK"}, ensure_ascii=False))
+            render_tiles_quantity = len(tiles)
+        else:
+            # 8-битные GTiff этапа конверсии сразу используются как источники тайлирования
+            tiling_source_files.extend(byte_converted)
+            render_tiles_quantity = len(tiles) * len(bands_list)
+        render_tiles_progress_step = 100 / render_tiles_quantity if render_tiles_quantity else 100
+        if warp_cache_directory:
+            # Карты перепроецирования вычисляются при первом рендеринге тайла и сохраняются, только если тайл
+            # пересекается с источником
+            warp_map_sources = tiling_source_files + (tiling_source_files_original_range if include_exif else [])
+            # Источники публикуются один раз и отображаются в память рабочими процессами без копирования
+            published_sources = sorted(set(warp_map_sources))
+            pool.map(publish_tiling_source, [[warp_cache_directory, warp_map_source, output_nodata, memory_limit]
+                                             for warp_map_source in published_sources])
+        encoder_options = tile_encoder_options(image_format, quality, lossless, png_compress_level, png_strategy)
+        write_manifest = write_manifest or bool(delta_directory)
+        tile_references = {}
+        if delta_directory:
+            for band_output_directory in output_directories:
+                tile_references[band_output_directory] = load_tile_references(
+                    os.path.join(delta_directory, os.path.relpath(band_output_directory, output_directory)),
+                    band_output_directory,
+                    image_format)
+        render_tile_tasks = []
+        echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                         "msg": f"Генерация задач на тайлирование изображений..."},
+                        ensure_ascii=False))
+        # Окна тайлов в пикселях источников вычисляются сразу для всего индекса тайлов
+        source_windows = {}
+        if not warp_cache_directory:
+            window_sources = tiling_source_files + (tiling_source_files_original_range if include_exif else [])
+            for tiling_source in set(window_sources):
+                source_windows[tiling_source] = tile_source_windows(tiles, tiling_source, output_crs)
+        # Стоимость тайлов оценивается по источнику тайлирования: тайлы вне данных почти ничего не стоят
+        source_costs = {tiling_source: tile_costs(tiles, tiling_source, output_crs, tilesize,
+                                                  source_windows.get(tiling_source)).tolist()
+                        for tiling_source in set(tiling_source_files)} if schedule == 'cost' else {}
+        tile_zs, tile_xs, tile_ys = tiles.z.tolist(), tiles.x.tolist(), tiles.y.tolist()
+        nodata_mask = None
+        if len(bands_list) < 3 and is_multiband and image_format != 'PNG':
+            nodata_mask = np.zeros((tilesize, tilesize), dtype='uint8')
+        for band, band_output_directory, tiling_source_file, tiling_source_file_original_range, palette, \
+                data_range in zip(bands_list, output_directories, tiling_source_files,
+                                  tiling_source_files_original_range, band_palettes, band_data_ranges):
+            band_tile_references = tile_references.get(band_output_directory, {})
+            windows = source_windows.get(tiling_source_file)
+            original_range_windows = source_windows.get(tiling_source_file_original_range)
+            costs = source_costs.get(tiling_source_file)
+            for row, (tile_z, tile_x, tile_y) in enumerate(zip(tile_zs, tile_xs, tile_ys)):
+                previous_tile_hash, previous_tile_reference = band_tile_references.get(
+                    f'{tile_z}/{tile_x}/{tile_y}', (None, None))
+                render_tile_tasks.append(
+                    RenderTileTask(
+                        input_filename=tiling_source_file,
+                        output_directory=band_output_directory,
+                        z=tile_z,
+                        x=tile_x,
+                        y=tile_y,
+                        tms=tms,
+                        nodata=output_nodata,
+                        tilesize=tilesize,
+                        image_format=image_format,
+                        nodata_mask_array=nodata_mask,
+                        bands=bands_list,
+                        transparency_percent=transparency_percent,
+                        original_range_filename=tiling_source_file_original_range,
+                        include_exif=include_exif,
+                        memory_limit=memory_limit,
+                        warp_map_directory=warp_cache_directory,
+                        output_crs=output_crs,
+                        write_manifest=write_manifest,
+                        previous_tile_hash=previous_tile_hash,
+                        previous_tile_reference=previous_tile_reference,
+                        palette=palette,
+                        encoder_options=encoder_options,
+                        data_encoding=data_encoding,
+                        data_range=data_range,
+                        source_window=tuple(windows[row]) if windows is not None else None,
+                        original_range_window=tuple(original_range_windows[row])
+                        if original_range_windows is not None else None,
+                        cost=costs[row] if costs is not None else 1.0
+                    )
+                )
+        tiling_progress = 0
+        echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                         "msg": f"Генерация задач на тайлирование изображений... OK"}, ensure_ascii=False))
+        echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                         "msg": f"Тайлирование изображений..."}, ensure_ascii=False))
+        manifests = {band_output_directory: {} for band_output_directory in output_directories}
+        encoded_tiles, encode_seconds, encoded_bytes = 0, 0.0, 0
+        render_batches = schedule_batches(render_units(render_tile_tasks, metatile_size, downsample), threads, schedule)
+        render_timings = []
+        if work_queue:
+            render_results = render_distributed(work_queue, output_directory, render_batches)
+        else:
+            render_results = render_scheduled(pool, render_batches, render_timings)
+        for tile_output_directory, tile_key, tile_entry, encode_stats in render_results:
+            manifests[tile_output_directory][tile_key] = tile_entry
+            if encode_stats:
+                encoded_tiles += 1
+                encode_seconds += encode_stats[0]
+                encoded_bytes += encode_stats[1]
+            tiling_progress += render_tiles_progress_step
+            echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                             "msg": f"Тайлирование изображений... {int(tiling_progress)}%"}, ensure_ascii=False))
+        echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                         "msg": f"Тайлирование изображений... OK"}, ensure_ascii=False))
+        run_metrics['encoding'] = {
+            'format': image_format,
+            'options': encoder_options,
+            'tiles': encoded_tiles,
+            'bytes_total': encoded_bytes,
+            'bytes_per_tile': encoded_bytes / encoded_tiles if encoded_tiles else None,
+            'encode_ms_per_tile': 1000 * encode_seconds / encoded_tiles if encoded_tiles else None
+        }
+        run_metrics['scheduling'] = dict(straggler_stats(render_timings), schedule=schedule)
+        if write_manifest:
+            for band_output_directory, tile_entries in manifests.items():
+                write_manifest_file(band_output_directory, tile_entries)
+                unchanged_tiles = sum('ref' in tile_entry for tile_entry in tile_entries.values())
+                echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                                 "msg": f"Манифест {band_output_directory}: тайлов без изменений {unchanged_tiles} "
+                                        f"из {len(tile_entries)}"}, ensure_ascii=False))
+        return output_directories
+    finally:
+        for published_source in published_sources:
+            unpublish_warp_source(warp_cache_directory, published_source, output_nodata)
+        intermediates.clear()
+        if stage_cache is not None:
+            run_metrics['stage_cache'] = dict(zip(('evicted', 'evicted_bytes'), stage_cache.evict()))
+        if own_pool:
+            pool.close()
+            pool.join()
+        run_metrics.update(peak_rss())
+        echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(), "msg": "Метрики выполнения",
+                         "metrics": run_metrics}, ensure_ascii=False))
+
+
+def tile_grib_batch(input_files, output_directory, temp_directory, concurrency=1, threads=os.cpu_count(),
+                    memory_budget=None, **tiling_options):
+    """Пакетное тайлирование: каждый входной файл тайлируется в собственный подкаталог выходного каталога.
+
+    Пул процессов и TilingContext создаются один раз на весь пакет, до concurrency файлов обрабатываются одновременно.
+    """
+    tiling_context = TilingContext()
+    threads, _, gdal_options = worker_resources(threads, memory_budget, tiling_options.get('gdal_cachemax'),
+                                                tiling_options.get('gdal_threads'))
+    with create_pool(threads, gdal_options) as pool, ThreadPoolExecutor(concurrency) as executor:
+        futures = []
+        for idx, input_file in enumerate(input_files):
+            file_temp_directory = os.path.join(temp_directory, str(idx))
+            os.makedirs(file_temp_directory, exist_ok=True)
+            futures.append(executor.submit(tile_grib_files,
+                                           [input_file],
+                                           batch_output_directory(output_directory, input_file),
+                                           file_temp_directory,
+                                           threads=threads,
+                                           memory_budget=memory_budget,
+                                           pool=pool,
+                                           tiling_context=tiling_context,
+                                           **batch_tiling_options(tiling_options, input_file)))
+        return [future.result() for future in futures]
@@ -17,6 +17,7 @@ class Task:
 class WarpTask(Task):
 
     def __init__(self, input_filename, output_directory, output_crs=None,
+                 output_filename=None,
                  multithreading=True,
                  write_flush=True,
                  cutline_filename=None,
@@ -26,7 +27,8 @@ class WarpTask(Task):
                  output_format=None,
                  source_nodata=None,
                  destination_nodata=None,
-                 crop_to_cutline=False):
+                 crop_to_cutline=False,
+                 threads=1):
         super().__init__(input_filename=input_filename,
                          output_directory=output_directory)
         self.output_crs = output_crs
@@ -40,19 +42,24 @@ class WarpTask(Task):
         self.source_nodata = source_nodata
         self.destination_nodata = destination_nodata
         self.crop_to_cutline = crop_to_cutline
+        self.threads = threads
 
         input_filename_splittext = os.path.splitext(os.path.basename(self.input_filename))
         input_filename_base = input_filename_splittext[0]
         self.output_format_extension = get_driver_extension(output_format)
-        self.output_filename = os.path.join(self.output_directory,
-                                            f'{input_filename_base}_warped{self.output_format_extension}')
+        self.output_filename = output_filename or os.path.join(
+            self.output_directory, f'{input_filename_base}_warped{self.output_format_extension}')
 
 
 class RenderTileTask(Task):
 
     def __init__(self, input_filename, output_directory, z, x, y, tms, nodata=None, tilesize=256, dtype='uint8',
                  image_format='PNG', subdirectory_name=None, nodata_mask_array=None, bands=None,
-                 transparency_percent=None, original_range_filename=None, include_exif=None):
+                 transparency_percent=None, original_range_filename=None, include_exif=None,
+                 warp_map_directory=None, output_crs=None, write_manifest=False, previous_tile_hash=None,
+                 previous_tile_reference=None, memory_limit=None, palette=None, encoder_options=None,
+                 data_encoding=None, data_range=None, source_window=None, original_range_window=None,
+                 prefetched_tiles=None, cost=1.0):
         super().__init__(input_filename=input_filename, output_directory=output_directory)
         self.z = z
         self.x = x
@@ -74,13 +81,32 @@ class RenderTileTask(Task):
         self.transparency_percent = transparency_percent
         self.original_range_filename = original_range_filename
         self.include_exif = include_exif
+        self.warp_map_directory = warp_map_directory
+        self.output_crs = output_crs
+        self.write_manifest = write_manifest
+        self.previous_tile_hash = previous_tile_hash
+        self.previous_tile_reference = previous_tile_reference
+        self.memory_limit = memory_limit
+        self.palette = palette
+        self.encoder_options = encoder_options
+        self.data_encoding = data_encoding
+        self.data_range = data_range
+        self.source_window = source_window
+        self.original_range_window = original_range_window
+        self.prefetched_tiles = prefetched_tiles
+        self.cost = cost
 
+    @property
+    def tile_key(self):
+        return f'{self.z}/{self.x}/{self.y}'
 
     @staticmethod
     def get_raster_extension(tile_img_format):
         img_to_ext = {
             'PNG': '.png',
             'JPEG': '.jpg',
+            'WEBP': '.webp',
+            'BIN': '.bin',
             'VRT': '.vrt'
         }
         return img_to_ext[tile_img_format]
@@ -91,12 +117,6 @@ class RenderTileTask(Task):
             return self._nodata_mask
 
 
-class InRangeTask(Task):
-
-    def __init__(self, input_filename, bands):
-        super().__init__(input_filename)
-        self.bands = bands
-
 class TranslateTask(Task):
 
     def __init__(self, input_filename, output_filename, output_directory=None,
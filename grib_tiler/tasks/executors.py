@@ -1,37 +1,49 @@
+import hashlib
 import io
 import json
 import multiprocessing
 import os
-import random
 import threading
-from pprint import pprint
+import time
+import traceback
+import zlib
+from contextlib import ExitStack
 
-import geopandas as gpd
-
-import fiona
 import numpy
 import numpy as np
 import rasterio
-from PIL import Image
+from rasterio.enums import MaskFlags, Resampling
+from rasterio.windows import Window
 from click import echo
-from pyproj import CRS
-from rasterio.apps.contour import build_contour
 from rasterio.apps.translate import translate
 from rasterio.apps.vrt import build_vrt
 from rasterio.apps.warp import warp
-from rasterio.cutils.min_max import min_max
-from rio_tiler.errors import TileOutsideBounds
-from rio_tiler.io import Reader
-from rio_tiler.utils import render
-from shapely import simplify
-from shapely.geometry import shape, mapping
 
-from grib_tiler.tasks import WarpTask, InRangeTask, RenderTileTask, TranslateTask, VirtualTask, IsolinesTask
-from grib_tiler.utils import fiona_bbox
+from grib_tiler.tasks import WarpTask, RenderTileTask, TranslateTask, VirtualTask, IsolinesTask
+from grib_tiler.tasks.warp_maps import load_warp_map, load_warp_source, publish_warp_source
+from grib_tiler.utils.colormap import scale_to_byte
+from grib_tiler.utils.cutline import cutline_window, cutline_mask
+from grib_tiler.utils.grib_index import message_subfile
+from grib_tiler.utils.intermediates import intermediate_filename, remove_intermediate
+from grib_tiler.utils.resources import strip_rows
+from grib_tiler.utils.stage_cache import cached_stage_result, store_stage_result, atomic_output
+from grib_tiler.utils.work_queue import open_work_queue
 
 simplify_coeff = 0.0
 lock = threading.Lock()
 
+DEFAULT_STRIP_MEMORY = 64 * 1024 * 1024
+
+RGB24_MAX_VALUE = 2 ** 24 - 1
+
+PNG_STRATEGIES = {
+    'default': zlib.Z_DEFAULT_STRATEGY,
+    'filtered': zlib.Z_FILTERED,
+    'huffman': zlib.Z_HUFFMAN_ONLY,
+    'rle': zlib.Z_RLE,
+    'fixed': zlib.Z_FIXED
+}
+
 
 def concatenate_raster(virtual_task: VirtualTask):
     return build_vrt(source_filenames=virtual_task.input_filename,
@@ -56,115 +68,478 @@ def warp_raster(warp_task: WarpTask):
         target_extent_crs=warp_task.target_extent_crs,
         crop_to_cutline=warp_task.crop_to_cutline,
         configuration_options={
-            'CUTLINE_ALL_TOUCHED': 'TRUE'
+            'CUTLINE_ALL_TOUCHED': 'TRUE',
+            'GDAL_NUM_THREADS': str(warp_task.threads)
         }
     )
 
 
-def _inrange_calculator(rio_ds, band):
-    with rasterio.open(rio_ds) as rio_ds:
-        try:
-            statistics = rio_ds.statistics(band, approx=True, clear_cache=True)
-            return statistics.min, statistics.max
-        except rasterio._err.CPLE_AppDefinedError:
-            statistics = rio_ds.statistics(band, approx=False, clear_cache=True)
-            return statistics.min, statistics.max
-
-
-def in_range_calculator(inrange_task: InRangeTask):
-    in_ranges = []
-    bands = inrange_task.bands
-    if not bands:
-        with rasterio.open(inrange_task.input_filename) as input_rio:
-            bands = input_rio.indexes
-    else:
-        if len(bands) == 1:
-            bands = [1]
-    with rasterio.open(inrange_task.input_filename) as input_rio:
-        for band in bands:
-            try:
-                statistics = input_rio.statistics(band, approx=True, clear_cache=True)
-                in_ranges.append((statistics.min, statistics.max))
-            except rasterio._err.CPLE_AppDefinedError:
-                statistics = input_rio.statistics(band, approx=False, clear_cache=True)
-                in_ranges.append((statistics.min, statistics.max))
-    return tuple(in_ranges)
-
-
-def render_tile(render_tile_task: RenderTileTask):
-    exif = None
-    min_max_values = {}
-    if render_tile_task.include_exif:
-        with Reader(input=render_tile_task.original_range_filename,
-                    tms=render_tile_task.tms,
-                    options={'nodata': render_tile_task.nodata}) as input_file_rio:
-            expected_band_count = len(input_file_rio.dataset.indexes)
-            try:
-                tile = input_file_rio.tile(tile_z=render_tile_task.z,
-                                           tile_y=render_tile_task.y,
-                                           tile_x=render_tile_task.x,
-                                           tilesize=render_tile_task.tilesize,
-                                           resampling_method='bilinear')
-                for band, color in zip(tile.data, ['r', 'g', 'b', 'a'][0:expected_band_count]):
-                    min_max_values[f'{color}min'] = band.min()
-                    min_max_values[f'{color}step'] = (band.max() - band.min()) / 255
-                bands_mm = []
-                for band in tile.data[0:expected_band_count]:
-                    bands_mm.append(
-                        (band.min(),
-                         band.max())
-                    )
-            except TileOutsideBounds:
-                for color in (['r', 'g', 'b', 'a'][0:expected_band_count]):
-                    min_max_values[f'{color}min'] = 0.0
-                    min_max_values[f'{color}step'] = 0.0
-    with Reader(input=render_tile_task.input_filename,
+def window_outside(window, raster_width, raster_height):
+    col_off, row_off, width, height = window
+    return col_off >= raster_width or row_off >= raster_height or col_off + width <= 0 or row_off + height <= 0
+
+
+def fits_dtype(value, dtype):
+    """Представимо ли значение value в типе данных dtype без потерь."""
+    dtype = numpy.dtype(dtype)
+    if numpy.issubdtype(dtype, numpy.integer):
+        return not numpy.isnan(value) and float(value).is_integer() and \
+            numpy.iinfo(dtype).min <= value <= numpy.iinfo(dtype).max
+    return numpy.isnan(value) or numpy.isinf(value) or abs(value) <= numpy.finfo(dtype).max
+
+
+def has_own_mask(input_rio):
+    """Есть ли у растра собственная маска (внутренняя маска или nodata) хотя бы у одного канала."""
+    return any(MaskFlags.all_valid not in band_flags for band_flags in input_rio.mask_flag_enums)
+
+
+def read_window(input_filename, window, out_height, out_width, nodata=None):
+    """Чтение окна растра в выходной СК (см. TileIndex.source_windows) с билинейным ресэмплингом до
+    out_height×out_width: (данные и маска 0/255 или None, если окно вне пределов растра; количество каналов растра).
+
+    Маска — маска растра (внутренняя маска или его nodata); nodata запуска дополнительно маскирует пиксели растров
+    без собственной маски. Пиксели за пределами растра маскируются всегда.
+    """
+    col_off, row_off, width, height = window
+    with rasterio.open(input_filename) as input_rio:
+        if window_outside(window, input_rio.width, input_rio.height):
+            return None, None, input_rio.count
+        # Окна на краю растра читаются с заполнением за его пределами
+        boundless = col_off < 0 or row_off < 0 or col_off + width > input_rio.width or \
+            row_off + height > input_rio.height
+        tile_window = Window(col_off, row_off, width, height)
+        fill_value = nodata if nodata is not None and fits_dtype(nodata, input_rio.dtypes[0]) else 0
+        tile_data = input_rio.read(window=tile_window, out_shape=(input_rio.count, out_height, out_width),
+                                   resampling=Resampling.bilinear, boundless=boundless, fill_value=fill_value)
+        tile_mask = input_rio.dataset_mask(window=tile_window, out_shape=(out_height, out_width),
+                                           boundless=boundless)
+        if nodata is not None and not has_own_mask(input_rio):
+            is_nodata = numpy.isnan(tile_data) if numpy.isnan(nodata) else tile_data == nodata
+            tile_mask = numpy.where(numpy.all(is_nodata, axis=0), 0, tile_mask).astype('uint8')
+        return tile_data, tile_mask, input_rio.count
+
+
+def read_tile(render_tile_task: RenderTileTask, input_filename, window=None):
+    """Чтение тайла: (ImageData или None, если тайл вне пределов растра; количество каналов растра).
+
+    window — окно тайла в пикселях растра, вычисленное заранее для растров в выходной СК; без него охват
+    и окно тайла вычисляет rio-tiler.
+    """
+    from rio_tiler.models import ImageData
+
+    if render_tile_task.prefetched_tiles and input_filename in render_tile_task.prefetched_tiles:
+        return render_tile_task.prefetched_tiles[input_filename]
+    if window is not None:
+        tile_data, tile_mask, band_count = read_window(input_filename, window, render_tile_task.tilesize,
+                                                       render_tile_task.tilesize, render_tile_task.nodata)
+        if tile_data is None:
+            return None, band_count
+        return ImageData(tile_data, tile_mask), band_count
+    if render_tile_task.warp_map_directory:
+        warp_source = load_warp_source(input_filename, render_tile_task.nodata, render_tile_task.memory_limit,
+                                       render_tile_task.warp_map_directory)
+        warp_map = load_warp_map(render_tile_task.warp_map_directory, render_tile_task.output_crs,
+                                 render_tile_task.z, render_tile_task.x, render_tile_task.y,
+                                 render_tile_task.tilesize, warp_source.signature)
+        tile_data, tile_mask = warp_source.gather(warp_map)
+        if tile_data is None:
+            return None, warp_source.count
+        return ImageData(tile_data, tile_mask), warp_source.count
+    from rio_tiler.errors import TileOutsideBounds
+    from rio_tiler.io import Reader
+
+    with Reader(input=input_filename,
                 tms=render_tile_task.tms,
                 options={'nodata': render_tile_task.nodata}) as input_file_rio:
+        band_count = len(input_file_rio.dataset.indexes)
         try:
-            tile = input_file_rio.tile(tile_z=render_tile_task.z,
+            return input_file_rio.tile(tile_z=render_tile_task.z,
                                        tile_y=render_tile_task.y,
                                        tile_x=render_tile_task.x,
                                        tilesize=render_tile_task.tilesize,
-                                       resampling_method='bilinear')
-            if isinstance(render_tile_task.nodata_mask, np.ndarray):
-                tile.mask = render_tile_task.nodata_mask
-            if render_tile_task.image_format == 'JPEG':
-                if tile.data.shape[0] == 2:
-                    tile_mask = numpy.reshape(numpy.expand_dims(tile.mask, axis=-1), (1, render_tile_task.tilesize,
-                                                                                      render_tile_task.tilesize))
-                    tile.data = np.concatenate((tile.data, tile_mask), axis=0)
-            if render_tile_task.image_format == 'PNG':
-                if tile.data.shape[0] == 1:
-                    render_tile_task.transparency_percent = abs(render_tile_task.transparency_percent - 100)
-                    tile.mask = (render_tile_task.transparency_percent / 100) * tile.mask
-            tile_bytes = tile.render(img_format=render_tile_task.image_format)
-            del tile
+                                       resampling_method='bilinear'), band_count
         except TileOutsideBounds:
-            if render_tile_task.image_format == 'JPEG':
-                if len(render_tile_task.bands) == 2:
-                    tile_bytes = render(data=numpy.zeros(
-                        shape=(
-                            3, render_tile_task.tilesize, render_tile_task.tilesize),
-                        dtype='uint8'), img_format=render_tile_task.image_format)
-                else:
-                    tile_bytes = render(data=numpy.zeros(
-                        shape=(
-                            len(input_file_rio.dataset.indexes), render_tile_task.tilesize, render_tile_task.tilesize),
-                        dtype='uint8'), img_format=render_tile_task.image_format)
-            else:
-                tile_bytes = render(data=numpy.zeros(
-                    shape=(
-                        len(input_file_rio.dataset.indexes), render_tile_task.tilesize, render_tile_task.tilesize),
-                    dtype='uint8'), img_format=render_tile_task.image_format)
-    pillow_image = Image.open(io.BytesIO(tile_bytes))
+            return None, band_count
+
+
+def tile_block_hash(tile_data, tile_mask, min_max_values, image_format, palette=None, data_encoding=None,
+                    data_range=None, encoder_options=None):
+    """Хэш квантованного блока пикселей тайла вместе с маской, EXIF-метаданными, форматом, палитрой, кодированием
+    тайлов данных с их диапазоном (min/step rgb24) и параметрами кодировщика."""
+    block_hash = hashlib.sha1(image_format.encode('utf-8'))
+    if palette is not None:
+        block_hash.update(palette)
+    block_hash.update(json.dumps([data_encoding, data_range, encoder_options], sort_keys=True,
+                                 default=str).encode('utf-8'))
+    block_hash.update(str(tile_data.shape).encode('utf-8'))
+    block_hash.update(numpy.ascontiguousarray(tile_data).tobytes())
+    if tile_mask is not None:
+        block_hash.update(numpy.ascontiguousarray(tile_mask).tobytes())
+    block_hash.update(json.dumps(min_max_values, sort_keys=True, default=str).encode('utf-8'))
+    return block_hash.hexdigest()
+
+
+def palette_indices(band, mask):
+    """Индексы палитры 8-битного канала: 0 — nodata, валидные пиксели не ниже 1."""
+    if mask is None:
+        return numpy.zeros(band.shape, dtype='uint8')
+    return numpy.where(mask > 0, numpy.maximum(band, 1), 0).astype('uint8')
+
+
+def tile_encoder_options(image_format, quality=None, lossless=False, png_compress_level=None, png_strategy=None):
+    """Параметры кодировщика Pillow для выходного формата тайлов."""
+    encoder_options = {}
+    if image_format in ('JPEG', 'WEBP') and quality:
+        encoder_options['quality'] = quality
+    if image_format == 'WEBP':
+        encoder_options['lossless'] = lossless
+    if image_format == 'PNG':
+        if png_compress_level is not None:
+            encoder_options['compress_level'] = png_compress_level
+        if png_strategy:
+            encoder_options['compress_type'] = PNG_STRATEGIES[png_strategy]
+    return encoder_options
+
+
+def encode_tile(render_tile_task: RenderTileTask, tile_data, tile_mask, min_max_values):
+    """Кодирование тайла в выходной формат за один проход Pillow (с EXIF-метаданными мин/макс).
+
+    Маска записывается альфа-каналом одно- и трёхканальных тайлов PNG и WEBP, третьим каналом RGB двухканальных
+    тайлов (нули — для тайлов без маски); палитровые тайлы — 8-битным PNG с прозрачным индексом 0.
+    Возвращает (байты тайла, время кодирования в секундах).
+    """
+    from PIL import Image
+
+    image_format = render_tile_task.image_format
+    save_options = dict(render_tile_task.encoder_options or {})
     if render_tile_task.include_exif:
-        exif = pillow_image.getexif()
+        exif = Image.Exif()
         exif[0x9286] = json.dumps(min_max_values, ensure_ascii=False)
-    pillow_image.save(render_tile_task.output_filename, exif=exif)
+        save_options['exif'] = exif
+    encode_start = time.perf_counter()
+    if render_tile_task.palette is not None:
+        height, width = tile_data.shape
+        pillow_image = Image.frombytes('P', (width, height), numpy.ascontiguousarray(tile_data).tobytes())
+        pillow_image.putpalette(render_tile_task.palette)
+        alpha = round(255 * (100 - (render_tile_task.transparency_percent or 0)) / 100)
+        save_options['transparency'] = bytes([0] + [alpha] * 255)
+    else:
+        bands = list(tile_data.astype('uint8'))
+        if len(bands) == 2:
+            bands.append(numpy.zeros_like(bands[0]) if tile_mask is None else numpy.asarray(tile_mask).astype('uint8'))
+        elif tile_mask is not None and image_format != 'JPEG' and len(bands) in (1, 3):
+            bands.append(numpy.asarray(tile_mask).astype('uint8'))
+        pillow_image = Image.fromarray(bands[0] if len(bands) == 1 else numpy.dstack(bands))
+    tile_buffer = io.BytesIO()
+    pillow_image.save(tile_buffer, format=image_format, **save_options)
+    return tile_buffer.getvalue(), time.perf_counter() - encode_start
+
+
+def read_data_tile(render_tile_task: RenderTileTask):
+    """Тайл данных в исходном диапазоне значений: (данные, маска 0/255)."""
+    tile, band_count = read_tile(render_tile_task, render_tile_task.input_filename, render_tile_task.source_window)
+    if tile is None:
+        tile_shape = (render_tile_task.tilesize, render_tile_task.tilesize)
+        return numpy.zeros((band_count,) + tile_shape, dtype='float32'), numpy.zeros(tile_shape, dtype='uint8')
+    return tile.data, tile.mask
+
+
+def encode_data_tile(render_tile_task: RenderTileTask, tile_data, tile_mask, min_max_values=None):
+    """Кодирование тайла данных: float16 — сжатый zlib массив Float16 (nodata — NaN), rgb24 — PNG со значением
+    min + (R·65536 + G·256 + B)·step и альфа-каналом nodata. Возвращает (байты тайла, время кодирования в секундах).
+    """
+    encode_start = time.perf_counter()
+    valid = numpy.asarray(tile_mask) > 0
+    if render_tile_task.data_encoding == 'float16':
+        values = tile_data.astype('<f2')
+        values[:, ~valid] = numpy.nan
+        tile_bytes = zlib.compress(values.tobytes())
+    else:
+        from PIL import Image
+
+        band_min, step = render_tile_task.data_range
+        codes = numpy.zeros(valid.shape, dtype='uint32')
+        if step:
+            codes[valid] = numpy.clip(numpy.rint((tile_data[0][valid] - band_min) / step), 0, RGB24_MAX_VALUE)
+        rgba = numpy.dstack([codes >> 16, (codes >> 8) & 255, codes & 255, numpy.where(valid, 255, 0)])
+        tile_buffer = io.BytesIO()
+        Image.fromarray(rgba.astype('uint8')).save(tile_buffer, format='PNG',
+                                                   **(render_tile_task.encoder_options or {}))
+        tile_bytes = tile_buffer.getvalue()
+    return tile_bytes, time.perf_counter() - encode_start
+
+
+def read_image_tile(render_tile_task: RenderTileTask):
+    """8-битный тайл изображения: (данные, маска или None, EXIF-метаданные мин/макс)."""
+    min_max_values = {}
+    if render_tile_task.include_exif:
+        tile, expected_band_count = read_tile(render_tile_task, render_tile_task.original_range_filename,
+                                              render_tile_task.original_range_window)
+        if tile is not None:
+            for band, color in zip(tile.data, ['r', 'g', 'b', 'a'][0:expected_band_count]):
+                min_max_values[f'{color}min'] = band.min()
+                min_max_values[f'{color}step'] = (band.max() - band.min()) / 255
+            bands_mm = []
+            for band in tile.data[0:expected_band_count]:
+                bands_mm.append(
+                    (band.min(),
+                     band.max())
+                )
+        else:
+            for color in (['r', 'g', 'b', 'a'][0:expected_band_count]):
+                min_max_values[f'{color}min'] = 0.0
+                min_max_values[f'{color}step'] = 0.0
+    tile, band_count = read_tile(render_tile_task, render_tile_task.input_filename, render_tile_task.source_window)
+    if tile is not None:
+        if isinstance(render_tile_task.nodata_mask, np.ndarray):
+            tile.mask = render_tile_task.nodata_mask
+        if render_tile_task.image_format in ('JPEG', 'WEBP'):
+            if tile.data.shape[0] == 2:
+                tile_mask = numpy.reshape(numpy.expand_dims(tile.mask, axis=-1), (1, render_tile_task.tilesize,
+                                                                                  render_tile_task.tilesize))
+                tile.data = np.concatenate((tile.data, tile_mask), axis=0)
+        if render_tile_task.image_format in ('PNG', 'WEBP') and render_tile_task.palette is None:
+            if tile.data.shape[0] == 1:
+                render_tile_task.transparency_percent = abs(render_tile_task.transparency_percent - 100)
+                tile.mask = (render_tile_task.transparency_percent / 100) * tile.mask
+        tile_data, tile_mask = tile.data, tile.mask
+        if isinstance(render_tile_task.nodata_mask, np.ndarray):
+            # Маска-заглушка двухканальных тайлов не является прозрачностью
+            tile_mask = None
+        del tile
+    else:
+        blank_band_count = band_count
+        if render_tile_task.image_format in ('JPEG', 'WEBP') and len(render_tile_task.bands) == 2:
+            blank_band_count = 3
+        tile_data, tile_mask = numpy.zeros(shape=(blank_band_count, render_tile_task.tilesize,
+                                                  render_tile_task.tilesize), dtype='uint8'), None
+    if render_tile_task.palette is not None:
+        tile_data, tile_mask = palette_indices(tile_data[0], tile_mask), None
+    return tile_data, tile_mask, min_max_values
+
+
+def render_tile(render_tile_task: RenderTileTask):
+    if render_tile_task.data_encoding:
+        tile_data, tile_mask = read_data_tile(render_tile_task)
+        min_max_values = {}
+        encode = encode_data_tile
+    else:
+        tile_data, tile_mask, min_max_values = read_image_tile(render_tile_task)
+        encode = encode_tile
+    tile_hash = None
+    if render_tile_task.write_manifest:
+        tile_hash = tile_block_hash(tile_data, tile_mask, min_max_values, render_tile_task.image_format,
+                                    render_tile_task.palette, render_tile_task.data_encoding,
+                                    render_tile_task.data_range, render_tile_task.encoder_options)
+        if render_tile_task.previous_tile_hash == tile_hash:
+            return render_tile_task.output_directory, render_tile_task.tile_key, {
+                'hash': tile_hash,
+                'ref': render_tile_task.previous_tile_reference
+            }, None
+    tile_bytes, encode_seconds = encode(render_tile_task, tile_data, tile_mask, min_max_values)
+    with open(render_tile_task.output_filename, 'wb') as tile_fp:
+        tile_fp.write(tile_bytes)
+    return render_tile_task.output_directory, render_tile_task.tile_key, {'hash': tile_hash}, (encode_seconds,
+                                                                                               len(tile_bytes))
+
+
+def prefetch_metatile(render_tile_tasks, input_filename, windows):
+    """Чтение окна метатайла одним запросом и нарезка его на тайлы: {номер задачи: (ImageData или None, если тайл
+    вне пределов растра; количество каналов растра)}."""
+    from rio_tiler.models import ImageData
+
+    tilesize = render_tile_tasks[0].tilesize
+    windows = numpy.array(windows, dtype='float64')
+    tile_width, tile_height = windows[0, 2], windows[0, 3]
+    col_off, row_off = windows[:, 0].min(), windows[:, 1].min()
+    # Положение тайлов в метатайле (в тайлах)
+    tile_cols = numpy.rint((windows[:, 0] - col_off) / tile_width).astype('int64')
+    tile_rows = numpy.rint((windows[:, 1] - row_off) / tile_height).astype('int64')
+    metatile_cols, metatile_rows = int(tile_cols.max()) + 1, int(tile_rows.max()) + 1
+    metatile_window = (col_off, row_off, tile_width * metatile_cols, tile_height * metatile_rows)
+    with rasterio.open(input_filename) as input_rio:
+        raster_width, raster_height = input_rio.width, input_rio.height
+    metatile_data, metatile_mask, band_count = read_window(input_filename, metatile_window, metatile_rows * tilesize,
+                                                           metatile_cols * tilesize, render_tile_tasks[0].nodata)
+    prefetched = {}
+    for task_index, (window, tile_col, tile_row) in enumerate(zip(windows, tile_cols, tile_rows)):
+        if metatile_data is None or window_outside(window, raster_width, raster_height):
+            prefetched[task_index] = (None, band_count)
+            continue
+        rows = slice(tile_row * tilesize, (tile_row + 1) * tilesize)
+        cols = slice(tile_col * tilesize, (tile_col + 1) * tilesize)
+        prefetched[task_index] = (ImageData(metatile_data[:, rows, cols].copy(), metatile_mask[rows, cols].copy()),
+                                  band_count)
+    return prefetched
+
+
+def tile_sources(render_tile_task: RenderTileTask):
+    """Растры, читаемые при рендеринге тайла, и окна тайла в них: источник тайлирования и (для EXIF) растр
+    исходного диапазона."""
+    sources = [(render_tile_task.input_filename, render_tile_task.source_window)]
+    if render_tile_task.include_exif and not render_tile_task.data_encoding:
+        sources.append((render_tile_task.original_range_filename, render_tile_task.original_range_window))
+    return sources
+
+
+def prefetch_tiles(render_tile_tasks, read_all=False):
+    """Чтение тайлов группы задач в prefetched_tiles: если окна всех тайлов известны, растр читается одним окном
+    метатайла; при read_all остальные тайлы читаются по отдельности."""
+    for source_index, (input_filename, _) in enumerate(tile_sources(render_tile_tasks[0])):
+        windows = [tile_sources(task)[source_index][1] for task in render_tile_tasks]
+        if len(render_tile_tasks) > 1 and all(window is not None for window in windows):
+            prefetched = prefetch_metatile(render_tile_tasks, input_filename, windows)
+        elif read_all:
+            prefetched = {task_index: read_tile(task, input_filename, window)
+                          for task_index, (task, window) in enumerate(zip(render_tile_tasks, windows))}
+        else:
+            continue
+        for task_index, prefetched_tile in prefetched.items():
+            task = render_tile_tasks[task_index]
+            task.prefetched_tiles = task.prefetched_tiles or {}
+            task.prefetched_tiles[input_filename] = prefetched_tile
+
+
+def render_metatile(render_tile_tasks):
+    """Рендеринг метатайла: окно источника (и растра исходного диапазона для EXIF) читается и ресэмплируется один
+    раз на все тайлы метатайла, тайлы вырезаются из него и кодируются по отдельности (см. render_tile)."""
+    prefetch_tiles(render_tile_tasks)
+    return [render_tile(task) for task in render_tile_tasks]
+
+
+def downsample_children(children, band_count):
+    """Тайл-родитель из четырёх тайлов-потомков (данные, маска 0/255) или None в порядке: верхний левый, верхний
+    правый, нижний левый, нижний правый.
+
+    Пиксель родителя — среднее допустимых пикселей блока 2×2 мозаики потомков; он допустим, если допустим хотя бы
+    один пиксель блока.
+    """
+    present = [child for child in children if child is not None]
+    if not present:
+        return None
+    dtype = present[0][0].dtype
+    tilesize = present[0][0].shape[-1]
+    mosaic = numpy.zeros((band_count, 2 * tilesize, 2 * tilesize), dtype='float64')
+    weights = numpy.zeros((2 * tilesize, 2 * tilesize), dtype='float64')
+    for child_index, child in enumerate(children):
+        if child is None:
+            continue
+        rows = slice((child_index // 2) * tilesize, (child_index // 2 + 1) * tilesize)
+        cols = slice((child_index % 2) * tilesize, (child_index % 2 + 1) * tilesize)
+        valid = numpy.asarray(child[1]) > 0
+        mosaic[:, rows, cols] = numpy.where(valid, child[0], 0)
+        weights[rows, cols] = valid
+    block_sums = mosaic.reshape(band_count, tilesize, 2, tilesize, 2).sum(axis=(2, 4))
+    block_weights = weights.reshape(tilesize, 2, tilesize, 2).sum(axis=(1, 3))
+    tile_data = numpy.divide(block_sums, block_weights, out=numpy.zeros_like(block_sums), where=block_weights > 0)
+    if numpy.issubdtype(dtype, numpy.integer):
+        tile_data = numpy.rint(tile_data)
+    return tile_data.astype(dtype), numpy.where(block_weights > 0, 255, 0).astype('uint8')
+
+
+def render_pyramid(render_tile_tasks):
+    """Рендеринг пирамиды тайлов снизу вверх.
+
+    Из источника читаются только тайлы наибольшего уровня увеличения группы (окном метатайла, если возможно),
+    тайлы меньших уровней строятся уменьшением 2×2 мозаики четырёх тайлов-потомков в памяти (см.
+    downsample_children). Маска, прозрачность, палитра и кодирование обрабатываются render_tile, как при чтении
+    тайла из источника.
+    """
+    from rio_tiler.models import ImageData
+
+    if not render_tile_tasks:
+        return []
+    tasks_by_zoom = {}
+    for render_tile_task in render_tile_tasks:
+        tasks_by_zoom.setdefault(render_tile_task.z, []).append(render_tile_task)
+    max_zoom, min_zoom = max(tasks_by_zoom), min(tasks_by_zoom)
+    leaf_tasks = tasks_by_zoom[max_zoom]
+    prefetch_tiles(leaf_tasks, read_all=True)
+    filenames = [input_filename for input_filename, _ in tile_sources(leaf_tasks[0])]
+    band_counts = {}
+    level = {}
+    for render_tile_task in leaf_tasks:
+        level_tiles = {}
+        for input_filename in filenames:
+            tile, band_counts[input_filename] = render_tile_task.prefetched_tiles[input_filename]
+            # Копии: render_tile изменяет данные и маску прочитанного тайла
+            level_tiles[input_filename] = None if tile is None else (tile.data.copy(), numpy.array(tile.mask))
+        level[(render_tile_task.x, render_tile_task.y)] = level_tiles
+    results = [render_tile(render_tile_task) for render_tile_task in leaf_tasks]
+    for z in range(max_zoom - 1, min_zoom - 1, -1):
+        parents = {(x // 2, y // 2) for x, y in level} | {(task.x, task.y) for task in tasks_by_zoom.get(z, [])}
+        level = {
+            (x, y): {
+                input_filename: downsample_children([level.get((2 * x + dx, 2 * y + dy), {}).get(input_filename)
+                                                     for dy in (0, 1) for dx in (0, 1)], band_counts[input_filename])
+                for input_filename in filenames
+            }
+            for x, y in parents
+        }
+        for render_tile_task in tasks_by_zoom.get(z, []):
+            render_tile_task.prefetched_tiles = {
+                input_filename: (None if tile is None else ImageData(tile[0].copy(), tile[1].copy()),
+                                 band_counts[input_filename])
+                for input_filename, tile in level[(render_tile_task.x, render_tile_task.y)].items()
+            }
+            results.append(render_tile(render_tile_task))
+    return results
+
+
+def render_batch(args):
+    """Рендеринг пакета задач вида kind: tiles — тайлы по отдельности, metatile — метатайл (см. render_metatile),
+    pyramid — пирамида снизу вверх (см. render_pyramid), batch — последовательность пакетов (вид, задачи)."""
+    kind, render_tile_tasks = args
+    if kind == 'batch':
+        return [result for unit in render_tile_tasks for result in render_batch(unit)]
+    if kind == 'metatile':
+        return render_metatile(render_tile_tasks)
+    if kind == 'pyramid':
+        return render_pyramid(render_tile_tasks)
+    return [render_tile(render_tile_task) for render_tile_task in render_tile_tasks]
+
+
+def timed_render_batch(args):
+    """Рендеринг пакета задач (см. render_batch) с измерением длительности: (результаты, секунды)."""
+    render_start = time.perf_counter()
+    results = render_batch(args)
+    return results, time.perf_counter() - render_start
+
+
+def queue_worker(args):
+    """Исполнитель очереди задач: захватывает пакеты открытых заданий, рендерит их и сообщает результаты.
+
+    Завершается, если в течение idle_timeout секунд нет пакетов (без idle_timeout — работает бессрочно).
+    Возвращает количество отрендеренных пакетов.
+    """
+    queue_url = args[0]
+    worker = args[1]
+    poll_interval = args[2]
+    idle_timeout = args[3] if len(args) > 3 else None
+    work_queue = open_work_queue(queue_url)
+    rendered = 0
+    idle_since = time.monotonic()
+    while True:
+        claimed = work_queue.claim(worker)
+        if claimed is None:
+            if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                return rendered
+            time.sleep(poll_interval)
+            continue
+        job, batch_id, kind, render_tile_tasks = claimed
+        try:
+            results = render_batch((kind, render_tile_tasks))
+        except Exception:
+            work_queue.fail(job, batch_id, traceback.format_exc())
+        else:
+            work_queue.complete(job, batch_id, results)
+            rendered += 1
+        idle_since = time.monotonic()
 
 
 def isolines_from_band(isolines_task: IsolinesTask):
+    from rasterio.apps.contour import build_contour
+
     return build_contour(source_raster_filename=isolines_task.input_filename,
                          output_vector_filename=isolines_task.output_filename,
                          elevation_interval=isolines_task.elevation_interval)
@@ -180,27 +555,220 @@ def translate_raster(translate_task: TranslateTask):
                      output_dtype=translate_task.output_dtype)
 
 
+def intermediate_creation_options(block_size=256, compression='LZW'):
+    """Параметры создания промежуточных GTiff: внутреннее тайлирование блоками, кратными размеру тайла,
+    и быстрое сжатие с предиктором."""
+    block_size = max(16, (block_size + 15) // 16 * 16)
+    creation_options = {
+        'tiled': True,
+        'blockxsize': block_size,
+        'blockysize': block_size,
+        'bigtiff': 'IF_SAFER'
+    }
+    if compression and compression != 'NONE':
+        creation_options.update(compress=compression, predictor=2)
+    return creation_options
+
+
+def windowed_translate(input_filename, output_filename, memory_limit=DEFAULT_STRIP_MEMORY, block_size=256,
+                       compression='LZW', output_dtype='uint8', mask_filenames=None):
+    """Запись растра в тайлированный GTiff полосами из целого числа рядов блоков, каждая из которых
+    укладывается в memory_limit байт.
+
+    Маска растра копируется внутренней маской результата, если её не передаёт перенесённое nodata.
+    mask_filenames — растры той же сетки, маски которых объединяются вместо маски растра (источники VRT:
+    GDAL не всегда передаёт их внутренние маски через VRT, см. scale_band_to_byte).
+    """
+    with rasterio.open(input_filename) as input_rio, ExitStack() as mask_stack:
+        itemsize = numpy.dtype(output_dtype).itemsize
+        nodata = input_rio.nodata
+        if nodata is not None and numpy.issubdtype(numpy.dtype(output_dtype), numpy.integer):
+            dtype_info = numpy.iinfo(output_dtype)
+            if not dtype_info.min <= nodata <= dtype_info.max:
+                nodata = None
+        if compression == 'NONE' and input_rio.width * input_rio.height * input_rio.count * itemsize > memory_limit:
+            # Растр больше бюджета памяти: сжимаем, чтобы не переполнять временный каталог
+            compression = 'LZW'
+        profile = {
+            'driver': 'GTiff',
+            'width': input_rio.width,
+            'height': input_rio.height,
+            'count': input_rio.count,
+            'dtype': output_dtype,
+            'crs': input_rio.crs,
+            'transform': input_rio.transform,
+            'nodata': nodata
+        }
+        profile.update(intermediate_creation_options(block_size, compression))
+        if mask_filenames:
+            mask_sources = [mask_stack.enter_context(rasterio.open(mask_filename)) for mask_filename in mask_filenames]
+            if not all(has_own_mask(mask_rio) for mask_rio in mask_sources):
+                # Источник без маски валиден целиком, а с ним и объединённая маска
+                mask_sources = []
+        elif nodata is not None and all(band_flags == [MaskFlags.nodata] for band_flags in input_rio.mask_flag_enums):
+            # nodata, перенесённое в результат, маскирует его само
+            mask_sources = []
+        else:
+            mask_sources = [input_rio] if has_own_mask(input_rio) else []
+        rows = strip_rows(input_rio.width, input_rio.count + bool(mask_sources), itemsize, memory_limit,
+                          input_rio.height)
+        rows = max(profile['blockysize'], rows // profile['blockysize'] * profile['blockysize'])
+        with rasterio.open(output_filename, 'w', **profile) as output_rio:
+            for row_off in range(0, input_rio.height, rows):
+                window = Window(0, row_off, input_rio.width, min(rows, input_rio.height - row_off))
+                output_rio.write(input_rio.read(window=window, out_dtype=output_dtype), window=window)
+                if mask_sources:
+                    output_rio.write_mask(numpy.maximum.reduce([mask_rio.dataset_mask(window=window)
+                                                                for mask_rio in mask_sources]), window=window)
+    return output_filename
+
+
 def vrt_to_raster(args):
     input_filename = args[0]
     output_directory = args[1]
-    filename = f'{os.path.splitext(input_filename)[0]}_{int(random.randint(0, 1000000))}.tiff'
-    output_filename = os.path.join(output_directory, filename)
-    translate_task = TranslateTask(input_filename=input_filename,
-                                   output_filename=output_filename,
-                                   output_format='GTiff',
-                                   output_dtype='Byte')
-    return translate_raster(translate_task)
+    memory_limit = args[2] if len(args) > 2 and args[2] else DEFAULT_STRIP_MEMORY
+    block_size = args[3] if len(args) > 3 else 256
+    compression = args[4] if len(args) > 4 else 'LZW'
+    mask_filenames = args[5] if len(args) > 5 else None
+    output_filename = intermediate_filename(output_directory, 'raster', [input_filename], [block_size, compression])
+    return windowed_translate(input_filename, output_filename, memory_limit, block_size, compression,
+                              mask_filenames=mask_filenames)
+
+
+def _read_valid(input_rio, window):
+    data = input_rio.read(1, window=window, out_dtype='float64')
+    valid = (input_rio.read_masks(1, window=window) > 0) & numpy.isfinite(data)
+    return data, valid
+
+
+def scale_band_to_byte(args):
+    """Преобразование канала в 8 бит векторизованно, полосами в пределах memory_limit байт.
+
+    Если диапазон не зафиксирован в спецификации шкалы colormap (min/max), первым проходом вычисляются
+    мин/макс валидных пикселей канала. Результат — тайлированный GTiff с внутренней маской nodata.
+    Возвращает (имя файла, мин, макс).
+    """
+    input_filename = args[0]
+    colormap = args[1] or {}
+    output_directory = args[2]
+    memory_limit = args[3] if len(args) > 3 and args[3] else DEFAULT_STRIP_MEMORY
+    block_size = args[4] if len(args) > 4 else 256
+    compression = args[5] if len(args) > 5 else 'LZW'
+    output_filename = intermediate_filename(output_directory, 'byte', [input_filename],
+                                            [colormap, block_size, compression])
+    cached = cached_stage_result(output_filename)
+    if cached is not None:
+        return tuple(cached)
+    with rasterio.open(input_filename) as input_rio, atomic_output(output_filename) as tmp_filename:
+        profile = {
+            'driver': 'GTiff',
+            'width': input_rio.width,
+            'height': input_rio.height,
+            'count': 1,
+            'dtype': 'uint8',
+            'crs': input_rio.crs,
+            'transform': input_rio.transform,
+            'nodata': None
+        }
+        profile.update(intermediate_creation_options(block_size, compression))
+        # Буферы полосы: значения и нормированные значения float64, маска и результат
+        rows = strip_rows(input_rio.width, 1, 9, memory_limit, input_rio.height)
+        rows = max(profile['blockysize'], rows // profile['blockysize'] * profile['blockysize'])
+        windows = [Window(0, row_off, input_rio.width, min(rows, input_rio.height - row_off))
+                   for row_off in range(0, input_rio.height, rows)]
+        band_min, band_max = colormap.get('min'), colormap.get('max')
+        if band_min is None or band_max is None:
+            strip_mins, strip_maxs = [], []
+            for window in windows:
+                data, valid = _read_valid(input_rio, window)
+                if valid.any():
+                    strip_mins.append(data[valid].min())
+                    strip_maxs.append(data[valid].max())
+            if band_min is None:
+                band_min = float(min(strip_mins)) if strip_mins else 0.0
+            if band_max is None:
+                band_max = float(max(strip_maxs)) if strip_maxs else 0.0
+        with rasterio.open(tmp_filename, 'w', **profile) as output_rio:
+            for window in windows:
+                data, valid = _read_valid(input_rio, window)
+                output_rio.write(scale_to_byte(data, valid, band_min, band_max, colormap.get('scale', 'linear'),
+                                               colormap.get('gamma', 1.0)), 1, window=window)
+                output_rio.write_mask(numpy.where(valid, 255, 0).astype('uint8'), window=window)
+    return tuple(store_stage_result(output_filename, [output_filename, band_min, band_max]))
+
+
+def apply_cutline_mask(args):
+    """Обрезка канала по геометрии: растр кадрируется по охвату геометрии, пиксели вне неё заменяются nodata.
+
+    Маска геометрии растеризуется один раз на сетку и кэшируется в mask_cache_directory.
+    Результат — тайлированный GTiff, записываемый полосами в пределах memory_limit байт.
+    """
+    input_filename = args[0]
+    geometry = args[1]
+    output_directory = args[2]
+    mask_cache_directory = args[3]
+    nodata = args[4]
+    memory_limit = args[5] if len(args) > 5 and args[5] else DEFAULT_STRIP_MEMORY
+    block_size = args[6] if len(args) > 6 else 256
+    compression = args[7] if len(args) > 7 else 'LZW'
+    output_filename = intermediate_filename(output_directory, 'cut', [input_filename],
+                                            [geometry, nodata, block_size, compression])
+    cached = cached_stage_result(output_filename)
+    if cached is not None:
+        return cached
+    with rasterio.open(input_filename) as input_rio, atomic_output(output_filename) as tmp_filename:
+        window = cutline_window(input_rio, geometry)
+        transform = input_rio.window_transform(window)
+        width, height = int(window.width), int(window.height)
+        mask = cutline_mask(geometry, transform, width, height, mask_cache_directory)
+        if nodata is None:
+            nodata = input_rio.nodata if input_rio.nodata is not None else numpy.nan
+        profile = {
+            'driver': 'GTiff',
+            'width': width,
+            'height': height,
+            'count': input_rio.count,
+            'dtype': input_rio.dtypes[0],
+            'crs': input_rio.crs,
+            'transform': transform,
+            'nodata': nodata
+        }
+        profile.update(intermediate_creation_options(block_size, compression))
+        rows = strip_rows(width, input_rio.count, numpy.dtype(input_rio.dtypes[0]).itemsize, memory_limit, height)
+        rows = max(profile['blockysize'], rows // profile['blockysize'] * profile['blockysize'])
+        with rasterio.open(tmp_filename, 'w', **profile) as output_rio:
+            for row_off in range(0, height, rows):
+                strip_height = min(rows, height - row_off)
+                source_window = Window(window.col_off, window.row_off + row_off, width, strip_height)
+                data = input_rio.read(window=source_window)
+                valid = (input_rio.dataset_mask(window=source_window) > 0) & mask[row_off:row_off + strip_height]
+                data[:, ~valid] = nodata
+                output_window = Window(0, row_off, width, strip_height)
+                output_rio.write(data, window=output_window)
+                output_rio.write_mask(numpy.where(valid, 255, 0).astype('uint8'), window=output_window)
+    return store_stage_result(output_filename, output_filename)
 
 
 def calculate_band_minmax(args):
     input_filename = args
+    # Мин/макс кэшируются рядом с каналом, если он хранится в кэше этапов
+    output_filename = intermediate_filename(os.path.dirname(input_filename), 'minmax', [input_filename],
+                                            extension='.json')
+    cached = cached_stage_result(output_filename)
+    if cached is not None:
+        return cached
     with rasterio.open(input_filename) as input_riods:
         stats = input_riods.statistics(1, approx=False, clear_cache=True)
 
-    return [stats.min, stats.max]
+    return store_stage_result(output_filename, [stats.min, stats.max], [input_filename])
 
 
 def extract_isoline_properties(feature):
+    from shapely import simplify
+    from shapely.geometry import shape, mapping
+
+    from grib_tiler.utils import fiona_bbox
+
     global simplify_coeff
     with lock:
         isoline = {
@@ -224,6 +792,8 @@ def extract_isoline_properties(feature):
 
 
 def band_isolines(args):
+    import fiona
+
     global simplify_coeff
     isolines_json = {
         "isoline": [
@@ -235,8 +805,8 @@ def band_isolines(args):
     elevation_interval = args[2]
     simplify_epsilon = args[3]
     simplify_coeff = simplify_epsilon
-    filename = f'{os.path.splitext(input_filename)[0]}_isolines_{int(random.randint(0, 1000000))}.gpkg'
-    output_filename = os.path.join(output_directory, filename)
+    output_filename = intermediate_filename(output_directory, 'isolines', [input_filename], [elevation_interval],
+                                            '.gpkg')
     isolines_task = IsolinesTask(input_filename=input_filename,
                                  output_filename=output_filename,
                                  elevation_interval=elevation_interval)
@@ -245,6 +815,7 @@ def band_isolines(args):
         with multiprocessing.Pool(os.cpu_count()) as isoline_extract_pool:
             for result in isoline_extract_pool.map(extract_isoline_properties, isolines_vds):
                 isolines_json["isoline"].append(result)
+    remove_intermediate(isolines_filename)
     return isolines_json
 
 
@@ -258,95 +829,73 @@ def warp_band(args):
     output_directory = args[6]
     crop_to_cutline = args[7]
     dest_nodata = args[8]
-    warp_task = WarpTask(input_filename=input_filename,
-                         output_directory=output_directory,
-                         output_crs=output_crs,
-                         target_extent=output_crs_bounds,
-                         target_extent_crs=bounds_crs,
-                         cutline_filename=cutline_filename,
-                         cutline_layer_name=cutline_layer,
-                         output_format='VRT',
-                         crop_to_cutline=crop_to_cutline,
-                         destination_nodata=dest_nodata
-                         )
-    return warp_raster(warp_task)
+    warp_threads = args[9] if len(args) > 9 else 1
+    output_filename = intermediate_filename(output_directory, 'warp', [input_filename],
+                                            [output_crs, output_crs_bounds, bounds_crs, cutline_filename,
+                                             cutline_layer, crop_to_cutline, dest_nodata], '.vrt')
+    cached = cached_stage_result(output_filename)
+    if cached is not None:
+        return cached
+    with atomic_output(output_filename) as tmp_filename:
+        warp_raster(WarpTask(input_filename=input_filename,
+                             output_directory=output_directory,
+                             output_filename=tmp_filename,
+                             output_crs=output_crs,
+                             target_extent=output_crs_bounds,
+                             target_extent_crs=bounds_crs,
+                             cutline_filename=cutline_filename,
+                             cutline_layer_name=cutline_layer,
+                             output_format='VRT',
+                             crop_to_cutline=crop_to_cutline,
+                             destination_nodata=dest_nodata,
+                             multithreading=warp_threads > 1,
+                             threads=warp_threads))
+    return store_stage_result(output_filename, output_filename, [input_filename])
+
+
+def vrt_references(vrt_filename, source_filename):
+    """Ссылается ли VRT на source_filename. Ключ извлечённого канала — хэш содержимого входного файла, поэтому
+    VRT кэша этапов может ссылаться на прежний путь файла с тем же содержимым (например, на удалённую копию)."""
+    try:
+        with rasterio.open(vrt_filename) as vrt_rio:
+            return source_filename in vrt_rio.files
+    except rasterio.errors.RasterioIOError:
+        return False
 
 
 def extract_band(args):
     input_filename = args[0]
     band = args[1]
     output_directory = args[2]
-    filename = f'{os.path.splitext(input_filename)[0].replace(" ", "_")}_{int(random.randint(0, 1000000))}.vrt'
-    output_filename = os.path.join(output_directory, filename)
-    translate_task = TranslateTask(input_filename=input_filename,
-                                   output_filename=output_filename,
-                                   band=band,
-                                   output_dtype=None)
-    return translate_raster(translate_task)
-
-
-def precut_bands(args):
-    input_filename = args[0]
-    band = args[1]
-    output_directory = args[2]
-    output_crs = 'EPSG:4326'
-    target_extent = CRS.from_epsg(4326).area_of_use.bounds,
-    target_extent_crs = 'EPSG:4326'
-    warp_task = WarpTask(input_filename=input_filename,
-                         output_directory=output_directory,
-                         output_crs=output_crs,
-                         target_extent=target_extent,
-                         target_extent_crs=target_extent_crs,
-                         output_format='VRT')
-    return warp_raster(warp_task), band, output_directory
-
-
-def warp_bands(args):
-    input_filename = args[0]
-    band = args[1]
-    output_directory = args[2]
-    output_crs = args[3]
-    target_extent = args[4]
-    target_extent_crs = args[5]
-    cutline_filename = args[6]
-    cutline_layer = args[7]
-    warp_task = WarpTask(input_filename=input_filename,
-                         output_directory=output_directory,
-                         output_crs=output_crs,
-                         target_extent=target_extent,
-                         target_extent_crs='EPSG:4326',
-                         cutline_filename=cutline_filename,
-                         cutline_layer_name=cutline_layer,
-                         output_format='VRT')
-    return warp_raster(warp_task), band, output_directory
-
-
-def calculate_inrange_bands(args):
-    input_filename = args[0]
-    bands = args[1]
-    inrange_task = InRangeTask(input_filename=input_filename,
-                               bands=bands)
-    return input_filename, bands, in_range_calculator(inrange_task)
-
-
-def transalte_bands_to_byte(args):
-    input_filename = args[0]
-    scale = args[1]
-    output_directory = args[2]
-    filename = f'{os.path.splitext(input_filename)[0]}_byte.vrt'
-    output_filename = os.path.join(output_directory, filename)
-    translate_task = TranslateTask(input_filename=input_filename,
-                                   output_filename=output_filename,
-                                   scale=scale,
-                                   output_dtype='Byte')
-    return translate_raster(translate_task)
+    message_range = args[3] if len(args) > 3 else None
+    output_filename = intermediate_filename(output_directory, 'extract', [input_filename], [band], '.vrt')
+    input_filename = os.path.abspath(input_filename)
+    if message_range:
+        # Канал читается из отдельного сообщения без разбора заголовков остальных сообщений файла
+        input_filename, band = message_subfile(input_filename, message_range), 1
+    cached = cached_stage_result(output_filename)
+    if cached is not None and vrt_references(output_filename, input_filename):
+        return cached
+    with atomic_output(output_filename) as tmp_filename:
+        translate_raster(TranslateTask(input_filename=input_filename,
+                                       output_filename=tmp_filename,
+                                       band=band,
+                                       output_dtype=None))
+    return store_stage_result(output_filename, output_filename)
 
 
 def concatenate_bands(args):
     input_filenames = args[0]
     output_directory = args[1]
-    filename = f'{str(random.randint(0, 1000000))}_conc.vrt'
-    output_filename = os.path.join(output_directory, filename)
+    output_filename = intermediate_filename(output_directory, 'concat', input_filenames, extension='.vrt')
     vrt_task = VirtualTask(input_filename=input_filenames,
                            output_filename=output_filename)
     return concatenate_raster(vrt_task)
+
+
+def publish_tiling_source(args):
+    warp_map_directory = args[0]
+    input_filename = args[1]
+    nodata = args[2]
+    memory_limit = args[3]
+    return publish_warp_source(warp_map_directory, input_filename, nodata, memory_limit)
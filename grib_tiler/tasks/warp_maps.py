@@ -0,0 +1,291 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from pyproj import Transformer
+
+from grib_tiler.data.tms import load_tile_grid
+from grib_tiler.utils.resources import strip_rows
+
+WARP_SOURCE_CACHE_SIZE = 4
+SEPARABLE_SAMPLES = 9
+SEPARABLE_TOLERANCE = 1e-3  # в пикселях исходной сетки
+
+_warp_sources = OrderedDict()
+
+
+def _dataset_signature(input_rio):
+    transform = input_rio.transform
+    return (input_rio.width, input_rio.height, (transform.a, transform.b, transform.c, transform.d, transform.e, transform.f),
+            input_rio.crs.to_wkt() if input_rio.crs else None)
+
+
+def grid_signature(input_filename):
+    """Сигнатура сетки растра: размеры, геотрансформация и система координат."""
+    with rasterio.open(input_filename) as input_rio:
+        return _dataset_signature(input_rio)
+
+
+def warp_map_key(signature, output_crs, tilesize):
+    key_source = json.dumps([list(signature), output_crs, tilesize])
+    return hashlib.sha1(key_source.encode('utf-8')).hexdigest()
+
+
+def warp_map_filename(warp_map_directory, key, z, x, y):
+    return os.path.join(warp_map_directory, key, str(z), str(x), f'{y}.npy')
+
+
+@lru_cache(maxsize=16)
+def _transformer(output_crs, source_crs_wkt):
+    return Transformer.from_crs(output_crs, source_crs_wkt, always_xy=True)
+
+
+def _source_pixels(output_crs, signature, xs, ys):
+    """Дробные координаты (столбец, строка) исходной сетки для точек (xs, ys) выходной СК."""
+    width, height, (a, b, c, d, e, f), source_crs_wkt = signature
+    source_xs, source_ys = _transformer(output_crs, source_crs_wkt).transform(xs, ys)
+    source_west = c if a > 0 else c + a * width
+    # Сетки с долготами 0..360
+    source_xs = np.where(source_xs < source_west, source_xs + 360.0, source_xs)
+    # Обратная геотрансформация
+    determinant = a * e - b * d
+    cols = (e * (source_xs - c) - b * (source_ys - f)) / determinant
+    rows = (a * (source_ys - f) - d * (source_xs - c)) / determinant
+    return cols - 0.5, rows - 0.5
+
+
+def compute_warp_map(output_crs, z, x, y, tilesize, signature):
+    """Карта перепроецирования тайла: дробные координаты (столбец, строка) центров пикселей исходной сетки.
+
+    Если столбец зависит только от столбца тайла, а строка — только от строки (например, EPSG:4326 → EPSG:3857),
+    карта разделима и хранится векторами: массив формы (2, tilesize). Иначе — массив формы
+    (2, tilesize, tilesize) для каждого пикселя тайла.
+    """
+    left, bottom, right, top = load_tile_grid(output_crs, tilesize).bounds(z, x, y)
+    xs = left + (np.arange(tilesize) + 0.5) * ((right - left) / tilesize)
+    ys = top - (np.arange(tilesize) + 0.5) * ((top - bottom) / tilesize)
+    sample = np.unique(np.linspace(0, tilesize - 1, SEPARABLE_SAMPLES).round().astype('intp'))
+    sample_cols, sample_rows = _source_pixels(output_crs, signature, *np.meshgrid(xs[sample], ys[sample]))
+    if np.all(np.isfinite(sample_cols)) and np.all(np.isfinite(sample_rows)) and \
+            np.ptp(sample_cols, axis=0).max() <= SEPARABLE_TOLERANCE and \
+            np.ptp(sample_rows, axis=1).max() <= SEPARABLE_TOLERANCE:
+        cols, _ = _source_pixels(output_crs, signature, xs, np.full(tilesize, ys[tilesize // 2]))
+        _, rows = _source_pixels(output_crs, signature, np.full(tilesize, xs[tilesize // 2]), ys)
+        return np.stack([cols, rows]).astype('float32')
+    cols, rows = _source_pixels(output_crs, signature, *np.meshgrid(xs, ys))
+    return np.stack([cols, rows]).astype('float32')
+
+
+def expand_warp_map(warp_map):
+    """Карта перепроецирования в виде (столбцы, строки) для каждого пикселя тайла; разделимая карта
+    разворачивается представлениями без копирования."""
+    if warp_map.ndim == 3:
+        return warp_map
+    tilesize = warp_map.shape[1]
+    return (np.broadcast_to(warp_map[0][np.newaxis, :], (tilesize, tilesize)),
+            np.broadcast_to(warp_map[1][:, np.newaxis], (tilesize, tilesize)))
+
+
+def warp_map_intersects(warp_map, signature):
+    """Попадает ли хотя бы один пиксель тайла в пределы исходной сетки."""
+    width, height = signature[:2]
+    cols, rows = np.asarray(warp_map[0]), np.asarray(warp_map[1])
+    if warp_map.ndim == 2:
+        return bool(np.any((cols >= -0.5) & (cols <= width - 0.5)) and np.any((rows >= -0.5) & (rows <= height - 0.5)))
+    return bool(np.any((cols >= -0.5) & (cols <= width - 0.5) & (rows >= -0.5) & (rows <= height - 0.5)))
+
+
+def load_warp_map(warp_map_directory, output_crs, z, x, y, tilesize, signature):
+    """Загрузка карты перепроецирования из кэша (с отображением в память) или её вычисление при первом рендеринге
+    тайла. В кэш сохраняются только карты тайлов, пересекающихся с исходной сеткой."""
+    filename = warp_map_filename(warp_map_directory, warp_map_key(signature, output_crs, tilesize), z, x, y)
+    if os.path.exists(filename):
+        return expand_warp_map(np.load(filename, mmap_mode='r'))
+    warp_map = compute_warp_map(output_crs, z, x, y, tilesize, signature)
+    if not warp_map_intersects(warp_map, signature):
+        return expand_warp_map(warp_map)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp_filename, 'wb') as warp_map_fp:
+        np.save(warp_map_fp, warp_map)
+    os.replace(tmp_filename, filename)
+    return expand_warp_map(warp_map)
+
+
+def shared_source_filenames(warp_map_directory, input_filename, nodata=None):
+    """Пути к массивам данных и маски допустимых пикселей растра, опубликованным publish_warp_source.
+
+    Промежуточные растры адресуются по содержимому, поэтому имени растра достаточно для имени массивов.
+    """
+    stem = os.path.join(warp_map_directory, 'sources', f'{os.path.basename(input_filename)}.{nodata}')
+    return f'{stem}.data.npy', f'{stem}.valid.npy'
+
+
+def publish_warp_source(warp_map_directory, input_filename, nodata=None, memory_limit=None):
+    """Публикация растра для рабочих процессов: данные и маска допустимых пикселей записываются полосами в пределах
+    memory_limit байт в несжатые файлы .npy в подкаталоге sources кэша карт перепроецирования.
+
+    Рабочие процессы отображают их в память (см. WarpSource), поэтому страницы растра разделяются через страничный
+    кэш ОС, а не копируются и не декодируются заново в каждом процессе. Кэш карт должен располагаться на диске:
+    на tmpfs массивы целиком занимают оперативную память.
+    """
+    data_filename, valid_filename = shared_source_filenames(warp_map_directory, input_filename, nodata)
+    if os.path.exists(data_filename) and os.path.exists(valid_filename):
+        return data_filename, valid_filename
+    os.makedirs(os.path.dirname(data_filename), exist_ok=True)
+    with rasterio.open(input_filename) as input_rio:
+        tmp_suffix = f'.{os.getpid()}.tmp.npy'
+        data = np.lib.format.open_memmap(data_filename + tmp_suffix, mode='w+', dtype=input_rio.dtypes[0],
+                                         shape=(input_rio.count, input_rio.height, input_rio.width))
+        valid = np.lib.format.open_memmap(valid_filename + tmp_suffix, mode='w+', dtype='bool',
+                                          shape=(input_rio.height, input_rio.width))
+        rows = strip_rows(input_rio.width, input_rio.count, data.dtype.itemsize,
+                          memory_limit or input_rio.height * input_rio.width * input_rio.count * data.dtype.itemsize,
+                          input_rio.height)
+        for row_start in range(0, input_rio.height, rows):
+            window = Window(0, row_start, input_rio.width, min(rows, input_rio.height - row_start))
+            strip_data, strip_valid = read_valid_strip(input_rio, window, nodata)
+            data[:, row_start:row_start + window.height] = strip_data
+            valid[row_start:row_start + window.height] = strip_valid
+        data.flush()
+        valid.flush()
+        del data, valid
+    os.replace(data_filename + tmp_suffix, data_filename)
+    os.replace(valid_filename + tmp_suffix, valid_filename)
+    return data_filename, valid_filename
+
+
+def unpublish_warp_source(warp_map_directory, input_filename, nodata=None):
+    """Удаление массивов растра, опубликованных publish_warp_source."""
+    for filename in shared_source_filenames(warp_map_directory, input_filename, nodata):
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+
+def read_valid_strip(input_rio, window=None, nodata=None):
+    data = input_rio.read(window=window)
+    valid = input_rio.dataset_mask(window=window) > 0
+    if nodata is not None:
+        valid &= ~np.any(data == nodata, axis=0)
+    return data, valid
+
+
+class WarpSource:
+    """Исходный растр для перепроецирования по картам.
+
+    Растр, опубликованный publish_warp_source в каталоге warp_map_directory, отображается в память без копирования. Иначе, если растр
+    укладывается в memory_limit байт (или лимит не задан), он читается в память целиком один раз на процесс,
+    а если нет — для каждого тайла читается только окно, покрываемое картой перепроецирования.
+    """
+
+    def __init__(self, input_filename, nodata=None, memory_limit=None, warp_map_directory=None):
+        self.nodata = nodata
+        self.identity = _file_identity(input_filename)
+        self.dataset = rasterio.open(input_filename)
+        self.signature = _dataset_signature(self.dataset)
+        self.count = self.dataset.count
+        raster_bytes = (self.dataset.width * self.dataset.height * self.count *
+                        np.dtype(self.dataset.dtypes[0]).itemsize)
+        self.data = self.valid = None
+        data_filename, valid_filename = shared_source_filenames(warp_map_directory, input_filename, nodata) \
+            if warp_map_directory else (None, None)
+        if data_filename and os.path.exists(data_filename) and os.path.exists(valid_filename):
+            self.data = np.load(data_filename, mmap_mode='r')
+            self.valid = np.load(valid_filename, mmap_mode='r')
+        elif memory_limit is None or raster_bytes <= memory_limit:
+            self.data, self.valid = self._read()
+
+    def _read(self, window=None):
+        return read_valid_strip(self.dataset, window, self.nodata)
+
+    def close(self):
+        self.data = self.valid = None
+        self.dataset.close()
+
+    def gather(self, warp_map):
+        if self.data is not None:
+            return bilinear_gather(self.data, self.valid, warp_map)
+        cols = np.asarray(warp_map[0])
+        rows = np.asarray(warp_map[1])
+        col_start = int(max(0, np.floor(cols.min())))
+        row_start = int(max(0, np.floor(rows.min())))
+        col_stop = int(min(self.dataset.width - 1, np.ceil(cols.max())))
+        row_stop = int(min(self.dataset.height - 1, np.ceil(rows.max())))
+        if col_start > col_stop or row_start > row_stop:
+            return None, None
+        data, valid = self._read(Window(col_start, row_start, col_stop - col_start + 1, row_stop - row_start + 1))
+        return bilinear_gather(data, valid, np.stack([cols - col_start, rows - row_start]))
+
+
+def _file_identity(filename):
+    try:
+        file_stat = os.stat(filename)
+    except OSError:
+        return None
+    return file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns
+
+
+def load_warp_source(input_filename, nodata=None, memory_limit=None, warp_map_directory=None):
+    """WarpSource растра, открываемый один раз на процесс.
+
+    Рабочие процессы переживают запуски (демон, исполнители очереди), а промежуточные растры запуска удаляются
+    по его завершении: открытые растры, файлы которых удалены или заменены, закрываются при следующем обращении,
+    чтобы не удерживать место удалённых файлов; открытыми остаются не более WARP_SOURCE_CACHE_SIZE растров.
+    """
+    for key, warp_source in list(_warp_sources.items()):
+        if _file_identity(key[0]) != warp_source.identity:
+            _warp_sources.pop(key).close()
+    key = (input_filename, nodata)
+    if key in _warp_sources:
+        _warp_sources.move_to_end(key)
+    else:
+        _warp_sources[key] = WarpSource(input_filename, nodata, memory_limit, warp_map_directory)
+        while len(_warp_sources) > WARP_SOURCE_CACHE_SIZE:
+            _warp_sources.popitem(last=False)[1].close()
+    return _warp_sources[key]
+
+
+def bilinear_gather(data, valid, warp_map):
+    """Билинейная выборка из data (каналы, строки, столбцы) по карте перепроецирования.
+
+    Невалидные соседи исключаются с перенормировкой весов. Возвращает (данные, маска 0/255) или (None, None),
+    если тайл не пересекается с исходным растром.
+    """
+    height, width = valid.shape
+    cols = np.asarray(warp_map[0])
+    rows = np.asarray(warp_map[1])
+    inside = (cols >= -0.5) & (cols <= width - 0.5) & (rows >= -0.5) & (rows <= height - 0.5)
+    if not inside.any():
+        return None, None
+    cols = np.clip(cols, 0, width - 1)
+    rows = np.clip(rows, 0, height - 1)
+    col0 = np.minimum(np.floor(cols).astype('intp'), width - 2 if width > 1 else 0)
+    row0 = np.minimum(np.floor(rows).astype('intp'), height - 2 if height > 1 else 0)
+    col1 = np.minimum(col0 + 1, width - 1)
+    row1 = np.minimum(row0 + 1, height - 1)
+    col_frac = cols - col0
+    row_frac = rows - row0
+
+    result = np.zeros((data.shape[0],) + cols.shape, dtype='float64')
+    weights_sum = np.zeros(cols.shape, dtype='float64')
+    for corner_rows, corner_cols, weights in (
+            (row0, col0, (1 - row_frac) * (1 - col_frac)),
+            (row0, col1, (1 - row_frac) * col_frac),
+            (row1, col0, row_frac * (1 - col_frac)),
+            (row1, col1, row_frac * col_frac)):
+        weights = weights * valid[corner_rows, corner_cols]
+        result += data[:, corner_rows, corner_cols] * weights
+        weights_sum += weights
+    has_data = inside & (weights_sum > 0)
+    result /= np.where(has_data, weights_sum, 1.0)
+    if np.issubdtype(data.dtype, np.integer):
+        result = np.rint(result)
+    result[:, ~has_data] = 0
+    return result.astype(data.dtype), np.where(has_data, 255, 0).astype('uint8')
@@ -1,9 +1,10 @@
 from datetime import datetime
 
 import pytz
-import rasterio
 from pyrfc3339.generator import generate
 
+from grib_tiler.utils.catalogue import load_band_catalogue
+
 def explode(coords):
     """Explode a GeoJSON geometry's coordinates object and yield coordinate tuples.
     As long as the input is conforming, the type of the geometry doesn't matter."""
@@ -25,27 +26,18 @@ def get_rfc3339nano_time():
 
 
 def seek_by_meta_value(input_fn, **meta_term):
+    """Поиск каналов по значениям тегов через каталог каналов входного файла (см. load_band_catalogue)."""
+    catalogue = load_band_catalogue(input_fn)
+    with_meta = 'meta' in meta_term
+    only_indexes = meta_term.pop('meta', None)
     results = {}
-    with rasterio.open(input_fn) as input_rio:
-        for bidx in input_rio.indexes:
-            tags = input_rio.tags(bidx)
-            for k, v in meta_term.items():
-                if k in tags:
-                    for _v in v:
-                        if tags[k] == _v:
-                            if 'meta' in meta_term:
-                                if meta_term['meta']:
-                                    if _v in results:
-                                        results[_v].append(bidx)
-                                    else:
-                                        results[_v] = []
-                                        results[_v].append(bidx)
-                            else:
-                                if _v in results:
-                                    results[_v].append({bidx: tags})
-                                else:
-                                    results[_v] = []
-                                    results[_v].append({bidx: tags})
+    for k, v in meta_term.items():
+        for _v in v:
+            for bidx in catalogue['index'].get(k, {}).get(_v, []):
+                if not with_meta:
+                    results.setdefault(_v, []).append({bidx: catalogue['bands'][str(bidx)]})
+                elif only_indexes:
+                    results.setdefault(_v, []).append(bidx)
     return results
 
 
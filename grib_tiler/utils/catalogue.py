@@ -0,0 +1,83 @@
+import json
+import os
+
+CATALOGUE_SUFFIX = '.catalogue.json'
+CATALOGUE_VERSION = 1
+
+
+def catalogue_filename(input_filename):
+    return f'{input_filename}{CATALOGUE_SUFFIX}'
+
+
+def _input_stamp(input_filename):
+    input_stat = os.stat(input_filename)
+    return [input_stat.st_size, input_stat.st_mtime_ns]
+
+
+def build_band_catalogue(input_filename):
+    """Каталог каналов GRIB-файла: теги (GRIB_ELEMENT, GRIB_SHORT_NAME, GRIB_FORECAST_SECONDS, ...) каждого канала
+    и обратный индекс «тег — значение — номера каналов»."""
+    import rasterio
+
+    bands = {}
+    index = {}
+    with rasterio.open(input_filename) as input_rio:
+        for bidx in input_rio.indexes:
+            tags = input_rio.tags(bidx)
+            if input_rio.descriptions[bidx - 1]:
+                tags['DESCRIPTION'] = input_rio.descriptions[bidx - 1]
+            bands[str(bidx)] = tags
+            for key, value in tags.items():
+                index.setdefault(key, {}).setdefault(value, []).append(bidx)
+    return {
+        'version': CATALOGUE_VERSION,
+        'bands': bands,
+        'index': index
+    }
+
+
+def load_band_catalogue(input_filename):
+    """Каталог каналов, кэшируемый рядом с входным файлом и перестраиваемый при изменении файла."""
+    filename = catalogue_filename(input_filename)
+    stamp = _input_stamp(input_filename) if os.path.exists(input_filename) else None
+    if os.path.exists(filename):
+        with open(filename) as catalogue_fp:
+            catalogue = json.load(catalogue_fp)
+        if catalogue.get('version') == CATALOGUE_VERSION and catalogue.get('stamp') == stamp:
+            return catalogue
+    catalogue = build_band_catalogue(input_filename)
+    catalogue['stamp'] = stamp
+    try:
+        tmp_filename = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp_filename, 'w') as catalogue_fp:
+            json.dump(catalogue, catalogue_fp, ensure_ascii=False)
+        os.replace(tmp_filename, filename)
+    except OSError:
+        # Каталог входного файла недоступен для записи: каталог каналов не кэшируется
+        pass
+    return catalogue
+
+
+def parse_band_selection(band_selection):
+    """Разбор условия выбора каналов вида «GRIB_ELEMENT=TMP|UGRD,GRIB_SHORT_NAME=850-ISBL».
+
+    Условия по разным тегам объединяются по «И», перечисленные через «|» значения одного тега — по «ИЛИ».
+    """
+    selection = {}
+    for term in band_selection.split(','):
+        key, separator, values = term.partition('=')
+        if not separator or not key.strip() or not values:
+            raise ValueError(f'Недопустимое условие выбора каналов: {term}')
+        selection.setdefault(key.strip(), []).extend(value.strip() for value in values.split('|'))
+    return selection
+
+
+def select_bands(catalogue, selection):
+    """Номера каналов (по возрастанию), удовлетворяющих условию выбора selection (тег — список значений)."""
+    selected = None
+    for key, values in selection.items():
+        key_bands = set()
+        for value in values:
+            key_bands.update(catalogue['index'].get(key, {}).get(value, []))
+        selected = key_bands if selected is None else selected & key_bands
+    return sorted(selected or [])
@@ -2,11 +2,9 @@ import multiprocessing
 import os
 
 import click
-import rasterio
-from rasterio._path import _parse_path, _UnparsedPath
-from pyproj import CRS
 
 from grib_tiler.utils import get_rfc3339nano_time
+from grib_tiler.utils.catalogue import parse_band_selection
 
 
 def zooms_handler(value):
@@ -68,6 +66,9 @@ def grib_handler(ctx, param, value):
 
 def file_in_handler(ctx, param, value):
     """Normalize ordinary filesystem and VFS paths"""
+    import rasterio.shutil
+    from rasterio._path import _parse_path, _UnparsedPath
+
     try:
         path = _parse_path(value)
 
@@ -107,6 +108,8 @@ def cpu_count_handler(ctx, param, value):
 
 
 def crs_handler(ctx, param, value):
+    from pyproj import CRS
+
     crs_def = None # PureC-style костыль, на стороне PyPROJ
     crs_def = CRS.from_user_input(value) # TODO: пулл-реквест в pyproj для возвращения None-значения при отсутствии определения СК
     if not crs_def:
@@ -206,4 +209,14 @@ def band_handler(ctx, param, value):
     for idx, band_index in enumerate(band_indexes):
         if band_index == 0:
             band_indexes[idx] += 1
-    return ",".join(list(map(str, band_indexes)))
\ No newline at end of file
+    return ",".join(list(map(str, band_indexes)))
+
+
+def band_selection_handler(ctx, param, value):
+    if value:
+        try:
+            parse_band_selection(value)
+        except ValueError as e:
+            click.echo({"level": "fatal", "time": get_rfc3339nano_time(), "msg": str(e)})
+            raise click.BadParameter(str(e))
+    return value
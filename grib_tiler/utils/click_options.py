@@ -3,7 +3,8 @@ import os
 import click
 from click import option, argument, Path, Choice
 
-from grib_tiler.utils.click_handlers import cpu_count_handler, crs_handler, zoom_handler, band_handler
+from grib_tiler.utils.click_handlers import cpu_count_handler, crs_handler, zoom_handler, band_handler, \
+    band_selection_handler, files_in_handler
 
 transparency_opt = option(
     '--transparency',
@@ -46,11 +47,65 @@ files_in_arg = argument(
 
 input_files_arg = argument(
     'input_files',
-    type=Path(resolve_path=True, file_okay=True, dir_okay=False, exists=True),
+    type=str,
+    callback=files_in_handler,
     nargs=-1,
     required=True,
     metavar="INPUT...")
 
+watch_directory_arg = argument(
+    'watch_directory_name',
+    metavar='INPUT_DIRECTORY',
+    required=True,
+    type=Path(resolve_path=True, file_okay=False, dir_okay=True, exists=True))
+
+work_queue_arg = argument(
+    'work_queue',
+    metavar='QUEUE',
+    required=True,
+    type=str)
+
+idle_timeout_opt = option(
+    '--idle-timeout',
+    'idle_timeout',
+    default=None,
+    type=click.FloatRange(0),
+    help='Завершить работу, если в очереди нет пакетов задач дольше заданного времени (в секундах). По умолчанию '
+         'исполнитель работает бессрочно.'
+)
+
+concurrency_opt = option(
+    '--concurrency',
+    'concurrency',
+    default=2,
+    type=click.IntRange(1),
+    help='Максимальное количество одновременно обрабатываемых входных файлов.'
+)
+
+poll_interval_opt = option(
+    '--poll-interval',
+    'poll_interval',
+    default=1.0,
+    type=click.FloatRange(0.1),
+    help='Интервал опроса каталога (в секундах).'
+)
+
+polling_opt = option(
+    '--polling',
+    'force_polling',
+    is_flag=True,
+    default=False,
+    help='Отслеживать каталог опросом, даже если доступен inotify.'
+)
+
+daemon_state_opt = option(
+    '--state',
+    'state_filename',
+    default=None,
+    type=Path(resolve_path=True, dir_okay=False),
+    help='Файл реестра обработанных файлов (по умолчанию .grib_tiler_processed.json в выходном каталоге).'
+)
+
 output_directory_arg = argument(
     'output_directory',
     metavar='OUTPUT',
@@ -63,6 +118,213 @@ file_out_arg = argument(
     required=True,
     type=Path(resolve_path=True, file_okay=False))
 
+batch_opt = option(
+    '--batch',
+    'is_batch',
+    is_flag=True,
+    default=False,
+    help='Пакетный режим: каждый входной файл тайлируется в собственный подкаталог выходного каталога.'
+)
+
+warp_cache_opt = option(
+    '--warp-cache',
+    'warp_cache_directory',
+    default=None,
+    type=Path(resolve_path=True, file_okay=False),
+    help='Каталог кэша карт перепроецирования тайлов. Карты вычисляются при первом рендеринге тайла один раз для '
+         'сетки, выходной СК и размера тайла и переиспользуются между каналами и запусками; сохраняются только '
+         'карты тайлов, пересекающихся с сеткой.'
+)
+
+manifest_opt = option(
+    '--manifest',
+    'write_manifest',
+    is_flag=True,
+    default=False,
+    help='Записывать manifest.json с хэшами тайлов в каждый выходной каталог.'
+)
+
+delta_opt = option(
+    '--delta-from',
+    'delta_directory',
+    default=None,
+    type=Path(resolve_path=True, file_okay=False, exists=True),
+    help='Выходной каталог предыдущего запуска: тайлы, не изменившиеся относительно него, не записываются, '
+         'а ссылки на них заносятся в manifest.json.'
+)
+
+memory_budget_opt = option(
+    '--memory-budget',
+    'memory_budget',
+    default=None,
+    type=click.IntRange(1),
+    help='Бюджет памяти (в МиБ) рабочих процессов: растры обрабатываются полосами, количество процессов и сжатие '
+         'промежуточных файлов (LZW) подбираются так, чтобы не превышать его. Списки тайлов и задач основного '
+         'процесса в бюджет не входят.'
+)
+
+intermediate_compression_opt = option(
+    '--intermediate-compression',
+    'intermediate_compression',
+    default='LZW',
+    type=Choice(['LZW', 'ZSTD', 'DEFLATE', 'NONE']),
+    help='Сжатие промежуточных GTiff-растров.'
+)
+
+temp_root_opt = option(
+    '--temp-dir',
+    'temp_root',
+    default=None,
+    type=Path(resolve_path=True, file_okay=False, exists=True),
+    help='Каталог для промежуточных файлов, например tmpfs (/dev/shm). По умолчанию — системный временный каталог.'
+)
+
+gdal_cachemax_opt = option(
+    '--gdal-cachemax',
+    'gdal_cachemax',
+    default=None,
+    type=click.IntRange(1),
+    help='Размер кэша блоков GDAL каждого процесса (в МиБ). По умолчанию — четверть памяти процесса из бюджета '
+         'памяти или значение GDAL.'
+)
+
+gdal_threads_opt = option(
+    '--gdal-threads',
+    'gdal_threads',
+    default=None,
+    type=click.IntRange(1),
+    help='Количество потоков GDAL каждого процесса. По умолчанию ядра делятся между процессами.'
+)
+
+warp_threads_opt = option(
+    '--warp-threads',
+    'warp_threads',
+    default=None,
+    type=click.IntRange(1),
+    help='Количество потоков GDALWarp. По умолчанию равно количеству потоков GDAL.'
+)
+
+colormap_opt = option(
+    '--colormap',
+    'colormap_filename',
+    default=None,
+    type=Path(exists=True, dir_okay=False),
+    help='JSON-спецификация шкалы преобразования каналов в 8 бит: scale (linear, sqrt, log, gamma), gamma, '
+         'фиксированные min/max и переопределения для отдельных каналов (bands).'
+)
+
+quality_opt = option(
+    '--quality',
+    'quality',
+    default=None,
+    type=click.IntRange(1, 100),
+    help='Качество сжатия тайлов JPEG и WEBP (для WEBP без потерь — усилие сжатия).'
+)
+
+lossless_opt = option(
+    '--lossless',
+    'lossless',
+    is_flag=True,
+    default=False,
+    help='Сжатие тайлов WEBP без потерь.'
+)
+
+png_compress_level_opt = option(
+    '--png-compress-level',
+    'png_compress_level',
+    default=None,
+    type=click.IntRange(0, 9),
+    help='Уровень сжатия zlib тайлов PNG (0 — без сжатия, 9 — максимальное).'
+)
+
+png_strategy_opt = option(
+    '--png-strategy',
+    'png_strategy',
+    default=None,
+    type=Choice(['default', 'filtered', 'huffman', 'rle', 'fixed']),
+    help='Стратегия сжатия zlib тайлов PNG.'
+)
+
+data_tiles_opt = option(
+    '--data-tiles',
+    'data_encoding',
+    default=None,
+    type=Choice(['float16', 'rgb24']),
+    help='Генерировать тайлы данных в исходном диапазоне значений вместо 8-битных изображений: float16 — сжатые '
+         'массивы Float16 (.bin), rgb24 — PNG со значением, закодированным в каналах RGB.'
+)
+
+remote_cache_opt = option(
+    '--remote-cache',
+    'remote_cache_directory',
+    default=None,
+    type=Path(resolve_path=True, file_okay=False),
+    help='Каталог блочного кэша удалённых входных файлов (http(s)://, s3://); файлы загружаются целиком. '
+         'По умолчанию — каталог промежуточных файлов запуска, удаляемый по его завершении: для повторного '
+         'использования загруженных файлов между запусками задайте постоянный каталог.'
+)
+
+s3_endpoint_opt = option(
+    '--s3-endpoint',
+    's3_endpoint',
+    default=None,
+    help='Адрес S3-совместимого хранилища для входных файлов s3://bucket/key (по умолчанию AWS_S3_ENDPOINT).'
+)
+
+stage_cache_opt = option(
+    '--stage-cache',
+    'stage_cache_directory',
+    default=None,
+    type=Path(resolve_path=True, file_okay=False),
+    help='Каталог постоянного кэша результатов этапов (извлечение, перепроецирование, мин/макс, конверсия в 8 бит): '
+         'повторное тайлирование тех же каналов с другими уровнями, форматом или прозрачностью начинается сразу '
+         'с нарезки тайлов. Результаты адресуются хэшем содержимого входных файлов.'
+)
+
+stage_cache_size_opt = option(
+    '--stage-cache-size',
+    'stage_cache_size',
+    default=10240,
+    type=click.IntRange(1),
+    help='Предельный объём кэша этапов (в МиБ): давно не использованные результаты вытесняются.'
+)
+
+work_queue_opt = option(
+    '--queue',
+    'work_queue',
+    default=None,
+    help='Очередь задач распределённого тайлирования (путь к файлу SQLite или sqlite:///путь на общей для узлов '
+         'файловой системе): тайлы рендерятся исполнителями grib_tiler_worker.py. Промежуточные файлы (--temp-dir '
+         'или --stage-cache) и выходной каталог должны быть доступны исполнителям по тем же путям.'
+)
+
+schedule_opt = option(
+    '--schedule',
+    'schedule',
+    default='cost',
+    type=Choice(['cost', 'count']),
+    help='Планирование рендеринга: cost — тайлы упорядочиваются по оценённой стоимости (уровень увеличения, покрытие '
+         'данными) и объединяются в пакеты равной стоимости, count — пакеты из равного количества тайлов.'
+)
+
+metatile_opt = option(
+    '--metatile',
+    'metatile_size',
+    default=1,
+    type=click.IntRange(1, 64),
+    help='Размер метатайла в тайлах (N×N тайлов на задачу): окно источника читается и ресэмплируется один раз на '
+         'метатайл, тайлы вырезаются из него. Действует для источников в выходной СК (без --warp-cache).'
+)
+
+downsample_opt = option(
+    '--downsample',
+    'downsample',
+    is_flag=True,
+    default=False,
+    help='Строить тайлы меньших уровней увеличения уменьшением 2×2 тайлов-потомков в памяти: из источника '
+         'читаются только тайлы наибольшего уровня.'
+)
+
 exif_opt = option(
     '--exif',
     'include_exif',
@@ -77,7 +339,7 @@ image_format_opt = option(
     'image_format',
     default='JPEG',
     type=Choice([
-        'PNG', 'JPEG'
+        'PNG', 'JPEG', 'WEBP'
     ]),
     help='Выходной формат тайлов.')
 
@@ -127,6 +389,15 @@ bands_list_opt = option(
     type=str,
     help="Каналы входного изображения для генерации тайлов.")
 
+band_selection_opt = option(
+    '--select',
+    'band_selection',
+    default=None,
+    callback=band_selection_handler,
+    type=str,
+    help="Выбор каналов по метаданным GRIB вместо номеров --band, например "
+         "GRIB_ELEMENT=TMP|UGRD,GRIB_SHORT_NAME=850-ISBL (условия по разным тегам объединяются по «И»).")
+
 isolines_generate_opt = option(
     '--contours',
     'generate_isolines',
@@ -152,3 +423,45 @@ isolines_simplify_epsilon_opt = option(
 )
 
 
+def tiling_options(func):
+    """Общие для всех режимов запуска опции тайлирования."""
+    for tiling_option in reversed([cutline_filename_opt,
+                                   bands_list_opt,
+                                   band_selection_opt,
+                                   zooms_list_opt,
+                                   multiband_opt,
+                                   output_crs_opt,
+                                   threads_opt,
+                                   tilesize,
+                                   image_format_opt,
+                                   isolines_generate_opt,
+                                   isolines_elev_interval_opt,
+                                   isolines_simplify_epsilon_opt,
+                                   equator_opt,
+                                   transparency_opt,
+                                   nodata_opt,
+                                   exif_opt,
+                                   warp_cache_opt,
+                                   manifest_opt,
+                                   delta_opt,
+                                   memory_budget_opt,
+                                   intermediate_compression_opt,
+                                   gdal_cachemax_opt,
+                                   gdal_threads_opt,
+                                   warp_threads_opt,
+                                   colormap_opt,
+                                   quality_opt,
+                                   lossless_opt,
+                                   png_compress_level_opt,
+                                   png_strategy_opt,
+                                   data_tiles_opt,
+                                   metatile_opt,
+                                   downsample_opt,
+                                   remote_cache_opt,
+                                   s3_endpoint_opt,
+                                   stage_cache_opt,
+                                   stage_cache_size_opt,
+                                   work_queue_opt,
+                                   schedule_opt]):
+        func = tiling_option(func)
+    return func
@@ -0,0 +1,118 @@
+import json
+from copy import deepcopy
+
+import numpy as np
+
+SCALES = ('linear', 'sqrt', 'log', 'gamma')
+LOG_SCALE_BASE = 256.0
+
+
+def load_colormap(colormap_filename):
+    """Чтение спецификации шкалы/палитры.
+
+    Пример::
+
+        {
+            "scale": "sqrt",
+            "min": 0.0,
+            "max": 50.0,
+            "palette": [[0.0, "#ffffff"], [10.0, "#2c7fb8"], [50.0, [255, 0, 0]]],
+            "bands": {"2": {"scale": "linear", "min": -40.0, "max": 40.0}}
+        }
+
+    scale — шкала преобразования в 8 бит (linear, sqrt, log, gamma с параметром gamma); min/max — фиксированный
+    диапазон значений (иначе он вычисляется по каналу); palette — опорные точки «значение — цвет» палитры
+    одноканальных тайлов; bands — переопределения для отдельных каналов.
+    """
+    with open(colormap_filename) as colormap_fp:
+        colormap = json.load(colormap_fp)
+    for band_colormap_spec in [colormap] + list(colormap.get('bands', {}).values()):
+        scale = band_colormap_spec.get('scale', 'linear')
+        if scale not in SCALES:
+            raise ValueError(f'Неизвестная шкала {scale}, допустимые шкалы: {", ".join(SCALES)}')
+        if 'palette' in band_colormap_spec and not band_colormap_spec['palette']:
+            raise ValueError('Палитра должна содержать хотя бы одну опорную точку')
+    return colormap
+
+
+def band_colormap(colormap, band):
+    """Спецификация шкалы/палитры канала band с учётом переопределений."""
+    if not colormap:
+        return {}
+    merged_colormap = {key: value for key, value in deepcopy(colormap).items() if key != 'bands'}
+    merged_colormap.update(deepcopy(colormap.get('bands', {}).get(str(band), {})))
+    return merged_colormap
+
+
+def scale_to_byte(values, valid, vmin, vmax, scale='linear', gamma=1.0):
+    """Векторизованное преобразование значений в 8 бит: отсечение по [vmin, vmax] и нелинейная шкала."""
+    span = vmax - vmin
+    normalized = np.zeros(values.shape, dtype='float64')
+    if span:
+        np.subtract(values, vmin, out=normalized, where=valid)
+        normalized /= span
+        np.clip(normalized, 0.0, 1.0, out=normalized)
+    if scale == 'sqrt':
+        np.sqrt(normalized, out=normalized)
+    elif scale == 'log':
+        normalized = np.log1p(normalized * (LOG_SCALE_BASE - 1)) / np.log(LOG_SCALE_BASE)
+    elif scale == 'gamma':
+        normalized **= 1.0 / gamma
+    normalized[~valid] = 0.0
+    return np.rint(normalized * 255).astype('uint8')
+
+
+def scale_meta(colormap, vmin, vmax):
+    """Описание преобразования для meta.json: значение = min + f⁻¹(байт / 255) · 255 · step."""
+    meta = {
+        'step': (vmax - vmin) / 255,
+        'min': vmin
+    }
+    scale = colormap.get('scale', 'linear')
+    if scale != 'linear':
+        meta['scale'] = scale
+        if scale == 'gamma':
+            meta['gamma'] = colormap.get('gamma', 1.0)
+    return meta
+
+
+def byte_values(vmin, vmax, scale='linear', gamma=1.0):
+    """Значения, соответствующие байтам 0..255 (обратное преобразование scale_to_byte)."""
+    normalized = np.arange(256, dtype='float64') / 255
+    if scale == 'sqrt':
+        normalized = normalized ** 2
+    elif scale == 'log':
+        normalized = (LOG_SCALE_BASE ** normalized - 1) / (LOG_SCALE_BASE - 1)
+    elif scale == 'gamma':
+        normalized = normalized ** gamma
+    return vmin + normalized * (vmax - vmin)
+
+
+def _parse_color(color):
+    if isinstance(color, str):
+        color = color.lstrip('#')
+        return [int(color[idx:idx + 2], 16) for idx in (0, 2, 4)]
+    return [int(component) for component in color[:3]]
+
+
+def band_palette(colormap, vmin, vmax):
+    """Палитра канала (768 байт RGB) для 8-битного тайла или None, если палитра не задана.
+
+    Индекс 0 зарезервирован под nodata (прозрачный), цвета индексов 1..255 интерполируются по опорным точкам
+    палитры в единицах значений канала.
+    """
+    stops = sorted(colormap.get('palette') or [], key=lambda stop: stop[0])
+    if not stops:
+        return None
+    stop_values = np.array([stop[0] for stop in stops], dtype='float64')
+    stop_colors = np.array([_parse_color(stop[1]) for stop in stops], dtype='float64')
+    values = byte_values(vmin, vmax, colormap.get('scale', 'linear'), colormap.get('gamma', 1.0))
+    palette = np.stack([np.interp(values, stop_values, stop_colors[:, channel]) for channel in range(3)], axis=-1)
+    palette[0] = 0
+    return bytes(np.rint(palette).astype('uint8').ravel())
+
+
+def palette_ramp(colormap):
+    """Цветовая шкала палитры для meta.json."""
+    return [{'value': stop[0], 'color': '#{:02x}{:02x}{:02x}'.format(*_parse_color(stop[1]))}
+            for stop in sorted(colormap['palette'], key=lambda stop: stop[0])]
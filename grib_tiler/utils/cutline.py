@@ -0,0 +1,83 @@
+import hashlib
+import math
+import os
+
+import numpy as np
+from rasterio.windows import Window, from_bounds
+
+# shapely, pyproj и rasterio.features импортируются в функциях: они нужны только запускам с обрезкой
+
+
+def _transform_geometry(geometry, source_crs, target_crs):
+    import shapely
+    from pyproj import Transformer
+
+    transformer = Transformer.from_crs(source_crs, target_crs, always_xy=True)
+    return shapely.transform(geometry, lambda coords: np.column_stack(transformer.transform(coords[:, 0],
+                                                                                              coords[:, 1])))
+
+
+def load_cutline(cutline_filename):
+    """Геометрия файла обрезки (объединение всех объектов) в EPSG:4326."""
+    import fiona
+    import shapely
+    from pyproj import CRS
+    from shapely.geometry import shape
+
+    with fiona.open(cutline_filename) as cutline_fp:
+        geometries = [shape(feature['geometry']) for feature in cutline_fp if feature['geometry']]
+        cutline_crs_wkt = cutline_fp.crs_wkt
+    geometry = shapely.union_all(geometries)
+    if cutline_crs_wkt and CRS.from_wkt(cutline_crs_wkt) != CRS.from_epsg(4326):
+        geometry = _transform_geometry(geometry, CRS.from_wkt(cutline_crs_wkt), CRS.from_epsg(4326))
+    return geometry
+
+
+def cutline_window(input_rio, geometry):
+    """Окно растра, покрывающее охват геометрии (аналог обрезки GDALWarp по охвату линии обрезки)."""
+    window = from_bounds(*geometry.bounds, transform=input_rio.transform)
+    col_start = max(0, math.floor(window.col_off))
+    row_start = max(0, math.floor(window.row_off))
+    col_stop = min(input_rio.width, math.ceil(window.col_off + window.width))
+    row_stop = min(input_rio.height, math.ceil(window.row_off + window.height))
+    if col_start >= col_stop or row_start >= row_stop:
+        return Window(0, 0, input_rio.width, input_rio.height)
+    return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+
+def cutline_mask(geometry, transform, width, height, cache_directory):
+    """Маска пикселей сетки внутри геометрии (все касающиеся пиксели), кэшируемая в cache_directory (.npy)."""
+    import shapely
+    from rasterio.features import geometry_mask
+
+    key = hashlib.sha1(shapely.to_wkb(geometry))
+    key.update(repr((tuple(transform)[:6], width, height)).encode('utf-8'))
+    mask_filename = os.path.join(cache_directory, 'cutline_masks', f'{key.hexdigest()}.npy')
+    if os.path.exists(mask_filename):
+        return np.load(mask_filename, mmap_mode='r')
+    mask = geometry_mask([geometry], out_shape=(height, width), transform=transform, all_touched=True, invert=True)
+    os.makedirs(os.path.dirname(mask_filename), exist_ok=True)
+    tmp_filename = f'{mask_filename}.{os.getpid()}.tmp'
+    with open(tmp_filename, 'wb') as mask_fp:
+        np.save(mask_fp, mask)
+    os.replace(tmp_filename, mask_filename)
+    return mask
+
+
+def tiles_intersecting(tile_index, output_crs, geometry):
+    """Строки индекса тайлов (TileIndex), пересекающиеся с геометрией в EPSG:4326 (проверка выполняется
+    в выходной СК)."""
+    import shapely
+    from pyproj import CRS
+    from shapely.geometry import box
+
+    output_crs = CRS.from_user_input(output_crs)
+    area_of_use = output_crs.area_of_use
+    if area_of_use:
+        geometry = geometry.intersection(box(*area_of_use.bounds))
+    if geometry.is_empty or not len(tile_index):
+        return tile_index.select(np.zeros(len(tile_index), dtype=bool))
+    projected_geometry = _transform_geometry(shapely.segmentize(geometry, 0.5), CRS.from_epsg(4326), output_crs)
+    shapely.prepare(projected_geometry)
+    tiles_boxes = shapely.box(*tile_index.bounds.T)
+    return tile_index.select(shapely.intersects(projected_geometry, tiles_boxes))
@@ -0,0 +1,107 @@
+import json
+import os
+
+from grib_tiler.utils.catalogue import load_band_catalogue
+
+GRIB_MAGIC = b'GRIB'
+MESSAGE_INDEX_SUFFIX = '.index.json'
+MESSAGE_INDEX_VERSION = 1
+SCAN_CHUNK_SIZE = 64 * 1024
+GRIB1_LARGE_MESSAGE_FLAG = 0x800000
+
+
+def message_index_filename(input_filename):
+    return f'{input_filename}{MESSAGE_INDEX_SUFFIX}'
+
+
+def _find_magic(grib_fp, position):
+    """Позиция ближайшей сигнатуры GRIB начиная с position (сообщения могут разделяться заголовками ВМО)."""
+    grib_fp.seek(position)
+    tail = b''
+    while True:
+        chunk = grib_fp.read(SCAN_CHUNK_SIZE)
+        if not chunk:
+            return None
+        data = tail + chunk
+        found = data.find(GRIB_MAGIC)
+        if found != -1:
+            return position - len(tail) + found
+        tail = data[-(len(GRIB_MAGIC) - 1):]
+        position += len(chunk)
+
+
+def scan_grib_messages(input_filename):
+    """Смещения и длины (в байтах) сообщений GRIB файла, прочитанные по заголовкам секции 0 без декодирования.
+
+    Возвращает None, если файл не удаётся разобрать (например, сообщения GRIB1 с расширенной длиной).
+    """
+    messages = []
+    file_size = os.path.getsize(input_filename)
+    with open(input_filename, 'rb') as grib_fp:
+        position = 0
+        while True:
+            offset = _find_magic(grib_fp, position)
+            if offset is None:
+                break
+            grib_fp.seek(offset)
+            section0 = grib_fp.read(16)
+            if len(section0) < 8:
+                break
+            edition = section0[7]
+            if edition == 1:
+                length = int.from_bytes(section0[4:7], 'big')
+                if length & GRIB1_LARGE_MESSAGE_FLAG:
+                    return None
+            elif edition == 2 and len(section0) == 16:
+                length = int.from_bytes(section0[8:16], 'big')
+            else:
+                # Сигнатура внутри данных или заголовка, а не начало сообщения
+                position = offset + 1
+                continue
+            if length < 8 or offset + length > file_size:
+                return None
+            messages.append([offset, length, edition])
+            position = offset + length
+    return messages
+
+
+def load_message_index(input_filename):
+    """Индекс сообщений GRIB-файла, кэшируемый рядом с входным файлом и перестраиваемый при его изменении."""
+    filename = message_index_filename(input_filename)
+    input_stat = os.stat(input_filename)
+    stamp = [input_stat.st_size, input_stat.st_mtime_ns]
+    if os.path.exists(filename):
+        with open(filename) as index_fp:
+            message_index = json.load(index_fp)
+        if message_index.get('version') == MESSAGE_INDEX_VERSION and message_index.get('stamp') == stamp:
+            return message_index['messages']
+    messages = scan_grib_messages(input_filename)
+    try:
+        tmp_filename = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp_filename, 'w') as index_fp:
+            json.dump({'version': MESSAGE_INDEX_VERSION, 'stamp': stamp, 'messages': messages}, index_fp)
+        os.replace(tmp_filename, filename)
+    except OSError:
+        # Каталог входного файла недоступен для записи: индекс сообщений не кэшируется
+        pass
+    return messages
+
+
+def band_message_ranges(input_filename):
+    """Байтовые диапазоны (смещение, длина) сообщений для каналов 1..N или None.
+
+    Диапазоны применимы, только если каждому каналу соответствует ровно одно сообщение (количество сообщений
+    равно количеству каналов в каталоге каналов).
+    """
+    if not os.path.isfile(input_filename):
+        return None
+    messages = load_message_index(input_filename)
+    if not messages or len(messages) != len(load_band_catalogue(input_filename)['bands']):
+        return None
+    return [(offset, length) for offset, length, _ in messages]
+
+
+def message_subfile(input_filename, message_range):
+    """Путь GDAL /vsisubfile/ к отдельному сообщению GRIB-файла."""
+    offset, length = message_range
+    return f'/vsisubfile/{offset}_{length},{input_filename}'
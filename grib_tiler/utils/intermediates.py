@@ -0,0 +1,123 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+
+from grib_tiler.utils.watch import file_content_hash
+
+INTERMEDIATE_KEY_LENGTH = 20
+INTERMEDIATE_NAME_PATTERN = re.compile(r'^[a-z0-9]+-[0-9a-f]{%d}\.' % INTERMEDIATE_KEY_LENGTH)
+
+_content_hashes = {}
+
+
+def source_identity(source_filename):
+    """Идентичность источника в ключе промежуточного файла.
+
+    Промежуточные файлы уже адресуются по содержимому и идентифицируются именем; прочие файлы (входные GRIB) —
+    хэшем содержимого, поэтому повторно доставленный файл или локальная копия удалённого файла в другом каталоге
+    получают те же ключи. Хэш вычисляется один раз на процесс для каждой версии файла (путь, размер, время
+    изменения).
+    """
+    basename = os.path.basename(source_filename)
+    if INTERMEDIATE_NAME_PATTERN.match(basename):
+        return basename
+    source_filename = os.path.abspath(source_filename)
+    try:
+        source_stat = os.stat(source_filename)
+    except OSError:
+        return source_filename
+    stamp = (source_filename, source_stat.st_size, source_stat.st_mtime_ns)
+    if stamp not in _content_hashes:
+        _content_hashes[stamp] = file_content_hash(source_filename)
+    return _content_hashes[stamp]
+
+
+def _key_param(param):
+    if hasattr(param, 'wkb'):
+        # Геометрии обрезки идентифицируются хэшем WKB, а не громоздким WKT
+        return hashlib.sha1(param.wkb).hexdigest()
+    return str(param)
+
+
+def intermediate_key(stage, sources, params=()):
+    """Ключ промежуточного файла: хэш этапа, идентичности источников и параметров этапа."""
+    key_data = json.dumps([stage, [source_identity(source) for source in sources], list(params)],
+                          default=_key_param, sort_keys=True)
+    return hashlib.sha1(key_data.encode('utf-8')).hexdigest()[:INTERMEDIATE_KEY_LENGTH]
+
+
+def intermediate_filename(directory, stage, sources, params=(), extension='.tiff'):
+    """Детерминированное имя результата этапа stage в каталоге directory: <этап>-<ключ><расширение>.
+
+    Одинаковые источники и параметры всегда дают одно имя, разные — разные имена (вместо случайных суффиксов).
+    """
+    return os.path.join(directory, f'{stage}-{intermediate_key(stage, sources, params)}{extension}')
+
+
+def remove_intermediate(filename):
+    """Удаление промежуточного файла вместе со спутниками (<имя>.aux.xml и т. п.)."""
+    for companion_filename in [filename] + glob.glob(f'{glob.escape(filename)}.*'):
+        try:
+            os.remove(companion_filename)
+        except FileNotFoundError:
+            pass
+
+
+class IntermediateStore:
+    """Промежуточные файлы запуска с подсчётом ссылок.
+
+    Конвейер держит одну ссылку на каждый добавленный файл, пока он нужен последующим этапам; файл VRT, кроме
+    того, держит ссылки на свои источники (GDAL читает их при каждом обращении к VRT). Файл, на который не осталось
+    ссылок, сразу удаляется, освобождая свои источники, — пиковый объём временного каталога ограничивается
+    файлами, ещё нужными конвейеру. Файлы каталога persistent_directory (кэша этапов) не учитываются и не удаляются.
+    """
+
+    def __init__(self, persistent_directory=None):
+        self.persistent_directory = os.path.abspath(persistent_directory) if persistent_directory else None
+        self._lock = threading.Lock()
+        self._references = {}
+        self._sources = {}
+
+    def add(self, filename, sources=()):
+        """Регистрация результата этапа; sources — файлы, на которые он ссылается (для VRT)."""
+        if self.persistent_directory and os.path.dirname(os.path.abspath(filename)) == self.persistent_directory:
+            return filename
+        with self._lock:
+            if filename in self._references:
+                # Тот же ключ получен повторно: результат общий
+                self._references[filename] += 1
+                return filename
+            self._references[filename] = 1
+            self._sources[filename] = [source for source in sources if source in self._references]
+            for source in self._sources[filename]:
+                self._references[source] += 1
+        return filename
+
+    def release(self, *filenames):
+        """Освобождение ссылок конвейера на файлы; файлы без ссылок удаляются."""
+        with self._lock:
+            pending = list(filenames)
+            while pending:
+                filename = pending.pop()
+                if filename not in self._references:
+                    continue
+                self._references[filename] -= 1
+                if self._references[filename] > 0:
+                    continue
+                del self._references[filename]
+                pending.extend(self._sources.pop(filename))
+                remove_intermediate(filename)
+
+    def clear(self):
+        """Удаление всех оставшихся файлов."""
+        with self._lock:
+            for filename in self._references:
+                remove_intermediate(filename)
+            self._references.clear()
+            self._sources.clear()
+
+    def __len__(self):
+        return len(self._references)
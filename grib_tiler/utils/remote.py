@@ -0,0 +1,193 @@
+import hashlib
+import os
+import shutil
+import threading
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlparse
+
+REMOTE_SCHEMES = ('http', 'https', 's3')
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+REQUEST_TIMEOUT = 60
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def is_remote(input_filename):
+    return urlparse(input_filename).scheme in REMOTE_SCHEMES
+
+
+def http_url(input_url, s3_endpoint=None):
+    """HTTP(S)-адрес входного файла; s3://bucket/key адресуется в стиле пути к S3-совместимому хранилищу
+    s3_endpoint (или AWS_S3_ENDPOINT)."""
+    parsed_url = urlparse(input_url)
+    if parsed_url.scheme != 's3':
+        return input_url
+    endpoint = s3_endpoint or os.environ.get('AWS_S3_ENDPOINT', 's3.amazonaws.com')
+    if '://' not in endpoint:
+        endpoint = f'https://{endpoint}'
+    return f'{endpoint.rstrip("/")}/{parsed_url.netloc}{parsed_url.path}'
+
+
+class RemoteFile:
+    """Удалённый файл с блочным кэшем на диске.
+
+    Каждый блок block_size байт запрашивается не более одного раза (Range-запросами, смежные недостающие блоки —
+    одним запросом); тело ответа записывается в блоки кэша по мере получения, поэтому в памяти находится не более
+    одного блока. Запросы к одному хосту идут через общее keep-alive соединение процесса.
+    """
+
+    def __init__(self, input_url, cache_directory, block_size=DEFAULT_BLOCK_SIZE, s3_endpoint=None):
+        self.url = http_url(input_url, s3_endpoint)
+        parsed_url = urlparse(self.url)
+        self._connection_key = (parsed_url.scheme, parsed_url.netloc)
+        self._request_path = parsed_url.path + (f'?{parsed_url.query}' if parsed_url.query else '')
+        self.basename = os.path.basename(parsed_url.path) or 'input'
+        self.block_size = block_size
+        self.requests = 0
+        self.fetched_bytes = 0
+        self.root_cache_directory = cache_directory
+        self.size = self.cache_directory = None
+        self._request({'Range': f'bytes=0-{self.block_size - 1}'}, self._probe)
+
+    def _request(self, headers, consume):
+        """GET-запрос; ответ передаётся consume, пока соединение занято. Возвращает результат consume."""
+        with _connections_lock:
+            for attempt in range(2):
+                connection = _connections.get(self._connection_key)
+                if connection is None:
+                    scheme, netloc = self._connection_key
+                    connection_class = HTTPSConnection if scheme == 'https' else HTTPConnection
+                    connection = _connections[self._connection_key] = connection_class(netloc,
+                                                                                       timeout=REQUEST_TIMEOUT)
+                status_error = None
+                try:
+                    connection.request('GET', self._request_path, headers=headers)
+                    response = connection.getresponse()
+                    if response.status in (200, 206):
+                        result = consume(response)
+                    else:
+                        response.read()
+                        status_error = OSError(f'Ошибка запроса {self.url}: HTTP {response.status}')
+                except (HTTPException, OSError):
+                    # Соединение закрыто сервером: повтор через новое соединение
+                    connection.close()
+                    del _connections[self._connection_key]
+                    if attempt:
+                        raise
+                    continue
+                self.requests += 1
+                if status_error:
+                    raise status_error
+                return result
+
+    def _probe(self, response):
+        """Размер, ETag и время изменения файла по ответу на запрос первого блока; полученные данные сохраняются
+        в кэш."""
+        if response.status == 206:
+            self.size = int(response.getheader('Content-Range').rsplit('/', 1)[1])
+        elif response.getheader('Content-Length') is not None:
+            # Сервер не поддерживает Range-запросы: передаётся весь файл
+            self.size = int(response.getheader('Content-Length'))
+        # Без ETag версия файла различается по времени изменения: файл того же размера не берётся из кэша
+        version = f'{response.getheader("ETag", "")}|{response.getheader("Last-Modified", "")}'
+        key = hashlib.sha1(f'{self.url}|{self.size}|{version}'.encode('utf-8')).hexdigest()
+        self.cache_directory = os.path.join(self.root_cache_directory, key)
+        os.makedirs(self.cache_directory, exist_ok=True)
+        received = self._store(0, response)
+        if self.size is None:
+            self.size = received
+
+    def _block_filename(self, block_index):
+        return os.path.join(self.cache_directory, f'{block_index}.block')
+
+    def _store(self, start, response):
+        """Запись тела ответа (начиная с границы блока start) в блоки кэша по мере получения.
+
+        Возвращает количество полученных байт.
+        """
+        received = 0
+        while True:
+            block = _read_block(response, self.block_size)
+            if not block:
+                break
+            block_filename = self._block_filename((start + received) // self.block_size)
+            tmp_filename = f'{block_filename}.{os.getpid()}.tmp'
+            with open(tmp_filename, 'wb') as block_fp:
+                block_fp.write(block)
+            os.replace(tmp_filename, block_filename)
+            received += len(block)
+        self.fetched_bytes += received
+        return received
+
+    def _fetch(self, first_block, last_block):
+        start = first_block * self.block_size
+        end = min(self.size, (last_block + 1) * self.block_size) - 1
+        self._request({'Range': f'bytes={start}-{end}'},
+                      lambda response: self._store(0 if response.status == 200 else start, response))
+
+    def ensure(self, offset, length):
+        """Загрузка недостающих блоков, покрывающих диапазон [offset, offset + length)."""
+        if length <= 0:
+            return
+        missing_run = None
+        for block_index in range(offset // self.block_size, (offset + length - 1) // self.block_size + 1):
+            if os.path.exists(self._block_filename(block_index)):
+                if missing_run:
+                    self._fetch(*missing_run)
+                    missing_run = None
+            elif missing_run:
+                missing_run = (missing_run[0], block_index)
+            else:
+                missing_run = (block_index, block_index)
+        if missing_run:
+            self._fetch(*missing_run)
+
+    def materialise(self):
+        """Локальная копия файла, собранная из блоков кэша; создаётся один раз."""
+        local_filename = os.path.join(self.cache_directory, self.basename)
+        if not os.path.exists(local_filename):
+            self.ensure(0, self.size)
+            tmp_filename = f'{local_filename}.{os.getpid()}.tmp'
+            with open(tmp_filename, 'wb') as local_fp:
+                for block_index in range((self.size + self.block_size - 1) // self.block_size):
+                    with open(self._block_filename(block_index), 'rb') as block_fp:
+                        shutil.copyfileobj(block_fp, local_fp)
+            os.replace(tmp_filename, local_filename)
+        return local_filename
+
+
+def _read_block(response, block_size):
+    """Чтение из ответа до block_size байт (меньше — только в конце тела)."""
+    chunks = []
+    remaining = block_size
+    while remaining:
+        chunk = response.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def fetch_remote_inputs(input_files, cache_directory, s3_endpoint=None):
+    """Замена удалённых входных файлов локальными копиями из блочного кэша.
+
+    Файлы загружаются целиком: GDAL читает GRIB из локальной копии, даже если нужны лишь некоторые сообщения.
+
+    Возвращает (список входных файлов, статистика загрузки: количество запросов и полученных байт).
+    """
+    local_files = []
+    remote_files = {}
+    for input_file in input_files:
+        if not is_remote(input_file):
+            local_files.append(input_file)
+            continue
+        if input_file not in remote_files:
+            remote_files[input_file] = RemoteFile(input_file, cache_directory, s3_endpoint=s3_endpoint)
+        local_files.append(remote_files[input_file].materialise())
+    fetch_stats = {
+        'requests': sum(remote_file.requests for remote_file in remote_files.values()),
+        'fetched_bytes': sum(remote_file.fetched_bytes for remote_file in remote_files.values())
+    }
+    return local_files, fetch_stats
@@ -0,0 +1,79 @@
+import multiprocessing
+import os
+import resource
+
+MEBIBYTE = 1024 * 1024
+WORKER_BASE_MEMORY = 64 * MEBIBYTE  # интерпретатор, GDAL и импортированные модули рабочего процесса
+MIN_WORKER_MEMORY = 16 * MEBIBYTE
+
+
+def budget_threads(threads, memory_budget):
+    """Количество рабочих процессов, укладывающееся в бюджет памяти memory_budget (в МиБ)."""
+    if not memory_budget:
+        return threads
+    return int(max(1, min(threads, memory_budget * MEBIBYTE // (WORKER_BASE_MEMORY + MIN_WORKER_MEMORY))))
+
+
+def worker_memory_limit(threads, memory_budget):
+    """Объём памяти (в байтах) под данные одного рабочего процесса или None, если бюджет не задан."""
+    if not memory_budget:
+        return None
+    return int(max(MIN_WORKER_MEMORY, memory_budget * MEBIBYTE // threads - WORKER_BASE_MEMORY))
+
+
+def gdal_configuration(threads, memory_limit=None, gdal_cachemax=None, gdal_threads=None):
+    """Параметры конфигурации GDAL для рабочих процессов и оставшаяся под данные память процесса (в байтах).
+
+    Без явного gdal_cachemax (в МиБ) под кэш блоков GDAL отводится четверть памяти процесса из бюджета,
+    без явного gdal_threads потоки GDAL делят ядра между рабочими процессами.
+    """
+    if gdal_cachemax is None and memory_limit:
+        gdal_cachemax = max(1, memory_limit // 4 // MEBIBYTE)
+    if gdal_cachemax and memory_limit:
+        memory_limit = max(MIN_WORKER_MEMORY, memory_limit - gdal_cachemax * MEBIBYTE)
+    if gdal_threads is None:
+        gdal_threads = max(1, (os.cpu_count() or 1) // threads)
+    gdal_options = {
+        'GDAL_PAM_ENABLED': 'NO',
+        'GDAL_NUM_THREADS': str(gdal_threads),
+        'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+        'GDAL_MAX_DATASET_POOL_SIZE': '450',
+        'VSI_CACHE': 'TRUE',
+        'GDAL_TIFF_INTERNAL_MASK': 'YES'
+    }
+    if gdal_cachemax:
+        gdal_options['GDAL_CACHEMAX'] = str(gdal_cachemax)
+    return gdal_options, memory_limit
+
+
+def worker_resources(threads, memory_budget=None, gdal_cachemax=None, gdal_threads=None):
+    """Количество рабочих процессов, память под данные процесса и параметры GDAL в пределах бюджета памяти."""
+    threads = budget_threads(threads, memory_budget)
+    gdal_options, memory_limit = gdal_configuration(threads, worker_memory_limit(threads, memory_budget),
+                                                    gdal_cachemax, gdal_threads)
+    return threads, memory_limit, gdal_options
+
+
+def configure_gdal(gdal_options):
+    os.environ.update(gdal_options)
+
+
+def create_pool(threads, gdal_options):
+    return multiprocessing.Pool(threads, initializer=configure_gdal, initargs=(gdal_options,))
+
+
+def strip_rows(width, count, itemsize, memory_limit, height):
+    """Высота полосы (в строках) для обработки растра окнами в пределах memory_limit байт.
+
+    Учитываются буферы чтения и записи полосы.
+    """
+    row_bytes = width * count * itemsize * 2
+    return int(max(1, min(height, memory_limit // row_bytes)))
+
+
+def peak_rss():
+    """Пиковое потребление памяти (в МиБ) основным процессом и завершёнными рабочими процессами."""
+    return {
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_workers_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    }
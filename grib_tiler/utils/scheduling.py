@@ -0,0 +1,90 @@
+import math
+
+import numpy as np
+
+TILE_BASE_COST = 0.5  # тайл без данных (чтение окна, маска, запись пустого тайла) в долях тайла, покрытого данными
+SCHEDULE_BATCHES_PER_WORKER = 8
+SCHEDULE_MAX_BATCH_UNITS = 1024
+EQUAL_CHUNKS_PER_WORKER = 4  # разбиение Pool.map по умолчанию
+
+
+def tile_costs(tiles, source_filename, output_crs, tilesize, windows=None):
+    """Оценка стоимости рендеринга тайлов индекса tiles из источника: массив формы (N,) в долях тайла,
+    целиком покрытого данными.
+
+    Если известны окна тайлов в пикселях источника (windows), стоимость пропорциональна числу читаемых пикселей
+    источника (крупные окна малых уровней увеличения ресэмплируются из большого числа пикселей), но не меньше
+    покрытой данными доли тайла. Иначе она равна доле тайла, покрытой охватом источника в выходной СК.
+    Тайлы без данных стоят TILE_BASE_COST.
+    """
+    import rasterio
+    from rasterio.warp import transform_bounds
+
+    with rasterio.open(source_filename) as source_rio:
+        if windows is not None:
+            col_off, row_off, width, height = windows.T
+            covered_width = np.maximum(np.clip(col_off + width, 0, source_rio.width) -
+                                       np.clip(col_off, 0, source_rio.width), 0)
+            covered_height = np.maximum(np.clip(row_off + height, 0, source_rio.height) -
+                                        np.clip(row_off, 0, source_rio.height), 0)
+            covered = covered_width * covered_height
+            coverage = covered / np.maximum(width * height, 1)
+            return TILE_BASE_COST + np.maximum(coverage, covered / (tilesize * tilesize))
+        if source_rio.crs is None:
+            return np.full(len(tiles), 1 + TILE_BASE_COST)
+        footprint = transform_bounds(source_rio.crs, output_crs, *source_rio.bounds, densify_pts=21)
+    bounds = tiles.bounds
+    covered_width = np.clip(np.minimum(bounds[:, 2], footprint[2]) - np.maximum(bounds[:, 0], footprint[0]), 0, None)
+    covered_height = np.clip(np.minimum(bounds[:, 3], footprint[3]) - np.maximum(bounds[:, 1], footprint[1]), 0, None)
+    area = (bounds[:, 2] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 1])
+    return TILE_BASE_COST + covered_width * covered_height / np.maximum(area, np.finfo('float64').tiny)
+
+
+def unit_cost(unit):
+    _, render_tile_tasks = unit
+    return sum(render_tile_task.cost for render_tile_task in render_tile_tasks)
+
+
+def schedule_batches(units, workers, schedule='cost'):
+    """Пакеты ('batch', единицы) из неделимых единиц рендеринга (вид, задачи) — тайлов, метатайлов, пирамид.
+
+    schedule = 'cost': единицы упорядочиваются по убыванию оценённой стоимости (дорогие начинаются первыми и не
+    остаются в хвосте) и объединяются в пакеты стоимостью около 1/SCHEDULE_BATCHES_PER_WORKER доли работы
+    исполнителя: дорогие единицы — по одной, дешёвые (тайлы вне данных) — большими пакетами.
+    schedule = 'count': пакеты из равного количества единиц в исходном порядке, как у Pool.map.
+    """
+    if schedule == 'count':
+        chunk_size = max(1, math.ceil(len(units) / (workers * EQUAL_CHUNKS_PER_WORKER)))
+        return [('batch', units[start:start + chunk_size]) for start in range(0, len(units), chunk_size)]
+    costs = [unit_cost(unit) for unit in units]
+    target_cost = sum(costs) / (workers * SCHEDULE_BATCHES_PER_WORKER)
+    batches = []
+    batch_units, batch_cost = [], 0.0
+    for idx in sorted(range(len(units)), key=costs.__getitem__, reverse=True):
+        if batch_units and (batch_cost + costs[idx] > target_cost or len(batch_units) >= SCHEDULE_MAX_BATCH_UNITS):
+            batches.append(('batch', batch_units))
+            batch_units, batch_cost = [], 0.0
+        batch_units.append(units[idx])
+        batch_cost += costs[idx]
+    if batch_units:
+        batches.append(('batch', batch_units))
+    return batches
+
+
+def straggler_stats(render_timings):
+    """Статистика хвоста рендеринга по парам (длительность пакета, момент завершения от начала рендеринга):
+    медиана, 95-й процентиль и максимум длительности пакетов, отношение максимума к медиане и хвост — время
+    от завершения 90 % пакетов до завершения последнего."""
+    if not render_timings:
+        return {'batches': 0}
+    batch_seconds, completion_seconds = (np.array(values, dtype='float64') for values in zip(*render_timings))
+    median_seconds = float(np.percentile(batch_seconds, 50))
+    return {
+        'batches': len(render_timings),
+        'batch_seconds_p50': median_seconds,
+        'batch_seconds_p95': float(np.percentile(batch_seconds, 95)),
+        'batch_seconds_max': float(batch_seconds.max()),
+        'straggler_ratio': float(batch_seconds.max()) / median_seconds if median_seconds else None,
+        'tail_seconds': float(completion_seconds.max() - np.percentile(completion_seconds, 90)),
+        'render_seconds': float(completion_seconds.max())
+    }
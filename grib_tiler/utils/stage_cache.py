@@ -0,0 +1,149 @@
+import glob
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from grib_tiler.utils.intermediates import remove_intermediate
+
+STAGE_CACHE_INDEX = 'stage_cache.sqlite'
+STAGE_CACHE_TIMEOUT = 60
+# Записи, использованные недавно, не вытесняются: их могут читать параллельные запуски
+STAGE_CACHE_GRACE_SECONDS = 600
+
+
+def _connect(index_filename):
+    connection = sqlite3.connect(index_filename, timeout=STAGE_CACHE_TIMEOUT)
+    connection.execute('PRAGMA journal_mode=WAL')
+    return connection
+
+
+def _index_filename(output_filename):
+    """Индекс кэша этапов каталога результата или None, если каталог не является кэшем этапов."""
+    index_filename = os.path.join(os.path.dirname(output_filename), STAGE_CACHE_INDEX)
+    return index_filename if os.path.exists(index_filename) else None
+
+
+def _touch(connection, filename, accessed):
+    pending = [filename]
+    while pending:
+        filename = pending.pop()
+        connection.execute('UPDATE entries SET accessed = ? WHERE filename = ?', (accessed, filename))
+        pending.extend(source for source, in connection.execute('SELECT source FROM sources WHERE filename = ?',
+                                                                 (filename,)))
+
+
+def cached_stage_result(output_filename):
+    """Результат этапа с именем результата output_filename, сохранённый в кэше этапов, или None.
+
+    Попадание обновляет время использования записи и её источников (VRT читает их при каждом обращении).
+    """
+    index_filename = _index_filename(output_filename)
+    if index_filename is None:
+        return None
+    with _connect(index_filename) as connection:
+        row = connection.execute('SELECT result, has_file FROM entries WHERE filename = ?',
+                                 (os.path.basename(output_filename),)).fetchone()
+        if row is None:
+            return None
+        result, has_file = row
+        if has_file and not os.path.exists(output_filename):
+            connection.execute('DELETE FROM entries WHERE filename = ?', (os.path.basename(output_filename),))
+            return None
+        _touch(connection, os.path.basename(output_filename), time.time())
+    return json.loads(result)
+
+
+def store_stage_result(output_filename, result, sources=()):
+    """Запись результата этапа в кэш этапов (если каталог результата — кэш этапов); возвращает result.
+
+    sources — файлы кэша, на которые ссылается результат: при их вытеснении вытесняется и результат.
+    """
+    index_filename = _index_filename(output_filename)
+    if index_filename is None:
+        return result
+    cache_directory = os.path.dirname(os.path.abspath(output_filename))
+    filename = os.path.basename(output_filename)
+    with _connect(index_filename) as connection:
+        connection.execute('INSERT OR REPLACE INTO entries (filename, result, has_file, accessed) VALUES (?, ?, ?, ?)',
+                           (filename, json.dumps(result), os.path.exists(output_filename), time.time()))
+        connection.execute('DELETE FROM sources WHERE filename = ?', (filename,))
+        connection.executemany('INSERT INTO sources (filename, source) VALUES (?, ?)',
+                               [(filename, os.path.basename(source)) for source in sources
+                                if os.path.dirname(os.path.abspath(source)) == cache_directory])
+    return result
+
+
+@contextmanager
+def atomic_output(output_filename):
+    """Имя временного файла (с тем же расширением), переименовываемого в output_filename после записи.
+
+    Параллельные запуски, строящие один и тот же результат, не видят частично записанных файлов.
+    """
+    stem, extension = os.path.splitext(output_filename)
+    tmp_filename = f'{stem}.{os.getpid()}.tmp{extension}'
+    try:
+        yield tmp_filename
+        os.replace(tmp_filename, output_filename)
+    finally:
+        remove_intermediate(tmp_filename)
+
+
+class StageCache:
+    """Постоянный кэш результатов этапов (извлечение, перепроецирование, обрезка, мин/макс, конверсия в 8 бит).
+
+    Результаты хранятся в каталоге directory под детерминированными именами (см. intermediate_filename), индекс
+    SQLite хранит возвращаемые этапами значения, время последнего использования и ссылки VRT на источники.
+    Когда объём каталога превышает max_size байт, вытесняются давно не использованные результаты (LRU) вместе
+    с ссылающимися на них.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        with _connect(os.path.join(directory, STAGE_CACHE_INDEX)) as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS entries (filename TEXT PRIMARY KEY, result TEXT, '
+                               'has_file INTEGER, accessed REAL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS sources (filename TEXT, source TEXT)')
+            connection.execute('CREATE INDEX IF NOT EXISTS sources_source ON sources (source)')
+
+    def _entry_size(self, filename):
+        entry_filename = os.path.join(self.directory, filename)
+        size = 0
+        for companion_filename in [entry_filename] + glob.glob(f'{glob.escape(entry_filename)}.*'):
+            try:
+                size += os.path.getsize(companion_filename)
+            except OSError:
+                pass
+        return size
+
+    def evict(self, grace_seconds=STAGE_CACHE_GRACE_SECONDS):
+        """Вытеснение давно не использованных результатов до объёма max_size.
+
+        Возвращает (количество удалённых записей, освобождённые байты).
+        """
+        with _connect(os.path.join(self.directory, STAGE_CACHE_INDEX)) as connection:
+            entries = connection.execute('SELECT filename, accessed FROM entries ORDER BY accessed').fetchall()
+            sizes = {filename: self._entry_size(filename) for filename, _ in entries}
+            total_size = sum(sizes.values())
+            evicted, freed = 0, 0
+            for filename, accessed in entries:
+                if total_size <= self.max_size or accessed > time.time() - grace_seconds:
+                    break
+                pending = [filename]
+                while pending:
+                    filename = pending.pop()
+                    if filename not in sizes:
+                        continue
+                    pending.extend(dependent for dependent, in connection.execute(
+                        'SELECT filename FROM sources WHERE source = ?', (filename,)))
+                    connection.execute('DELETE FROM entries WHERE filename = ?', (filename,))
+                    connection.execute('DELETE FROM sources WHERE filename = ?', (filename,))
+                    remove_intermediate(os.path.join(self.directory, filename))
+                    size = sizes.pop(filename)
+                    total_size -= size
+                    freed += size
+                    evicted += 1
+        return evicted, freed
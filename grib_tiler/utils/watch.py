@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+from grib_tiler.utils import get_rfc3339nano_time
+
+GRIB_MAGIC = b'GRIB'
+GRIB_MAGIC_SEARCH_BYTES = 4096  # бюллетени ВМО содержат заголовок перед сообщением GRIB
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def is_grib_file(filename):
+    """Проверка начала файла на сообщение GRIB (сигнатура и номер редакции 1 или 2), в том числе после
+    заголовка WMO; текстовые файлы с тегами GRIB_* (например, каталоги каналов) отбрасываются."""
+    try:
+        with open(filename, 'rb') as grib_fp:
+            head = grib_fp.read(GRIB_MAGIC_SEARCH_BYTES)
+    except OSError:
+        return False
+    position = head.find(GRIB_MAGIC)
+    while position != -1:
+        if position + 7 < len(head) and head[position + 7] in (1, 2):
+            return True
+        position = head.find(GRIB_MAGIC, position + 1)
+    return False
+
+
+def file_content_hash(filename):
+    content_hash = hashlib.sha256()
+    with open(filename, 'rb') as input_fp:
+        for chunk in iter(lambda: input_fp.read(HASH_CHUNK_SIZE), b''):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+class ProcessedRegistry:
+    """Реестр обработанных файлов по хэшу содержимого, сохраняемый между перезапусками демона."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._processed = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as registry_fp:
+                self._processed = json.load(registry_fp)
+
+    def __contains__(self, content_hash):
+        with self._lock:
+            return content_hash in self._processed
+
+    def add(self, content_hash, input_filename):
+        with self._lock:
+            self._processed[content_hash] = {
+                'filename': input_filename,
+                'time': get_rfc3339nano_time()
+            }
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            registry_tmp_filename = f'{self.filename}.tmp'
+            with open(registry_tmp_filename, 'w') as registry_fp:
+                json.dump(self._processed, registry_fp, ensure_ascii=False)
+            os.replace(registry_tmp_filename, self.filename)
+
+
+def _directory_files(directory):
+    for entry in os.scandir(directory):
+        if entry.is_file() and not entry.name.startswith('.'):
+            yield entry.path
+
+
+def _poll_directory(directory, poll_interval):
+    # Файл считается доставленным, когда его размер и время изменения не меняются между двумя опросами
+    pending = {}
+    delivered = {}
+    while True:
+        for filename in _directory_files(directory):
+            try:
+                file_stat = os.stat(filename)
+            except FileNotFoundError:
+                continue
+            signature = (file_stat.st_size, file_stat.st_mtime_ns)
+            if delivered.get(filename) == signature:
+                continue
+            if pending.get(filename) == signature:
+                delivered[filename] = signature
+                del pending[filename]
+                yield filename
+            else:
+                pending[filename] = signature
+        time.sleep(poll_interval)
+
+
+def _inotify_directory(directory, poll_interval):
+    inotify = INotify()
+    inotify.add_watch(directory, inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO)
+    # Файлы, доставленные до запуска демона
+    yield from _directory_files(directory)
+    while True:
+        for event in inotify.read(timeout=int(poll_interval * 1000)):
+            if event.name and not event.name.startswith('.'):
+                yield os.path.join(directory, event.name)
+
+
+def watch_directory(directory, poll_interval=1.0, use_inotify=True):
+    """Бесконечный генератор путей к файлам, полностью доставленным в каталог."""
+    if use_inotify and INotify is not None:
+        return _inotify_directory(directory, poll_interval)
+    return _poll_directory(directory, poll_interval)
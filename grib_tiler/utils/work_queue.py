@@ -0,0 +1,148 @@
+import json
+import os
+import pickle
+import sqlite3
+import time
+from urllib.parse import urlparse
+
+WORK_QUEUE_TIMEOUT = 60
+WORK_QUEUE_LEASE_SECONDS = 600
+WORK_QUEUE_MAX_ATTEMPTS = 3
+
+
+class SQLiteWorkQueue:
+    """Очередь пакетов задач тайлирования в файле SQLite на общей для узлов файловой системе.
+
+    Пакет (batch) — группа задач одного вида (см. render_batch), адресуемая заданием job и идентификатором пакета.
+    Исполнитель захватывает пакет на WORK_QUEUE_LEASE_SECONDS секунд: пакет исполнителя, не сообщившего
+    о завершении за это время, захватывается повторно. Завершённые пакеты хранят результаты рендеринга и не
+    отправляются повторно, что позволяет продолжить прерванное задание.
+    Журнал WAL не используется: он не работает на сетевых файловых системах.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        directory = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS jobs (job TEXT PRIMARY KEY, open INTEGER)')
+            connection.execute('CREATE TABLE IF NOT EXISTS batches (job TEXT, batch_id TEXT, kind TEXT, payload BLOB, '
+                               'state TEXT, worker TEXT, lease_until REAL, attempts INTEGER DEFAULT 0, '
+                               'results TEXT, error TEXT, PRIMARY KEY (job, batch_id))')
+            connection.execute('CREATE INDEX IF NOT EXISTS batches_state ON batches (state, lease_until)')
+
+    def _connect(self):
+        connection = sqlite3.connect(self.filename, timeout=WORK_QUEUE_TIMEOUT, isolation_level=None)
+        connection.execute('BEGIN IMMEDIATE')
+        return _Transaction(connection)
+
+    def submit(self, job, batches):
+        """Постановка пакетов (batch_id, вид, список задач) задания job в очередь.
+
+        Ранее завершённые пакеты с тем же идентификатором не изменяются, остальные заменяются новыми.
+        """
+        with self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO jobs (job, open) VALUES (?, 1)', (job,))
+            connection.executemany(
+                'INSERT INTO batches (job, batch_id, kind, payload, state) VALUES (?, ?, ?, ?, \'pending\') '
+                'ON CONFLICT (job, batch_id) DO UPDATE SET kind = excluded.kind, payload = excluded.payload, '
+                'state = \'pending\', worker = NULL, lease_until = NULL, attempts = 0, error = NULL '
+                'WHERE state != \'done\'',
+                [(job, batch_id, kind, pickle.dumps(tasks)) for batch_id, kind, tasks in batches])
+
+    def claim(self, worker):
+        """Захват следующего пакета открытого задания: (job, batch_id, вид, задачи) или None."""
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT batches.job, batch_id, kind, payload FROM batches JOIN jobs ON jobs.job = batches.job '
+                'WHERE jobs.open AND (state = \'pending\' OR (state = \'claimed\' AND lease_until < ?)) '
+                'ORDER BY batches.rowid LIMIT 1', (now,)).fetchone()
+            if row is None:
+                return None
+            job, batch_id, kind, payload = row
+            connection.execute('UPDATE batches SET state = \'claimed\', worker = ?, lease_until = ?, '
+                               'attempts = attempts + 1 WHERE job = ? AND batch_id = ?',
+                               (worker, now + WORK_QUEUE_LEASE_SECONDS, job, batch_id))
+        return job, batch_id, kind, pickle.loads(payload)
+
+    def complete(self, job, batch_id, results):
+        with self._connect() as connection:
+            connection.execute('UPDATE batches SET state = \'done\', results = ?, lease_until = NULL '
+                               'WHERE job = ? AND batch_id = ?', (json.dumps(results), job, batch_id))
+
+    def fail(self, job, batch_id, error):
+        """Ошибка пакета: пакет возвращается в очередь, после WORK_QUEUE_MAX_ATTEMPTS попыток — помечается
+        ошибочным."""
+        with self._connect() as connection:
+            connection.execute('UPDATE batches SET state = CASE WHEN attempts < ? THEN \'pending\' ELSE \'failed\' END, '
+                               'error = ?, lease_until = NULL WHERE job = ? AND batch_id = ?',
+                               (WORK_QUEUE_MAX_ATTEMPTS, error, job, batch_id))
+
+    def progress(self, job, batch_ids):
+        """Количество пакетов batch_ids задания по состояниям (pending, claimed, done, failed)."""
+        states = dict.fromkeys(('pending', 'claimed', 'done', 'failed'), 0)
+        with self._connect() as connection:
+            for state, count in connection.execute('SELECT state, COUNT(*) FROM batches WHERE job = ? '
+                                                   'GROUP BY state', (job,)):
+                states[state] = count
+            if sum(states.values()) != len(batch_ids):
+                # В задании остались пакеты прежних запусков: подсчёт только по текущим пакетам
+                states = dict.fromkeys(states, 0)
+                wanted = set(batch_ids)
+                for batch_id, state in connection.execute('SELECT batch_id, state FROM batches WHERE job = ?',
+                                                          (job,)):
+                    if batch_id in wanted:
+                        states[state] += 1
+        return states
+
+    def errors(self, job):
+        with self._connect() as connection:
+            return [error for error, in connection.execute('SELECT error FROM batches WHERE job = ? AND '
+                                                            'state = \'failed\'', (job,))]
+
+    def results(self, job, batch_ids):
+        """Результаты рендеринга завершённых пакетов batch_ids задания."""
+        wanted = set(batch_ids)
+        with self._connect() as connection:
+            rows = connection.execute('SELECT batch_id, results FROM batches WHERE job = ? AND state = \'done\'',
+                                      (job,)).fetchall()
+        for batch_id, results in rows:
+            if batch_id in wanted:
+                yield from json.loads(results)
+
+    def close(self, job):
+        """Закрытие задания: его пакеты больше не выдаются исполнителям."""
+        with self._connect() as connection:
+            connection.execute('UPDATE jobs SET open = 0 WHERE job = ?', (job,))
+
+
+class _Transaction:
+    """Соединение с открытой транзакцией BEGIN IMMEDIATE, фиксируемой (или откатываемой) при выходе из with."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.connection.close()
+
+
+WORK_QUEUES = {
+    'sqlite': SQLiteWorkQueue,
+    '': SQLiteWorkQueue
+}
+
+
+def open_work_queue(queue_url):
+    """Очередь задач по адресу: путь к файлу или sqlite:///путь (другие реализации регистрируются в WORK_QUEUES
+    по схеме адреса и предоставляют методы submit, claim, complete, fail, progress, errors, results, close)."""
+    parsed_url = urlparse(queue_url)
+    if parsed_url.scheme not in WORK_QUEUES:
+        raise ValueError(f'Неизвестный тип очереди задач: {parsed_url.scheme}')
+    return WORK_QUEUES[parsed_url.scheme](parsed_url.path if parsed_url.scheme else queue_url)
@@ -0,0 +1,86 @@
+import json
+import os
+import sys
+import tempfile
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from click import echo, command
+
+from grib_tiler.pipeline import tile_grib_files, batch_output_directory, batch_tiling_options, TilingContext
+from grib_tiler.utils import click_options, get_rfc3339nano_time
+from grib_tiler.utils.resources import worker_resources, create_pool
+from grib_tiler.utils.watch import ProcessedRegistry, watch_directory, is_grib_file, file_content_hash
+
+
+def tile_delivered_file(input_file, content_hash, output_directory, temp_root, registry, in_flight, pool,
+                        tiling_context, tiling_options):
+    file_output_directory = batch_output_directory(output_directory, input_file)
+    try:
+        echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(), "file": input_file,
+                         "msg": "Тайлирование поступившего файла..."}, ensure_ascii=False))
+        with tempfile.TemporaryDirectory(dir=temp_root) as temp_directory:
+            tile_grib_files([input_file], file_output_directory, temp_directory, pool=pool,
+                            tiling_context=tiling_context, **batch_tiling_options(tiling_options, input_file))
+        registry.add(content_hash, input_file)
+        echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(), "file": input_file,
+                         "msg": "Тайлирование поступившего файла... OK"}, ensure_ascii=False))
+    except Exception:
+        echo(json.dumps({"level": "error", "time": get_rfc3339nano_time(), "file": input_file,
+                         "msg": traceback.format_exc()}, ensure_ascii=False))
+    finally:
+        in_flight.discard(content_hash)
+
+
+@command(short_help='Демон тайлирования GRIB(2)-файлов, поступающих во входной каталог.')
+@click_options.watch_directory_arg
+@click_options.output_directory_arg
+@click_options.concurrency_opt
+@click_options.poll_interval_opt
+@click_options.polling_opt
+@click_options.daemon_state_opt
+@click_options.temp_root_opt
+@click_options.tiling_options
+def grib_tiler_daemon(watch_directory_name,
+                      output_directory,
+                      concurrency,
+                      poll_interval,
+                      force_polling,
+                      state_filename,
+                      temp_root,
+                      **tiling_options):
+    registry = ProcessedRegistry(state_filename or os.path.join(output_directory, '.grib_tiler_processed.json'))
+    in_flight = set()
+    tiling_context = TilingContext()
+    echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(),
+                     "msg": f"Ожидание входных файлов в каталоге {watch_directory_name}..."}, ensure_ascii=False))
+    tiling_options['threads'], _, gdal_options = worker_resources(tiling_options['threads'],
+                                                                  tiling_options['memory_budget'],
+                                                                  tiling_options['gdal_cachemax'],
+                                                                  tiling_options['gdal_threads'])
+    with create_pool(tiling_options['threads'], gdal_options) as pool, ThreadPoolExecutor(concurrency) as executor:
+        for input_file in watch_directory(watch_directory_name, poll_interval, use_inotify=not force_polling):
+            if not is_grib_file(input_file):
+                continue
+            try:
+                content_hash = file_content_hash(input_file)
+            except FileNotFoundError:
+                continue
+            if content_hash in registry or content_hash in in_flight:
+                echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(), "file": input_file,
+                                 "msg": "Файл уже обработан, пропуск"}, ensure_ascii=False))
+                continue
+            in_flight.add(content_hash)
+            executor.submit(tile_delivered_file, input_file, content_hash, output_directory, temp_root, registry,
+                            in_flight, pool, tiling_context, tiling_options)
+
+
+if __name__ == '__main__':
+    try:
+        grib_tiler_daemon()
+    except KeyboardInterrupt:
+        sys.exit()
+    except Exception as e:
+        echo(json.dumps({"level": "fatal", "time": get_rfc3339nano_time(), "msg": traceback.format_exc()},
+                        ensure_ascii=False))
+        sys.exit()
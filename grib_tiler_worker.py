@@ -0,0 +1,43 @@
+import json
+import os
+import socket
+import sys
+import traceback
+
+from click import echo, command
+
+from grib_tiler.utils import click_options, get_rfc3339nano_time
+
+
+@command(short_help='Исполнитель очереди задач распределённого тайлирования.')
+@click_options.work_queue_arg
+@click_options.threads_opt
+@click_options.poll_interval_opt
+@click_options.idle_timeout_opt
+@click_options.memory_budget_opt
+@click_options.gdal_cachemax_opt
+@click_options.gdal_threads_opt
+def grib_tiler_worker(work_queue, threads, poll_interval, idle_timeout, memory_budget, gdal_cachemax, gdal_threads):
+    from grib_tiler.tasks.executors import queue_worker
+    from grib_tiler.utils.resources import worker_resources, create_pool
+
+    threads, _, gdal_options = worker_resources(threads, memory_budget, gdal_cachemax, gdal_threads)
+    worker_name = f'{socket.gethostname()}:{os.getpid()}'
+    echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(), "worker": worker_name,
+                     "msg": f"Ожидание задач в очереди {work_queue}..."}, ensure_ascii=False))
+    with create_pool(threads, gdal_options) as pool:
+        rendered = sum(pool.map(queue_worker, [[work_queue, f'{worker_name}:{idx}', poll_interval, idle_timeout]
+                                               for idx in range(threads)]))
+    echo(json.dumps({"level": "info", "time": get_rfc3339nano_time(), "worker": worker_name,
+                     "msg": f"Нет задач в очереди, завершение. Отрендерено пакетов: {rendered}"}, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    try:
+        grib_tiler_worker()
+    except KeyboardInterrupt:
+        sys.exit()
+    except Exception as e:
+        echo(json.dumps({"level": "fatal", "time": get_rfc3339nano_time(), "msg": traceback.format_exc()},
+                        ensure_ascii=False))
+        sys.exit()
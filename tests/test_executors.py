@@ -0,0 +1,175 @@
+import io
+import os
+import subprocess
+import sys
+import textwrap
+
+import numpy
+import pytest
+import rasterio
+from PIL import Image
+from rasterio.transform import from_origin
+
+pytest.importorskip('rasterio.apps')
+
+from grib_tiler.tasks import RenderTileTask  # noqa: E402
+from grib_tiler.tasks.executors import encode_tile, read_image_tile, read_window, tile_block_hash, vrt_references, \
+    vrt_to_raster, windowed_translate  # noqa: E402
+
+
+def write_raster(filename, data, mask=None, nodata=None):
+    count, height, width = data.shape
+    with rasterio.open(filename, 'w', driver='GTiff', width=width, height=height, count=count, dtype=data.dtype,
+                       transform=from_origin(0, height, 1, 1), nodata=nodata) as output_rio:
+        output_rio.write(data)
+        if mask is not None:
+            output_rio.write_mask(mask)
+    return str(filename)
+
+
+def half_masked_byte_raster(filename, size=16):
+    """8-битный растр с внутренней маской: левая половина валидна, валидные пиксели содержат и 0."""
+    data = (numpy.arange(size * size).reshape(1, size, size) % 4).astype('uint8')
+    mask = numpy.zeros((size, size), dtype='uint8')
+    mask[:, :size // 2] = 255
+    return write_raster(filename, data, mask)
+
+
+def test_read_window_nodata_out_of_dtype_range(tmp_path):
+    filename = half_masked_byte_raster(tmp_path / 'byte.tiff')
+    # Окно на краю растра читается с заполнением; nodata не представимо в uint8
+    tile_data, tile_mask, band_count = read_window(filename, (-8, 0, 16, 16), 16, 16, nodata=-9999.0)
+    assert band_count == 1
+    assert tile_data.dtype == numpy.uint8
+    assert not tile_mask[:, :8].any()
+    assert (tile_mask[:, 8:] == 255).all()
+
+
+def test_read_window_keeps_dataset_mask_with_nodata(tmp_path):
+    filename = half_masked_byte_raster(tmp_path / 'byte.tiff')
+    _, tile_mask, _ = read_window(filename, (0, 0, 16, 16), 16, 16, nodata=0)
+    assert (tile_mask > 0).mean() == 0.5
+
+
+def test_read_window_nodata_without_dataset_mask(tmp_path):
+    data = numpy.ones((1, 16, 16), dtype='float32')
+    data[:, :4] = -9999.0
+    filename = write_raster(tmp_path / 'float.tiff', data)
+    _, tile_mask, _ = read_window(filename, (0, 0, 16, 16), 16, 16, nodata=-9999.0)
+    assert not tile_mask[:4].any()
+    assert (tile_mask[4:] == 255).all()
+
+
+def test_windowed_translate_copies_mask(tmp_path):
+    data = numpy.full((2, 64, 64), 7, dtype='uint8')
+    mask = numpy.zeros((64, 64), dtype='uint8')
+    mask[:32] = 255
+    filename = write_raster(tmp_path / 'masked.tiff', data, mask)
+    # Полосы по 16 строк
+    output_filename = windowed_translate(filename, str(tmp_path / 'raster.tiff'), memory_limit=64 * 3 * 2 * 16,
+                                         block_size=16)
+    with rasterio.open(output_filename) as output_rio:
+        assert output_rio.nodata is None
+        assert (output_rio.dataset_mask() > 0).mean() == 0.5
+        assert (output_rio.dataset_mask() == mask).all()
+        assert (output_rio.read() == data).all()
+
+
+def test_windowed_translate_memory_limit(tmp_path):
+    # Растр 2 × 8192 × 8192 байт (128 МиБ) при лимите 8 МиБ
+    filename = str(tmp_path / 'large.tiff')
+    with rasterio.open(filename, 'w', driver='GTiff', width=8192, height=8192, count=2, dtype='uint8',
+                       transform=from_origin(0, 8192, 1, 1), tiled=True) as output_rio:
+        for row_off in range(0, 8192, 512):
+            window = rasterio.windows.Window(0, row_off, 8192, 512)
+            output_rio.write(numpy.full((2, 512, 8192), row_off // 512, dtype='uint8'), window=window)
+    script = textwrap.dedent(f"""
+        import resource
+        import rasterio
+        from grib_tiler.tasks.executors import windowed_translate
+        with rasterio.open({filename!r}):
+            pass
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        windowed_translate({filename!r}, {str(tmp_path / 'raster.tiff')!r}, memory_limit=8 * 1024 * 1024)
+        print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before)
+    """)
+    # ru_maxrss в КиБ (Linux); кэш блоков GDAL ограничен, чтобы измерялись только буферы полос
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                            env=dict(os.environ, GDAL_CACHEMAX='8'))
+    rss_growth = int(result.stdout.split()[-1]) * 1024
+    assert rss_growth < 48 * 1024 * 1024
+    with rasterio.open(str(tmp_path / 'raster.tiff')) as output_rio:
+        assert output_rio.read(1, window=rasterio.windows.Window(0, 8191, 1, 1))[0, 0] == 15
+
+
+def test_vrt_to_raster_copies_source_masks(tmp_path):
+    mask = numpy.zeros((64, 64), dtype='uint8')
+    mask[:32] = 255
+    source_filenames = [write_raster(tmp_path / f'byte{band}.tiff', numpy.full((1, 64, 64), band, dtype='uint8'),
+                                     mask) for band in (1, 2)]
+    vrt_bands = ''.join(
+        f'<VRTRasterBand dataType="Byte" band="{band}"><SimpleSource>'
+        f'<SourceFilename relativeToVRT="0">{source_filename}</SourceFilename><SourceBand>1</SourceBand>'
+        f'<SrcRect xOff="0" yOff="0" xSize="64" ySize="64"/><DstRect xOff="0" yOff="0" xSize="64" ySize="64"/>'
+        f'</SimpleSource></VRTRasterBand>' for band, source_filename in enumerate(source_filenames, 1))
+    vrt_filename = tmp_path / 'concat.vrt'
+    vrt_filename.write_text(f'<VRTDataset rasterXSize="64" rasterYSize="64">'
+                            f'<GeoTransform>0, 1, 0, 64, 0, -1</GeoTransform>{vrt_bands}</VRTDataset>')
+    output_filename = vrt_to_raster([str(vrt_filename), str(tmp_path), None, 16, 'LZW', source_filenames])
+    with rasterio.open(output_filename) as output_rio:
+        assert (output_rio.dataset_mask() > 0).mean() == 0.5
+        assert (output_rio.read(2) == 2).all()
+
+
+def test_encode_two_band_tile_as_rgb_with_mask(tmp_path):
+    render_tile_task = RenderTileTask(None, str(tmp_path), 0, 0, 0, None, tilesize=4, image_format='PNG', bands=[1, 2])
+    tile_data = numpy.stack([numpy.full((4, 4), 10), numpy.full((4, 4), 200)]).astype('uint8')
+    tile_mask = numpy.zeros((4, 4), dtype='uint8')
+    tile_mask[:2] = 255
+    tile_bytes, _ = encode_tile(render_tile_task, tile_data, tile_mask, {})
+    image = Image.open(io.BytesIO(tile_bytes))
+    assert image.mode == 'RGB'
+    pixels = numpy.asarray(image)
+    assert (pixels[..., 0] == 10).all() and (pixels[..., 1] == 200).all()
+    assert (pixels[..., 2] == tile_mask).all()
+
+
+def test_webp_tile_transparency(tmp_path):
+    pytest.importorskip('rio_tiler')
+    data = numpy.full((1, 16, 16), 100, dtype='uint8')
+    mask = numpy.zeros((16, 16), dtype='uint8')
+    mask[:, :8] = 255
+    filename = write_raster(tmp_path / 'byte.tiff', data, mask)
+    render_tile_task = RenderTileTask(filename, str(tmp_path / 'tiles'), 0, 0, 0, None, tilesize=16,
+                                      image_format='WEBP', bands=[1], transparency_percent=50,
+                                      encoder_options={'lossless': True}, source_window=(0, 0, 16, 16))
+    tile_data, tile_mask, min_max_values = read_image_tile(render_tile_task)
+    tile_bytes, _ = encode_tile(render_tile_task, tile_data, tile_mask, min_max_values)
+    image = Image.open(io.BytesIO(tile_bytes))
+    assert image.mode == 'RGBA'
+    alpha = numpy.asarray(image)[..., 3]
+    assert (numpy.abs(alpha[:, :8].astype(int) - 128) <= 1).all()
+    assert not alpha[:, 8:].any()
+
+
+def test_tile_block_hash_covers_data_range_and_encoder_options():
+    tile_data = numpy.zeros((3, 4, 4), dtype='uint8')
+    tile_mask = numpy.full((4, 4), 255, dtype='uint8')
+
+    def block_hash(data_range=(0.0, 0.1), encoder_options=None):
+        return tile_block_hash(tile_data, tile_mask, {}, 'PNG', None, 'rgb24', data_range, encoder_options or {})
+
+    assert block_hash() == block_hash()
+    assert block_hash() != block_hash(data_range=(1.0, 0.1))
+    assert block_hash() != block_hash(data_range=(0.0, 0.2))
+    assert block_hash() != block_hash(encoder_options={'compress_level': 9})
+
+
+def test_vrt_references(tmp_path):
+    source_filename = write_raster(tmp_path / 'source.tiff', numpy.zeros((1, 8, 8), dtype='uint8'))
+    vrt_filename = tmp_path / 'extract.vrt'
+    vrt_filename.write_text(f'<VRTDataset rasterXSize="8" rasterYSize="8"><VRTRasterBand dataType="Byte" band="1">'
+                            f'<SimpleSource><SourceFilename relativeToVRT="0">{source_filename}</SourceFilename>'
+                            f'<SourceBand>1</SourceBand></SimpleSource></VRTRasterBand></VRTDataset>')
+    assert vrt_references(str(vrt_filename), source_filename)
+    assert not vrt_references(str(vrt_filename), str(tmp_path / 'moved.tiff'))
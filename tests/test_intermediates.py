@@ -0,0 +1,15 @@
+from grib_tiler.utils.intermediates import intermediate_filename
+
+
+def test_input_files_are_keyed_by_content(tmp_path):
+    (tmp_path / 'delivered').mkdir()
+    (tmp_path / 'redelivered').mkdir()
+    (tmp_path / 'delivered' / 'input.grib2').write_bytes(b'GRIB' + bytes(64))
+    (tmp_path / 'redelivered' / 'copy.grib2').write_bytes(b'GRIB' + bytes(64))
+    (tmp_path / 'other.grib2').write_bytes(b'GRIB' + bytes(63) + b'\x01')
+
+    def extract_filename(input_filename):
+        return intermediate_filename(str(tmp_path), 'extract', [str(tmp_path / input_filename)], [1], '.vrt')
+
+    assert extract_filename('delivered/input.grib2') == extract_filename('redelivered/copy.grib2')
+    assert extract_filename('delivered/input.grib2') != extract_filename('other.grib2')
@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+pytest.importorskip('rasterio.apps')
+
+from grib_tiler.pipeline import batch_output_directory, batch_tiling_options  # noqa: E402
+
+
+def test_batch_delta_directory_matches_file_output_root(tmp_path):
+    input_file = str(tmp_path / 'HTWE95 EGRR 221200')
+    tiling_options = {'delta_directory': str(tmp_path / 'previous'), 'zooms_list': '0,1'}
+    file_tiling_options = batch_tiling_options(tiling_options, input_file)
+    output_directory = batch_output_directory(str(tmp_path / 'current'), input_file)
+    band_output_directory = os.path.join(output_directory, '1')
+    assert os.path.join(file_tiling_options['delta_directory'],
+                        os.path.relpath(band_output_directory, output_directory)) == \
+        os.path.join(str(tmp_path), 'previous', 'HTWE95_EGRR_221200', '1')
+    assert file_tiling_options['zooms_list'] == '0,1'
+    assert tiling_options['delta_directory'] == str(tmp_path / 'previous')
+
+
+def test_batch_tiling_options_without_delta(tmp_path):
+    tiling_options = {'delta_directory': None}
+    assert batch_tiling_options(tiling_options, str(tmp_path / 'input.grib2')) is tiling_options
@@ -0,0 +1,73 @@
+import os
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from grib_tiler.utils.remote import RemoteFile
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Раздача файлов с поддержкой Range-запросов вида bytes=start-end."""
+
+    def do_GET(self):
+        range_header = self.headers.get('Range')
+        if not self.server.ranges or not range_header:
+            return super().do_GET()
+        with open(self.translate_path(self.path), 'rb') as input_fp:
+            data = input_fp.read()
+            modified = os.fstat(input_fp.fileno()).st_mtime
+        start, end = (int(value) for value in range_header.split('=', 1)[1].split('-'))
+        end = min(end, len(data) - 1)
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Last-Modified', self.date_time_string(modified))
+        self.end_headers()
+        self.wfile.write(data[start:end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(params=[True, False], ids=['ranges', 'no-ranges'])
+def http_directory(request, tmp_path):
+    served_directory = tmp_path / 'served'
+    served_directory.mkdir()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(RangeRequestHandler, directory=str(served_directory)))
+    server.ranges = request.param
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield served_directory, f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_materialise_streams_blocks(http_directory, tmp_path):
+    served_directory, base_url = http_directory
+    content = os.urandom(10 * 1024 + 7)
+    (served_directory / 'input.grib2').write_bytes(content)
+    remote_file = RemoteFile(f'{base_url}/input.grib2', str(tmp_path / 'cache'), block_size=1024)
+    assert remote_file.size == len(content)
+    with open(remote_file.materialise(), 'rb') as local_fp:
+        assert local_fp.read() == content
+    assert remote_file.fetched_bytes == len(content)
+    block_sizes = [os.path.getsize(os.path.join(remote_file.cache_directory, f'{block_index}.block'))
+                   for block_index in range(11)]
+    assert block_sizes == [1024] * 10 + [7]
+
+
+def test_cache_key_follows_last_modified(http_directory, tmp_path):
+    served_directory, base_url = http_directory
+    input_filename = served_directory / 'input.grib2'
+    input_filename.write_bytes(b'a' * 100)
+    os.utime(input_filename, (1_000_000_000, 1_000_000_000))
+    first_remote_file = RemoteFile(f'{base_url}/input.grib2', str(tmp_path / 'cache'))
+    # Файл заменён файлом того же размера
+    input_filename.write_bytes(b'b' * 100)
+    os.utime(input_filename, (1_000_000_100, 1_000_000_100))
+    second_remote_file = RemoteFile(f'{base_url}/input.grib2', str(tmp_path / 'cache'))
+    assert first_remote_file.cache_directory != second_remote_file.cache_directory
+    with open(second_remote_file.materialise(), 'rb') as local_fp:
+        assert local_fp.read() == b'b' * 100
@@ -0,0 +1,83 @@
+import os
+
+import numpy
+import rasterio
+from rasterio.transform import from_origin
+
+from grib_tiler.tasks import warp_maps
+from grib_tiler.data.tms import load_tile_grid
+from grib_tiler.tasks.warp_maps import WARP_SOURCE_CACHE_SIZE, WarpSource, compute_warp_map, expand_warp_map, \
+    load_warp_map, load_warp_source, publish_warp_source, unpublish_warp_source
+
+
+def write_raster(filename, value):
+    with rasterio.open(filename, 'w', driver='GTiff', width=8, height=8, count=1, dtype='uint8',
+                       transform=from_origin(0, 8, 1, 1), crs='EPSG:4326') as output_rio:
+        output_rio.write(numpy.full((1, 8, 8), value, dtype='uint8'))
+    return str(filename)
+
+
+def test_load_warp_source_reopens_replaced_files(tmp_path):
+    filename = write_raster(tmp_path / 'source.tiff', 1)
+    warp_source = load_warp_source(filename)
+    assert load_warp_source(filename) is warp_source
+    # Следующий запуск пересоздаёт промежуточный файл с тем же именем
+    os.remove(filename)
+    write_raster(filename, 2)
+    reopened_warp_source = load_warp_source(filename)
+    assert reopened_warp_source is not warp_source
+    assert warp_source.dataset.closed
+    assert reopened_warp_source.data[0, 0, 0] == 2
+
+
+def test_load_warp_source_is_bounded(tmp_path):
+    filenames = [write_raster(tmp_path / f'source{idx}.tiff', idx) for idx in range(WARP_SOURCE_CACHE_SIZE + 2)]
+    warp_sources = [load_warp_source(filename) for filename in filenames]
+    assert len(warp_maps._warp_sources) <= WARP_SOURCE_CACHE_SIZE
+    assert warp_sources[0].dataset.closed
+    assert not warp_sources[-1].dataset.closed
+
+
+def global_signature(width=360, height=181):
+    with rasterio.open('/vsimem/global.tiff', 'w', driver='GTiff', width=width, height=height, count=1,
+                       dtype='uint8', transform=from_origin(-180.5, 90.5, 1, 1), crs='EPSG:4326') as output_rio:
+        return warp_maps._dataset_signature(output_rio)
+
+
+def test_compute_warp_map_separable():
+    signature = global_signature()
+    warp_map = compute_warp_map('EPSG:3857', 3, 5, 2, 256, signature)
+    assert warp_map.shape == (2, 256)
+    # Разделимая карта совпадает с вычисленной для каждого пикселя тайла
+    left, bottom, right, top = load_tile_grid('EPSG:3857', 256).bounds(3, 5, 2)
+    xs = left + (numpy.arange(256) + 0.5) * ((right - left) / 256)
+    ys = top - (numpy.arange(256) + 0.5) * ((top - bottom) / 256)
+    dense_cols, dense_rows = warp_maps._source_pixels('EPSG:3857', signature, *numpy.meshgrid(xs, ys))
+    cols, rows = expand_warp_map(warp_map)
+    assert numpy.abs(cols - dense_cols).max() < 1e-3
+    assert numpy.abs(rows - dense_rows).max() < 1e-3
+
+
+def test_load_warp_map_stores_only_intersecting_tiles(tmp_path):
+    # Сетка покрывает только северо-западную четверть
+    with rasterio.open('/vsimem/quarter.tiff', 'w', driver='GTiff', width=180, height=90, count=1, dtype='uint8',
+                       transform=from_origin(-180, 90, 1, 1), crs='EPSG:4326') as output_rio:
+        signature = warp_maps._dataset_signature(output_rio)
+    key = warp_maps.warp_map_key(signature, 'EPSG:3857', 256)
+    cols, rows = load_warp_map(str(tmp_path), 'EPSG:3857', 1, 0, 0, 256, signature)
+    assert cols.shape == rows.shape == (256, 256)
+    assert os.path.exists(warp_maps.warp_map_filename(str(tmp_path), key, 1, 0, 0))
+    load_warp_map(str(tmp_path), 'EPSG:3857', 1, 1, 1, 256, signature)
+    assert not os.path.exists(warp_maps.warp_map_filename(str(tmp_path), key, 1, 1, 1))
+
+
+def test_published_source_is_memory_mapped(tmp_path):
+    filename = write_raster(tmp_path / 'source.tiff', 3)
+    warp_map_directory = str(tmp_path / 'warp-cache')
+    data_filename, valid_filename = publish_warp_source(warp_map_directory, filename)
+    assert os.path.dirname(data_filename) == os.path.join(warp_map_directory, 'sources')
+    warp_source = WarpSource(filename, warp_map_directory=warp_map_directory)
+    assert isinstance(warp_source.data, numpy.memmap) and warp_source.data[0, 0, 0] == 3
+    warp_source.close()
+    unpublish_warp_source(warp_map_directory, filename)
+    assert not os.path.exists(data_filename) and not os.path.exists(valid_filename)
@@ -0,0 +1,96 @@
+import multiprocessing
+from functools import partial
+
+import pytest
+
+from grib_tiler.utils import work_queue
+from grib_tiler.utils.work_queue import WORK_QUEUE_LEASE_SECONDS, WORK_QUEUE_MAX_ATTEMPTS, SQLiteWorkQueue, \
+    open_work_queue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return SQLiteWorkQueue(str(tmp_path / 'queue.sqlite'))
+
+
+def test_submit_claim_complete_results(queue):
+    queue.submit('job', [('b1', 'tiles', [1, 2]), ('b2', 'metatile', [3])])
+    assert queue.claim('w1') == ('job', 'b1', 'tiles', [1, 2])
+    assert queue.claim('w2') == ('job', 'b2', 'metatile', [3])
+    assert queue.claim('w3') is None
+    queue.complete('job', 'b1', [['tile', 1], ['tile', 2]])
+    assert queue.progress('job', ['b1', 'b2']) == {'pending': 0, 'claimed': 1, 'done': 1, 'failed': 0}
+    queue.complete('job', 'b2', [['tile', 3]])
+    assert list(queue.results('job', ['b1', 'b2'])) == [['tile', 1], ['tile', 2], ['tile', 3]]
+    assert list(queue.results('job', ['b2'])) == [['tile', 3]]
+
+
+def test_fail_retries_then_fails(queue):
+    queue.submit('job', [('b1', 'tiles', [1])])
+    for attempt in range(1, WORK_QUEUE_MAX_ATTEMPTS + 1):
+        assert queue.claim('w1')[1] == 'b1'
+        queue.fail('job', 'b1', f'error {attempt}')
+        expected_state = 'failed' if attempt == WORK_QUEUE_MAX_ATTEMPTS else 'pending'
+        assert queue.progress('job', ['b1'])[expected_state] == 1
+    assert queue.claim('w1') is None
+    assert queue.errors('job') == [f'error {WORK_QUEUE_MAX_ATTEMPTS}']
+
+
+def test_expired_lease_is_claimed_again(queue, monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(work_queue.time, 'time', lambda: now)
+    queue.submit('job', [('b1', 'tiles', [1])])
+    assert queue.claim('w1')[1] == 'b1'
+    assert queue.claim('w2') is None
+    now += WORK_QUEUE_LEASE_SECONDS + 1
+    assert queue.claim('w2')[1] == 'b1'
+
+
+def test_resubmitted_job_skips_done_batches(queue):
+    queue.submit('job', [('b1', 'tiles', [1]), ('b2', 'tiles', [2])])
+    queue.claim('w1')
+    queue.complete('job', 'b1', [['tile', 1]])
+    queue.claim('w1')
+    # Прерванное задание отправляется повторно: захваченный пакет возвращается в очередь, завершённый — нет
+    queue.submit('job', [('b1', 'tiles', [1]), ('b2', 'tiles', [2])])
+    assert queue.claim('w2') == ('job', 'b2', 'tiles', [2])
+    assert queue.claim('w2') is None
+    assert list(queue.results('job', ['b1'])) == [['tile', 1]]
+
+
+def test_closed_job_is_not_claimed(queue):
+    queue.submit('job', [('b1', 'tiles', [1])])
+    queue.close('job')
+    assert queue.claim('w1') is None
+
+
+def logged_render_batch(log_filename, args):
+    kind, render_tile_tasks = args
+    with open(log_filename, 'a') as log_fp:
+        log_fp.write(f'{render_tile_tasks[0]}\n')
+    return [[kind, render_tile_task] for render_tile_task in render_tile_tasks]
+
+
+def test_queue_workers_render_each_batch_once(tmp_path, monkeypatch):
+    pytest.importorskip('rasterio.apps')
+    from grib_tiler.tasks import executors
+
+    log_filename = str(tmp_path / 'rendered.log')
+    monkeypatch.setattr(executors, 'render_batch', partial(logged_render_batch, log_filename))
+    queue_url = f'sqlite://{tmp_path}/queue.sqlite'
+    batch_ids = [f'b{batch_index}' for batch_index in range(40)]
+    open_work_queue(queue_url).submit('job', [(batch_id, 'tiles', [batch_id]) for batch_id in batch_ids])
+    # Исполнители наследуют подменённый render_batch при fork
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=executors.queue_worker, args=([queue_url, f'w{worker}', 0.01, 0.5],))
+               for worker in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+    with open(log_filename) as log_fp:
+        rendered = log_fp.read().split()
+    assert sorted(rendered) == sorted(batch_ids)
+    assert open_work_queue(queue_url).progress('job', batch_ids)['done'] == len(batch_ids)
+    assert sorted(result[1] for result in open_work_queue(queue_url).results('job', batch_ids)) == sorted(batch_ids)